@@ -1,11 +1,17 @@
 # plugins/astrbot_stock_market/api.py
 
-from typing import Optional, Dict, Any, List, TYPE_CHECKING
+import asyncio
+from typing import Optional, Dict, Any, List, Callable, Awaitable, TYPE_CHECKING
+
+from astrbot.api import logger
+from .config_defaults import TICK_FEED_QUEUE_SIZE
 
 # 仅用于类型提示，避免循环导入
 if TYPE_CHECKING:
     from .main import StockMarketRefactored
 
+TickCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
 class StockMarketAPI:
     """
     模拟炒股插件对外暴露的API。
@@ -13,6 +19,9 @@ class StockMarketAPI:
     """
     def __init__(self, plugin_instance: "StockMarketRefactored"):
         self._plugin = plugin_instance
+        # 行情订阅者: 队列订阅者 和 回调订阅者 (回调 -> 上一次尚未结束的分发任务)
+        self._tick_queues: List[asyncio.Queue] = []
+        self._tick_callbacks: Dict[TickCallback, Optional[asyncio.Task]] = {}
 
     async def register_stock(self, ticker: str, company_name: str, initial_price: float, total_shares: int, owner_id: str) -> bool:
         return await self._plugin.api_register_stock(ticker, company_name, initial_price, total_shares, owner_id)
@@ -42,4 +51,60 @@ class StockMarketAPI:
         return await self._plugin.get_user_total_asset(user_id)
 
     async def get_total_asset_ranking(self, limit: int = 10) -> List[Dict[str, Any]]:
-        return await self._plugin.get_total_asset_ranking(limit)
\ No newline at end of file
+        return await self._plugin.get_total_asset_ranking(limit)
+
+    # --- 行情订阅 ---
+    def subscribe_ticks(self, callback: Optional[TickCallback] = None) -> Optional[asyncio.Queue]:
+        """
+        订阅每个 tick 的行情增量，代替轮询 get_stock_price。
+        传入 async 回调时，每次 tick 落库后都会以增量字典调用它；
+        不传回调时返回一个 asyncio.Queue，由调用方自行消费。
+        增量格式:
+            {"tick": int, "timestamp": str,
+             "prices": {stock_id: price},            # 本 tick 价格有变化的股票
+             "klines": {stock_id: [open, high, low, close]},
+             "events": [{"stock_id": str, "message": str}],
+             "index": {"avg_change_percent": float}, # 全市场相对昨收的平均涨跌幅
+             "market": {"cycle": str, "volatility_regime": str}}
+        消费过慢的订阅者 (队列积压满 / 上一次回调仍未结束) 会被自动移除，不会拖慢 tick。
+        """
+        if callback is not None:
+            self._tick_callbacks[callback] = None
+            return None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=TICK_FEED_QUEUE_SIZE)
+        self._tick_queues.append(queue)
+        return queue
+
+    def unsubscribe_ticks(self, subscriber) -> None:
+        """取消订阅，参数为 subscribe_ticks 时传入的回调或返回的队列。"""
+        if subscriber in self._tick_queues:
+            self._tick_queues.remove(subscriber)
+            return
+        task = self._tick_callbacks.pop(subscriber, None)
+        if task and not task.done():
+            task.cancel()
+
+    def publish_tick(self, delta: Dict[str, Any]) -> None:
+        """[内部] 由模拟循环在 tick 落库后调用。只做非阻塞投递，从不等待订阅者。"""
+        for queue in list(self._tick_queues):
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                self._tick_queues.remove(queue)
+                logger.warning("行情订阅队列积压已满，该订阅者处理过慢，已被移除。")
+
+        for callback, pending in list(self._tick_callbacks.items()):
+            if pending is not None and not pending.done():
+                pending.cancel()
+                del self._tick_callbacks[callback]
+                logger.warning(f"行情订阅回调 {getattr(callback, '__qualname__', callback)} 上一次尚未处理完，已被移除。")
+                continue
+            self._tick_callbacks[callback] = asyncio.create_task(self._dispatch_tick(callback, delta))
+
+    async def _dispatch_tick(self, callback: TickCallback, delta: Dict[str, Any]):
+        try:
+            await callback(delta)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"行情订阅回调执行出错: {e}", exc_info=True)
@@ -0,0 +1,93 @@
+# stock_market/backup.py
+
+import glob
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from astrbot.api import logger
+
+# 分步备份被源库写入打断 (SQLite 会从头重新开始) 的次数超过该值后，改为一次性复制整个库。
+# WAL 模式下一次性复制只持有读快照，不会阻塞 tick 落库和交易提交
+MAX_STEP_RESTARTS = 3
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy_online(src_path: str, dest_path: str, pages: int, sleep: float) -> Dict[str, float]:
+    """用 SQLite 在线备份 API 分步复制，每步 pages 页，步与步之间休眠 sleep 秒释放读锁。"""
+    stats = {'steps': 0, 'restarts': 0, 'pages': 0}
+    last_remaining: Optional[int] = None
+
+    def on_progress(status, remaining, total):
+        nonlocal last_remaining
+        stats['steps'] += 1
+        stats['pages'] = total
+        # 剩余页数不降反升，说明源库在两步之间被其他连接修改，备份已从头开始
+        if last_remaining is not None and remaining > last_remaining:
+            stats['restarts'] += 1
+            if stats['restarts'] > MAX_STEP_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    with closing(sqlite3.connect(src_path)) as src, closing(sqlite3.connect(dest_path)) as dest:
+        try:
+            src.backup(dest, pages=pages, progress=on_progress, sleep=sleep)
+        except _TooManyRestarts:
+            logger.info(f"[数据库备份] {os.path.basename(src_path)} 写入频繁，改为一次性复制。")
+            src.backup(dest, pages=-1)
+    return stats
+
+
+def _integrity_ok(path: str) -> bool:
+    with closing(sqlite3.connect(path)) as conn:
+        result = conn.execute("PRAGMA integrity_check").fetchone()
+    return bool(result) and result[0] == 'ok'
+
+
+def _rotate(backup_dir: str, name: str, keep: int) -> List[str]:
+    """只保留最新的 keep 份备份，返回被删除的文件。"""
+    files = sorted(glob.glob(os.path.join(backup_dir, f"{name}-*.db")))
+    expired = files[:-keep] if keep > 0 else []
+    for path in expired:
+        os.remove(path)
+    return expired
+
+
+def backup_database(src_path: str, backup_dir: str, keep: int, pages: int, sleep: float) -> Dict[str, object]:
+    """
+    [同步，应在工作线程中调用] 在线备份一个 SQLite 数据库到 backup_dir，校验完整性后轮换旧备份。
+    先写入 .tmp 文件，校验通过才改名为 <库名>-<时间>.db，因此目录中的 .db 备份总是完整可用的。
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(src_path))[0]
+    final_path = os.path.join(backup_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    tmp_path = final_path + ".tmp"
+    started = time.perf_counter()
+    try:
+        stats = _copy_online(src_path, tmp_path, pages, sleep)
+        copy_seconds = time.perf_counter() - started
+        if not _integrity_ok(tmp_path):
+            raise RuntimeError(f"备份文件 {tmp_path} 未通过 integrity_check")
+        os.replace(tmp_path, final_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    expired = _rotate(backup_dir, name, keep)
+    result = {
+        'path': final_path,
+        'size_mb': round(os.path.getsize(final_path) / 1024 / 1024, 2),
+        'copy_seconds': round(copy_seconds, 2),
+        'total_seconds': round(time.perf_counter() - started, 2),
+        'steps': stats['steps'],
+        'restarts': stats['restarts'],
+        'rotated': len(expired),
+    }
+    logger.info(f"[数据库备份] {name}: {result}")
+    return result
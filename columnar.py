@@ -0,0 +1,182 @@
+# stock_market/columnar.py
+
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖，未安装时列式导入导出不可用
+    pa = None
+
+from astrbot.api import logger
+from .database import KLINE_TABLES
+
+# 进度回调: (已完成分区数, 总分区数, 描述)
+ProgressCallback = Callable[[int, int, str], None]
+
+FILE_SUFFIXES = {'parquet': '.parquet', 'arrow': '.arrow'}
+IMPORT_BATCH_SIZE = 50000
+
+
+def ensure_available():
+    if pa is None:
+        raise RuntimeError("未安装 pyarrow，无法使用列式导入导出。请先执行 pip install pyarrow")
+
+
+def _write_table(table: "pa.Table", path: str, fmt: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == 'parquet':
+        pq.write_table(table, path, compression='zstd')
+    else:
+        with pa_ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_table(path: str) -> "pa.Table":
+    if path.endswith('.parquet'):
+        return pq.read_table(path)
+    with pa_ipc.open_file(path) as reader:
+        return reader.read_all()
+
+
+def _query_table(conn: sqlite3.Connection, query: str, params: tuple = ()) -> "pa.Table":
+    cursor = conn.execute(query, params)
+    names = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    columns = list(zip(*rows)) if rows else [[] for _ in names]
+    return pa.table({name: pa.array(col) for name, col in zip(names, columns)})
+
+
+def _month_ranges(min_ts: int, max_ts: int) -> List[Tuple[str, int, int]]:
+    """按本地自然月切分 [min_ts, max_ts]，返回 (YYYY-MM, 起始ts, 结束ts)。"""
+    ranges = []
+    current = datetime.fromtimestamp(min_ts).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while int(current.timestamp()) <= max_ts:
+        following = current.replace(year=current.year + 1, month=1) if current.month == 12 else current.replace(month=current.month + 1)
+        ranges.append((current.strftime('%Y-%m'), int(current.timestamp()), int(following.timestamp())))
+        current = following
+    return ranges
+
+
+def export_market_history(db_path: str, ledger_db_path: str, output_dir: str, fmt: str = 'parquet',
+                          progress: Optional[ProgressCallback] = None) -> Dict[str, int]:
+    """
+    [同步，应在工作线程中调用] 将股票、持仓和全部K线表导出为列式文件。
+    K线按 <表名>/stock_id=<代码>/month=<YYYY-MM>/part<后缀> 分区。返回各部分导出的行数。
+    """
+    ensure_available()
+    suffix = FILE_SUFFIXES[fmt]
+    counts: Dict[str, int] = {}
+    started = time.perf_counter()
+    with closing(sqlite3.connect(db_path)) as conn, closing(sqlite3.connect(ledger_db_path)) as ledger:
+        stocks = _query_table(conn, "SELECT * FROM stocks ORDER BY stock_key")
+        _write_table(stocks, os.path.join(output_dir, f"stocks{suffix}"), fmt)
+        counts['stocks'] = stocks.num_rows
+        holdings = _query_table(ledger, "SELECT * FROM holdings ORDER BY holding_id")
+        _write_table(holdings, os.path.join(output_dir, f"holdings{suffix}"), fmt)
+        counts['holdings'] = holdings.num_rows
+
+        partitions = []
+        for table in KLINE_TABLES.values():
+            bounds = conn.execute(
+                f"SELECT s.stock_id, k.stock_key, MIN(k.ts), MAX(k.ts) FROM {table} k "
+                f"JOIN stocks s ON s.stock_key = k.stock_key GROUP BY k.stock_key").fetchall()
+            for stock_id, stock_key, min_ts, max_ts in bounds:
+                for month, start_ts, end_ts in _month_ranges(min_ts, max_ts):
+                    partitions.append((table, stock_id, stock_key, month, start_ts, end_ts))
+
+        for done, (table, stock_id, stock_key, month, start_ts, end_ts) in enumerate(partitions, 1):
+            part = _query_table(
+                conn, f"SELECT ts, open, high, low, close FROM {table} WHERE stock_key = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (stock_key, start_ts, end_ts))
+            if part.num_rows:
+                path = os.path.join(output_dir, table, f"stock_id={stock_id}", f"month={month}", f"part{suffix}")
+                _write_table(part, path, fmt)
+                counts[table] = counts.get(table, 0) + part.num_rows
+            if progress:
+                progress(done, len(partitions), f"{table} {stock_id} {month}")
+
+    logger.info(f"[列式导出] 完成，用时 {time.perf_counter() - started:.1f} 秒: {counts}")
+    return counts
+
+
+def _find_input(input_dir: str, name: str) -> Optional[str]:
+    for suffix in FILE_SUFFIXES.values():
+        path = os.path.join(input_dir, name + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_holdings(input_dir: str) -> Optional[Tuple[List[str], List[tuple]]]:
+    """
+    [同步，应在工作线程中调用] 读取导出目录中的持仓批次，返回 (列名, 行)；没有持仓文件时返回 None。
+    写入账本需经过 DatabaseManager.import_holdings，与交易共用持仓锁。
+    """
+    ensure_available()
+    holdings_path = _find_input(input_dir, "holdings")
+    if not holdings_path:
+        return None
+    holdings = _read_table(holdings_path)
+    names = holdings.column_names
+    return names, list(zip(*(holdings.column(n).to_pylist() for n in names)))
+
+
+def import_market_history(db_path: str, input_dir: str, progress: Optional[ProgressCallback] = None) -> Dict[str, int]:
+    """
+    [同步，应在工作线程中调用] 从 export_market_history 生成的目录批量导入股票与K线 (持仓见 read_holdings)。
+    股票按 stock_id 合并 (已存在的保留原 stock_key)，K线按目标库的 stock_key 写入，已有的同一时间点被覆盖。
+    """
+    ensure_available()
+    counts: Dict[str, int] = {}
+    started = time.perf_counter()
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        stocks_path = _find_input(input_dir, "stocks")
+        if stocks_path:
+            stocks = _read_table(stocks_path).to_pylist()
+            for row in stocks:
+                row.pop('stock_key', None)
+                columns = ", ".join(row)
+                conn.execute(
+                    f"INSERT OR IGNORE INTO stocks ({columns}, stock_key) VALUES ({', '.join('?' for _ in row)}, "
+                    f"(SELECT COALESCE(MAX(stock_key), 0) + 1 FROM stocks))", tuple(row.values()))
+            conn.commit()
+            counts['stocks'] = len(stocks)
+        stock_keys = dict(conn.execute("SELECT stock_id, stock_key FROM stocks").fetchall())
+
+        partitions = []
+        for table in KLINE_TABLES.values():
+            table_dir = os.path.join(input_dir, table)
+            if not os.path.isdir(table_dir):
+                continue
+            for root, _, files in os.walk(table_dir):
+                partitions.extend((table, os.path.join(root, f)) for f in files if f.endswith(tuple(FILE_SUFFIXES.values())))
+
+        for done, (table, path) in enumerate(sorted(partitions), 1):
+            stock_dir = next(p for p in path.split(os.sep) if p.startswith("stock_id="))
+            stock_id = stock_dir.split("=", 1)[1]
+            stock_key = stock_keys.get(stock_id)
+            if stock_key is None:
+                logger.warning(f"[列式导入] 目标库中没有股票 {stock_id}，跳过 {path}")
+                continue
+            part = _read_table(path)
+            columns = [part.column(n).to_pylist() for n in ('ts', 'open', 'high', 'low', 'close')]
+            rows = [(stock_key, *r) for r in zip(*columns)]
+            for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} (stock_key, ts, open, high, low, close) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows[i:i + IMPORT_BATCH_SIZE])
+            conn.commit()
+            counts[table] = counts.get(table, 0) + len(rows)
+            if progress:
+                progress(done, len(partitions), f"{table} {stock_id}")
+
+    logger.info(f"[列式导入] 完成，用时 {time.perf_counter() - started:.1f} 秒: {counts}")
+    return counts
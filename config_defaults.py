@@ -0,0 +1,62 @@
+# stock_market/config_defaults.py
+
+# 可选设置的默认值。config.py 中定义的同名变量会覆盖这里的值 (见文件末尾)，
+# 因此旧版 config.py 不需要补全这些设置即可升级。
+import os
+
+from .config import DATA_DIR
+
+# --- Web服务 ---
+RATE_LIMIT_MAX_KEYS = 100000  # 限流状态最多记录的 (规则, IP/用户) 数，超出按最久未访问淘汰
+JWT_CACHE_MAX_ENTRIES = 10000  # 已验证Token缓存的条目上限
+PASSWORD_HASH_WORKERS = 2        # 执行 bcrypt 哈希/校验的线程数
+PASSWORD_HASH_MAX_PENDING = 32   # 执行中加排队的上限，超出时登录/注册直接返回 503
+
+# --- 启动加载 ---
+STARTUP_KLINE_PRELOAD = 288  # 启动时同步加载的K线根数 (24小时)，其余历史在后台补全
+
+# --- 行情推送 (供其他插件订阅) ---
+TICK_FEED_QUEUE_SIZE = 32  # 队列订阅者最多积压的 tick 数，超出即视为过慢并被移除
+# 图表页 WebSocket 推送 (/ws/ticks)
+WS_MAX_CLIENTS = 1000          # 同时在线的推送连接上限
+WS_MAX_SUBSCRIPTIONS = 50      # 每个连接最多订阅的股票数
+WS_SEND_TIMEOUT_SECONDS = 5    # 单个连接发送超时，超时即断开 (客户端会重连)
+# 公共行情接口的响应缓存 (每次 tick 后整体失效)
+RESPONSE_CACHE_MAX_ENTRIES = 512        # 最多缓存的 (接口, 参数) 组合数
+RESPONSE_CACHE_MIN_COMPRESS_BYTES = 1024  # 小于该大小的响应不预压缩
+# 公开的K线导出接口 (/api/v1/export/kline) 单次最多导出的K线根数 (按股票数 × 区间内周期数估算)；
+# 完整历史请使用管理员指令 /导出K线 或 /导出行情
+EXPORT_MAX_ROWS = 200000
+# K线降采样 (按根数分桶合并为 OHLC，保留桶内高低点)
+KLINE_CHART_MAX_CANDLES = 240  # /k线 图片中最多绘制的蜡烛数
+
+# --- 成交流水 ---
+TRADE_LEDGER_FLUSH_SECONDS = 2   # 成交记录攒批写入数据库的间隔
+TRADE_LEDGER_BATCH_SIZE = 200    # 缓冲区达到该条数时立即写入
+
+# --- 后台维护任务 ---
+HOLDINGS_CONSOLIDATION_INTERVAL_MINUTES = 30  # 合并已解锁碎片持仓的周期
+HOLDINGS_CONSOLIDATION_BATCH_SIZE = 200       # 每批合并的 (用户, 股票) 组数
+# K线保留策略 (在休市时段执行)：5分钟K线保留期满后汇总为小时K和日K，再分批删除
+KLINE_RAW_RETENTION_DAYS = 35       # 5分钟K线保留天数 (需覆盖内存中的 9000 根K线)
+KLINE_HOURLY_RETENTION_DAYS = 400   # 小时K保留天数，日K永久保留
+KLINE_PRUNE_BATCH_SIZE = 5000       # 每批删除的行数
+KLINE_ROLLUP_WINDOW_DAYS = 7        # 汇总过期5分钟K线时每批覆盖的天数 (每批单独提交)
+KLINE_MIGRATION_CHUNK_SIZE = 50000  # 旧版K线表迁移到紧凑表时每批复制的行数
+# 在线备份 (SQLite 备份API，分步复制，不阻塞写入)
+BACKUP_DIR = os.path.join(DATA_DIR, "backups")
+BACKUP_INTERVAL_HOURS = 6     # 自动备份行情库和账本库的周期
+BACKUP_KEEP = 8               # 每个库保留的备份份数
+BACKUP_STEP_PAGES = 1024      # 每步复制的页数 (默认页大小下约 4MB)
+BACKUP_STEP_SLEEP = 0.005     # 两步之间的休眠秒数，期间释放源库读锁
+
+# --- 行情数据写后队列 ---
+PERSIST_MAX_PENDING_KLINES = 100000  # 数据库不可用时最多缓存的待写K线根数，超出丢弃最旧的
+PERSIST_RETRY_MAX_SECONDS = 60       # 写入失败后重试的最大退避间隔
+
+# --- 持仓榜 ---
+HOLDER_BOARD_TOP_K = 20            # /股东列表 显示的持有者名次
+NICKNAME_CACHE_TTL_SECONDS = 600   # 用户昵称缓存的有效期
+
+# --- 以 config.py 中的设置覆盖默认值 ---
+from .config import *  # noqa: E402,F401,F403
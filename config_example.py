@@ -64,6 +64,10 @@ DEFAULT_LISTED_COMPANY_VOLATILITY = 0.025
 # 内在价值更新对市场压力的影响
 INTRINSIC_VALUE_PRESSURE_FACTOR = 5
 
+# --- 可选设置 ---
+# 缓存、后台任务、推送、备份等设置的默认值见 config_defaults.py；
+# 如需调整，在本文件中定义同名变量即可覆盖，未定义的沿用默认值。
+
 # --- 原生股票随机事件 ---
 NATIVE_EVENT_PROBABILITY_PER_TICK = 0.001  # 每5分钟有 0.1% 的概率
 
@@ -1,15 +1,73 @@
 # stock_market/database.py
 
+import asyncio
+import time
 import aiosqlite
-from typing import Dict, List, Any, Tuple, Optional
+from typing import Dict, List, Any, Tuple, Optional, AsyncIterator, Callable
 from astrbot.api import logger
 from datetime import datetime, timedelta
 from .config import SELL_LOCK_MINUTES
+from .config_defaults import KLINE_MIGRATION_CHUNK_SIZE
 from .models import VirtualStock
+from .utils import generate_user_hash
+
+# 数据库结构版本 (PRAGMA user_version)
+#   0: kline_history 以 (stock_id TEXT, timestamp ISO TEXT) 为主键
+#   1: K线表改为 WITHOUT ROWID，以 (stock_key INTEGER, ts 纪元秒) 为主键
+SCHEMA_VERSION = 1
+
+# K线表: 5分钟K 及其汇总表。旧版表名 -> 新版表名
+KLINE_TABLES = {'kline_history': 'kline_5m', 'kline_history_1h': 'kline_1h', 'kline_history_1d': 'kline_1d'}
+
+# 存放在独立账本库中的表。行情库 (stocks/K线) 与账本库各自有独立的写锁和 WAL，
+# tick 批量落库不会阻塞用户交易的提交
+LEDGER_TABLES = ('users', 'holdings', 'subscriptions', 'trades')
+
+# 为尚未登记的用户补登 user_hash (图表页链接中的用户标识) 的 SQL，user_hash() 为注册到连接上的 Python 函数
+BACKFILL_USER_HASHES_SQL = (
+    "INSERT OR IGNORE INTO user_hashes (user_hash, user_id) "
+    "SELECT user_hash(user_id), user_id FROM (SELECT user_id FROM users UNION SELECT user_id FROM positions) "
+    "WHERE user_id NOT IN (SELECT user_id FROM user_hashes)"
+)
+
+# 由 holdings 批次重建 positions (每个 (用户, 股票) 一行的汇总持仓)
+REBUILD_POSITIONS_SQL = (
+    "INSERT INTO positions (user_id, stock_id, quantity, cost_basis) "
+    "SELECT user_id, stock_id, SUM(quantity), SUM(quantity * purchase_price) FROM holdings "
+    "GROUP BY user_id, stock_id HAVING SUM(quantity) > 0"
+)
+
+def to_epoch(iso_str: str) -> int:
+    """本地时间 ISO 字符串 -> 纪元秒。"""
+    return int(datetime.fromisoformat(iso_str).timestamp())
+
+def from_epoch(ts: int) -> str:
+    """纪元秒 -> 本地时间 ISO 字符串 (与内存/接口中的K线 date 字段格式一致)。"""
+    return datetime.fromtimestamp(ts).isoformat()
+
+def bucket_shift(bucket_seconds: int) -> int:
+    """按本地时间对齐时间桶的偏移秒数: (ts + shift) % bucket == 0 的 ts 为桶起点。按周聚合时从周一开始。"""
+    shift = int(datetime.now().astimezone().utcoffset().total_seconds())
+    if bucket_seconds % (7 * 86400) == 0:
+        shift += 3 * 86400  # 纪元起点是周四
+    return shift
+
+def bucket_start(ts: int, bucket_seconds: int) -> int:
+    """ts 所在时间桶的起点 (纪元秒)。"""
+    return ts - (ts + bucket_shift(bucket_seconds)) % bucket_seconds
 
 class DatabaseManager:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, ledger_db_path: str):
         self.db_path = db_path
+        self.ledger_db_path = ledger_db_path
+        # stock_id -> stock_key 的缓存。K线表只保存整数代理键，修改股票代码时无需改写K线
+        self._stock_keys: Dict[str, int] = {}
+        # 串行化所有改写 holdings 的操作 (买入、FIFO卖出、碎片合并)，避免读-改-写交错
+        self._holdings_lock = asyncio.Lock()
+        # 汇总持仓变化后的回调 (user_id, stock_id, quantity, cost_basis)，quantity 为 0 表示已清仓
+        self.on_position_changed: Optional[Callable[[str, str, int, float], None]] = None
+        # user_hash -> user_id 的内存副本，图表页按链接中的 hash 找用户时直接查字典
+        self._user_hashes: Dict[str, str] = {}
 
     async def _safe_add_columns(self, db, table_name, columns_to_add: Dict[str, str]):
         """安全地为指定表添加多个列。"""
@@ -26,15 +84,7 @@ class DatabaseManager:
         logger.info("正在检查并初始化数据库结构...")
         try:
             async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY NOT NULL,
-                    login_id TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );""")
-                await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_login_id ON users (login_id);")
-
+                await db.execute("PRAGMA journal_mode = WAL")
                 await db.execute("""
                 CREATE TABLE IF NOT EXISTS stocks (
                     stock_id TEXT PRIMARY KEY,
@@ -44,17 +94,50 @@ class DatabaseManager:
                     industry TEXT NOT NULL DEFAULT '综合'
                 );""")
 
+                for kline_table in KLINE_TABLES.values():
+                    await db.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {kline_table} (
+                        stock_key INTEGER NOT NULL,
+                        ts INTEGER NOT NULL,
+                        open REAL NOT NULL,
+                        high REAL NOT NULL,
+                        low REAL NOT NULL,
+                        close REAL NOT NULL,
+                        PRIMARY KEY (stock_key, ts)
+                    ) WITHOUT ROWID;""")
+
+                await self._safe_add_columns(db, 'stocks', {
+                    'is_listed_company': 'BOOLEAN NOT NULL DEFAULT 0',
+                    'owner_id': 'TEXT',
+                    'total_shares': 'INTEGER',
+                    'market_pressure': 'REAL NOT NULL DEFAULT 0.0',
+                    'fundamental_value': 'REAL',
+                    'stock_key': 'INTEGER'
+                })
+                await self._assign_missing_stock_keys(db)
+                await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_stocks_stock_key ON stocks (stock_key);")
+                await db.commit()
+
+                cursor = await db.execute("PRAGMA user_version")
+                version = (await cursor.fetchone())[0]
+                if version < 1:
+                    await self._migrate_klines_to_v1(db)
+                await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                await db.commit()
+
+                cursor = await db.execute("SELECT stock_id, stock_key FROM stocks")
+                self._stock_keys = {stock_id: stock_key for stock_id, stock_key in await cursor.fetchall()}
+
+            async with aiosqlite.connect(self.ledger_db_path) as db:
+                await db.execute("PRAGMA journal_mode = WAL")
                 await db.execute("""
-                CREATE TABLE IF NOT EXISTS kline_history (
-                    stock_id TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    open REAL NOT NULL,
-                    high REAL NOT NULL,
-                    low REAL NOT NULL,
-                    close REAL NOT NULL,
-                    PRIMARY KEY (stock_id, timestamp),
-                    FOREIGN KEY (stock_id) REFERENCES stocks(stock_id) ON DELETE CASCADE
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY NOT NULL,
+                    login_id TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );""")
+                await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_login_id ON users (login_id);")
 
                 await db.execute("""
                 CREATE TABLE IF NOT EXISTS holdings (
@@ -67,28 +150,226 @@ class DatabaseManager:
                     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
                 );""")
                 await db.execute("CREATE INDEX IF NOT EXISTS idx_holdings_user_stock ON holdings (user_id, stock_id);")
+
+                # 汇总持仓: 与 holdings 在同一事务中维护，组合/股东/排行查询每个持仓只读一行
+                await db.execute("""
+                CREATE TABLE IF NOT EXISTS positions (
+                    user_id TEXT NOT NULL,
+                    stock_id TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    cost_basis REAL NOT NULL,
+                    PRIMARY KEY (user_id, stock_id)
+                ) WITHOUT ROWID;""")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_positions_stock ON positions (stock_id, quantity);")
                 
                 await db.execute("CREATE TABLE IF NOT EXISTS subscriptions (umo TEXT PRIMARY KEY NOT NULL);")
 
-                await self._safe_add_columns(db, 'stocks', {
-                    'is_listed_company': 'BOOLEAN NOT NULL DEFAULT 0',
-                    'owner_id': 'TEXT',
-                    'total_shares': 'INTEGER',
-                    'market_pressure': 'REAL NOT NULL DEFAULT 0.0',
-                    'fundamental_value': 'REAL'
-                })
+                # 只追加的成交流水，按 trade_id 做游标分页
+                await db.execute("""
+                CREATE TABLE IF NOT EXISTS trades (
+                    trade_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    stock_id TEXT NOT NULL,
+                    side TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    price REAL NOT NULL,
+                    amount REAL NOT NULL,
+                    fee REAL NOT NULL DEFAULT 0,
+                    slippage REAL NOT NULL DEFAULT 0,
+                    realized_pnl REAL,
+                    timestamp TEXT NOT NULL
+                );""")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_trades_user ON trades (user_id, trade_id);")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_trades_stock ON trades (stock_id, trade_id);")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_trades_timestamp ON trades (timestamp);")
 
+                # 图表页链接中的 user_hash -> user_id 反查索引，在注册和首次买入时写入
+                await db.execute("""
+                CREATE TABLE IF NOT EXISTS user_hashes (
+                    user_hash TEXT PRIMARY KEY NOT NULL,
+                    user_id TEXT NOT NULL
+                ) WITHOUT ROWID;""")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_user_hashes_user ON user_hashes (user_id);")
                 await db.commit()
+
+            migrated_tables = await self._migrate_ledger_tables()
+            await self._ensure_positions(rebuild='holdings' in migrated_tables)
+            await self._load_user_hashes()
             logger.info("数据库初始化完成。")
         except Exception as e:
             logger.error(f"数据库初始化过程中发生严重错误: {e}", exc_info=True)
             raise
 
-    async def load_stocks(self) -> Dict[str, VirtualStock]:
-        """从数据库加载所有股票信息到内存。"""
+    async def _migrate_ledger_tables(self) -> List[str]:
+        """
+        将旧版单库中的用户账本表 (users/holdings/subscriptions/trades) 迁移到独立的账本库，返回迁移了的表名。
+        先整表复制并提交，再删除旧表；中途中断时 INSERT OR IGNORE 保证重跑幂等。
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            existing = {row[0] for row in await cursor.fetchall()}
+            legacy_tables = [t for t in LEDGER_TABLES if t in existing]
+            if not legacy_tables:
+                return []
+            logger.info(f"正在将账本表 {legacy_tables} 迁移到独立数据库 {self.ledger_db_path} ...")
+            await db.execute("ATTACH DATABASE ? AS ledger", (self.ledger_db_path,))
+            try:
+                for table in legacy_tables:
+                    cursor = await db.execute(f"PRAGMA main.table_info({table})")
+                    columns = ", ".join(row[1] for row in await cursor.fetchall())
+                    cursor = await db.execute(
+                        f"INSERT OR IGNORE INTO ledger.{table} ({columns}) SELECT {columns} FROM main.{table}")
+                    await db.commit()
+                    await db.execute(f"DROP TABLE main.{table}")
+                    await db.commit()
+                    logger.info(f"账本表 `{table}` 迁移完成，共 {cursor.rowcount} 行。")
+            finally:
+                await db.execute("DETACH DATABASE ledger")
+            await db.execute("VACUUM")
+        return legacy_tables
+
+    async def _ensure_positions(self, rebuild: bool = False):
+        """
+        positions 为空而 holdings 有数据时 (首次升级或外部导入后)，由持仓批次重建。
+        rebuild 为 True 时 (刚迁移进持仓批次) 无论 positions 是否为空都整表重建。
+        """
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            has_positions = await (await db.execute("SELECT 1 FROM positions LIMIT 1")).fetchone()
+            has_holdings = await (await db.execute("SELECT 1 FROM holdings LIMIT 1")).fetchone()
+            if has_holdings and (rebuild or not has_positions):
+                await db.execute("DELETE FROM positions")
+                cursor = await db.execute(REBUILD_POSITIONS_SQL)
+                await db.commit()
+                logger.info(f"已由持仓批次重建汇总持仓表，共 {cursor.rowcount} 行。")
+
+    async def _load_user_hashes(self):
+        """补登缺失的 user_hash (升级或外部导入后)，并载入内存。"""
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            await db.create_function("user_hash", 1, generate_user_hash, deterministic=True)
+            cursor = await db.execute(BACKFILL_USER_HASHES_SQL)
+            if cursor.rowcount:
+                logger.info(f"已为 {cursor.rowcount} 个用户补登 user_hash。")
+            await db.commit()
+            cursor = await db.execute("SELECT user_hash, user_id FROM user_hashes")
+            self._user_hashes = {user_hash: user_id for user_hash, user_id in await cursor.fetchall()}
+
+    async def _register_user_hash(self, db, user_id: str):
+        """在调用方的事务中登记 user_hash (已登记时不做任何事)。"""
+        user_hash = generate_user_hash(user_id)
+        if self._user_hashes.get(user_hash) == user_id:
+            return
+        await db.execute("INSERT OR IGNORE INTO user_hashes (user_hash, user_id) VALUES (?, ?)", (user_hash, user_id))
+        self._user_hashes.setdefault(user_hash, user_id)
+
+    def resolve_user_hash(self, user_hash: Optional[str]) -> Optional[str]:
+        """由图表页链接中的 user_hash 找到 user_id，未登记时返回 None。"""
+        return self._user_hashes.get(user_hash) if user_hash else None
+
+    async def _assign_missing_stock_keys(self, db):
+        """为尚未分配整数代理键的股票分配 stock_key。"""
+        cursor = await db.execute("SELECT stock_id FROM stocks WHERE stock_key IS NULL ORDER BY stock_id")
+        missing = [row[0] for row in await cursor.fetchall()]
+        for stock_id in missing:
+            await db.execute(
+                "UPDATE stocks SET stock_key = (SELECT COALESCE(MAX(stock_key), 0) + 1 FROM stocks) WHERE stock_id = ?",
+                (stock_id,)
+            )
+
+    async def _get_db_size(self, db) -> int:
+        page_count = (await (await db.execute("PRAGMA page_count")).fetchone())[0]
+        page_size = (await (await db.execute("PRAGMA page_size")).fetchone())[0]
+        return page_count * page_size
+
+    async def _time_range_scan(self, db, query: str, params: tuple) -> float:
+        """执行一次区间扫描并返回耗时 (毫秒)，仅用于迁移前后的对比日志。"""
+        start = time.perf_counter()
+        await (await db.execute(query, params)).fetchall()
+        return (time.perf_counter() - start) * 1000
+
+    async def _migrate_klines_to_v1(self, db):
+        """
+        将旧版 TEXT 主键的K线表分块迁移到 WITHOUT ROWID 的整数主键表。
+        每块在独立事务中「复制 + 删除源行」，中途中断后重启会从剩余的行继续。
+        """
+        cursor = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        existing_tables = {row[0] for row in await cursor.fetchall()}
+        legacy_tables = [t for t in KLINE_TABLES if t in existing_tables]
+        if not legacy_tables:
+            return
+
+        started = time.perf_counter()
+        size_before = await self._get_db_size(db)
+        sample = await (await db.execute("SELECT stock_id, MAX(timestamp) FROM kline_history")).fetchone() \
+            if 'kline_history' in legacy_tables else None
+        scan_before = None
+        if sample and sample[0]:
+            since_iso = (datetime.fromisoformat(sample[1]) - timedelta(days=7)).isoformat()
+            scan_before = await self._time_range_scan(
+                db, "SELECT timestamp, open, high, low, close FROM kline_history WHERE stock_id = ? AND timestamp >= ? ORDER BY timestamp",
+                (sample[0], since_iso))
+        logger.info(f"开始迁移K线表到整数时间戳结构 (数据库大小 {size_before / 1024 / 1024:.1f} MB)...")
+
+        migrated = orphaned = 0
+        for legacy_table in legacy_tables:
+            new_table = KLINE_TABLES[legacy_table]
+            # 新表只能按 stocks 中的 stock_key 保存；没有对应股票的K线无法迁移，会随分块删除一并丢弃
+            cursor = await db.execute(f"""
+                SELECT k.stock_id, COUNT(*) FROM {legacy_table} k
+                WHERE NOT EXISTS (SELECT 1 FROM stocks s WHERE s.stock_id = k.stock_id)
+                GROUP BY k.stock_id""")
+            orphans = await cursor.fetchall()
+            if orphans:
+                orphan_rows = sum(count for _, count in orphans)
+                orphaned += orphan_rows
+                detail = ", ".join(f"{stock_id}: {count}" for stock_id, count in orphans[:20])
+                more = f" 等 {len(orphans)} 支" if len(orphans) > 20 else ""
+                logger.warning(f"`{legacy_table}` 中有 {orphan_rows} 行K线对应的股票已不存在，迁移时将被丢弃 ({detail}{more})。")
+            while True:
+                cursor = await db.execute(
+                    f"SELECT MAX(rowid) FROM (SELECT rowid FROM {legacy_table} ORDER BY rowid LIMIT ?)",
+                    (KLINE_MIGRATION_CHUNK_SIZE,))
+                chunk_end = (await cursor.fetchone())[0]
+                if chunk_end is None:
+                    break
+                # 'utc' 修饰符把本地时间转换为 UTC，结果与 Python 的 datetime.timestamp() 一致
+                await db.execute(f"""
+                    INSERT OR IGNORE INTO {new_table} (stock_key, ts, open, high, low, close)
+                    SELECT s.stock_key, CAST(strftime('%s', k.timestamp, 'utc') AS INTEGER), k.open, k.high, k.low, k.close
+                    FROM {legacy_table} k JOIN stocks s ON s.stock_id = k.stock_id
+                    WHERE k.rowid <= ?""", (chunk_end,))
+                cursor = await db.execute(f"DELETE FROM {legacy_table} WHERE rowid <= ?", (chunk_end,))
+                migrated += cursor.rowcount
+                await db.commit()
+                await asyncio.sleep(0)
+            await db.execute(f"DROP TABLE {legacy_table}")
+            await db.commit()
+
+        await db.execute("VACUUM")
+        size_after = await self._get_db_size(db)
+        scan_after = None
+        if sample and sample[0]:
+            cursor = await db.execute("SELECT stock_key FROM stocks WHERE stock_id = ?", (sample[0],))
+            key_row = await cursor.fetchone()
+            if key_row:
+                since_ts = to_epoch(sample[1]) - 7 * 86400
+                scan_after = await self._time_range_scan(
+                    db, "SELECT ts, open, high, low, close FROM kline_5m WHERE stock_key = ? AND ts >= ? ORDER BY ts",
+                    (key_row[0], since_ts))
+        scan_text = f"，7天区间扫描 {scan_before:.1f} ms -> {scan_after:.1f} ms" if scan_before is not None and scan_after is not None else ""
+        logger.info(
+            f"K线表迁移完成: {migrated} 行 (其中 {orphaned} 行无对应股票被丢弃)，用时 {time.perf_counter() - started:.1f} 秒；"
+            f"数据库大小 {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB{scan_text}。"
+        )
+
+    async def load_stocks(self, kline_limit: int) -> Dict[str, VirtualStock]:
+        """
+        从数据库加载所有股票信息到内存。
+        只同步加载每支股票最近 kline_limit 根K线 (足够行情计算)，完整历史由 load_kline_history 另行补全。
+        kline_limit 为 0 时不读取K线 (从快照恢复时使用)。
+        """
         stocks = {}
         async with aiosqlite.connect(self.db_path) as db:
-            query = "SELECT stock_id, name, current_price, volatility, industry, is_listed_company, owner_id, total_shares, market_pressure, fundamental_value FROM stocks"
+            query = "SELECT stock_id, name, current_price, volatility, industry, is_listed_company, owner_id, total_shares, market_pressure, fundamental_value, stock_key FROM stocks"
             cursor = await db.execute(query)
             rows = await cursor.fetchall()
 
@@ -100,15 +381,18 @@ class DatabaseManager:
                     ('HK', '虎口矿业', 45, 0.0300, '矿业'), ('GH', '光合生物', 26, 0.0550, '生物'),
                 ]
                 await db.executemany(
-                    "INSERT INTO stocks (stock_id, name, current_price, volatility, industry, fundamental_value) VALUES (?, ?, ?, ?, ?, ?)",
-                    [(d[0], d[1], d[2], d[3], d[4], d[2]) for d in initial_data]
+                    "INSERT INTO stocks (stock_id, name, current_price, volatility, industry, fundamental_value, stock_key) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(d[0], d[1], d[2], d[3], d[4], d[2], i) for i, d in enumerate(initial_data, 1)]
                 )
                 await db.commit()
                 cursor = await db.execute(query)
                 rows = await cursor.fetchall()
 
+            klines_by_key = await self._fetch_recent_klines(db, kline_limit) if kline_limit > 0 else {}
+
             for row in rows:
-                stock_id, name, price, volatility, industry, is_listed, owner_id, total_shares, market_pressure, fundamental_value = row
+                stock_id, name, price, volatility, industry, is_listed, owner_id, total_shares, market_pressure, fundamental_value, stock_key = row
+                self._stock_keys[stock_id] = stock_key
                 if fundamental_value is None:
                     fundamental_value = price
 
@@ -119,15 +403,10 @@ class DatabaseManager:
                     total_shares=total_shares or 0, market_pressure=market_pressure or 0.0
                 )
                 
-                k_cursor = await db.execute(
-                    "SELECT timestamp, open, high, low, close FROM kline_history WHERE stock_id = ? ORDER BY timestamp DESC LIMIT ?",
-                    (stock_id, stock.kline_history.maxlen)
-                )
-                k_rows = await k_cursor.fetchall()
-                kline_data = [{"date": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4]} for r in reversed(k_rows)]
-                
+                kline_data = klines_by_key.get(stock_key, [])
                 stock.kline_history.extend(kline_data)
-                stock.price_history.extend([k['close'] for k in kline_data])
+                stock.rebuild_derived()
+                stock.price_history.extend(k['close'] for k in kline_data[-stock.price_history.maxlen:])
                 if not stock.price_history:
                     stock.price_history.append(price)
                 stock.daily_close_history.extend(list(stock.price_history)[-stock.daily_close_history.maxlen:])
@@ -137,10 +416,31 @@ class DatabaseManager:
         logger.info(f"成功从数据库加载 {len(stocks)} 支股票。")
         return stocks
 
+    async def load_kline_history(self, limit: int) -> Dict[str, List[Dict[str, Any]]]:
+        """一次查询取回所有股票最近 limit 根5分钟K线，按 stock_id 分组，时间升序。"""
+        async with aiosqlite.connect(self.db_path) as db:
+            klines_by_key = await self._fetch_recent_klines(db, limit)
+        return {stock_id: klines_by_key.get(stock_key, []) for stock_id, stock_key in self._stock_keys.items()}
+
+    async def _fetch_recent_klines(self, db, limit: int) -> Dict[int, List[Dict[str, Any]]]:
+        """用窗口函数在单条查询中取出每支股票最近 limit 根K线，避免逐支股票查询。"""
+        cursor = await db.execute("""
+            SELECT stock_key, ts, open, high, low, close FROM (
+                SELECT stock_key, ts, open, high, low, close,
+                       ROW_NUMBER() OVER (PARTITION BY stock_key ORDER BY ts DESC) AS rn
+                FROM kline_5m
+            ) WHERE rn <= ? ORDER BY stock_key, ts
+        """, (limit,))
+        klines_by_key: Dict[int, List[Dict[str, Any]]] = {}
+        for stock_key, ts, o, h, l, c in await cursor.fetchall():
+            klines_by_key.setdefault(stock_key, []).append(
+                {"date": from_epoch(ts), "open": o, "high": h, "low": l, "close": c})
+        return klines_by_key
+
     async def load_subscriptions(self) -> set:
         """从数据库加载所有订阅者到内存。"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with aiosqlite.connect(self.ledger_db_path) as db:
                 cursor = await db.execute("SELECT umo FROM subscriptions")
                 rows = await cursor.fetchall()
                 subscribers = {row[0] for row in rows}
@@ -150,72 +450,188 @@ class DatabaseManager:
             logger.error(f"从数据库加载订阅者列表失败: {e}", exc_info=True)
             return set()
             
-    async def batch_update_stock_data(self, updates: List[Dict[str, Any]]):
-        """批量更新股票价格、压力和K线数据。"""
-        if not updates:
+    async def batch_update_stock_data(self, prices: List[Tuple[str, float, float]],
+                                      klines: List[Tuple[str, str, float, float, float, float]]):
+        """
+        在一个事务中批量更新股票价格、压力和K线数据。
+        prices: (stock_id, current_price, market_pressure)
+        klines: (stock_id, date_iso, open, high, low, close)
+        """
+        if not prices and not klines:
             return
+        kline_rows, skipped = [], {}
+        for stock_id, date_iso, o, h, l, c in klines:
+            stock_key = self._stock_keys.get(stock_id)
+            if stock_key is None:
+                skipped[stock_id] = skipped.get(stock_id, 0) + 1
+                continue
+            kline_rows.append((stock_key, to_epoch(date_iso), o, h, l, c))
+        if skipped:
+            # 例如排队期间股票被改名或删除
+            logger.warning(f"以下股票在数据库中已不存在，跳过其待写K线: {skipped}")
         async with aiosqlite.connect(self.db_path) as db:
-            for data in updates:
-                await db.execute(
-                    "UPDATE stocks SET current_price = ?, market_pressure = ? WHERE stock_id = ?",
-                    (data['current_price'], data['market_pressure'], data['stock_id'])
-                )
-                k = data['kline']
-                await db.execute(
-                    "INSERT INTO kline_history (stock_id, timestamp, open, high, low, close) VALUES (?, ?, ?, ?, ?, ?) "
-                    "ON CONFLICT(stock_id, timestamp) DO UPDATE SET open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close",
-                    (data['stock_id'], k['date'], k['open'], k['high'], k['low'], k['close'])
-                )
+            await db.executemany(
+                "UPDATE stocks SET current_price = ?, market_pressure = ? WHERE stock_id = ?",
+                [(price, pressure, stock_id) for stock_id, price, pressure in prices]
+            )
+            await db.executemany(
+                "INSERT INTO kline_5m (stock_key, ts, open, high, low, close) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(stock_key, ts) DO UPDATE SET open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close",
+                kline_rows
+            )
             await db.commit()
 
-    async def get_user_holdings(self, user_id: str) -> List[Tuple[str, int]]:
-        """获取指定用户的所有持仓。"""
+    async def get_oldest_kline_ts(self, stock_key: int, table: str = 'kline_5m') -> Optional[int]:
+        """返回某支股票在指定K线表中最早一根的纪元秒，没有数据时返回 None。"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(f"SELECT MIN(ts) FROM {table} WHERE stock_key = ?", (stock_key,)) as cursor:
+                row = await cursor.fetchone()
+        return row[0]
+
+    async def rollup_klines_window(self, stock_key: int, start_ts: int, end_ts: int):
+        """
+        将某支股票 [start_ts, end_ts) 内的5分钟K线汇总进小时K和日K表 (已存在的桶不会被覆盖)。
+        区间边界应落在本地零点上，保证每个小时/日桶完整地落在一个区间内；每个区间单独提交。
+        """
+        # 日K按本地自然日分桶
+        utc_offset = int(datetime.now().astimezone().utcoffset().total_seconds())
+        bucket_exprs = {
+            'kline_1h': "ts - ts % 3600",
+            'kline_1d': f"ts - (ts + {utc_offset}) % 86400",
+        }
+        async with aiosqlite.connect(self.db_path) as db:
+            for table, bucket_expr in bucket_exprs.items():
+                await db.execute(f"""
+                    INSERT OR IGNORE INTO {table} (stock_key, ts, open, high, low, close)
+                    SELECT g.stock_key, g.bucket, o.open, g.high, g.low, c.close
+                    FROM (
+                        SELECT stock_key, {bucket_expr} AS bucket, MIN(ts) AS first_ts, MAX(ts) AS last_ts,
+                               MAX(high) AS high, MIN(low) AS low
+                        FROM kline_5m WHERE stock_key = ? AND ts >= ? AND ts < ?
+                        GROUP BY bucket
+                    ) g
+                    JOIN kline_5m o ON o.stock_key = g.stock_key AND o.ts = g.first_ts
+                    JOIN kline_5m c ON c.stock_key = g.stock_key AND c.ts = g.last_ts
+                """, (stock_key, start_ts, end_ts))
+            await db.commit()
+
+    async def prune_klines_batch(self, table: str, stock_key: int, cutoff_ts: int, batch_size: int) -> int:
+        """从指定K线表中删除一批早于 cutoff 的记录，返回删除的行数。"""
         async with aiosqlite.connect(self.db_path) as db:
             cursor = await db.execute(
-                "SELECT stock_id, SUM(quantity) FROM holdings WHERE user_id = ? GROUP BY stock_id",
-                (user_id,)
+                f"DELETE FROM {table} WHERE stock_key = ? AND ts IN "
+                f"(SELECT ts FROM {table} WHERE stock_key = ? AND ts < ? ORDER BY ts LIMIT ?)",
+                (stock_key, stock_key, cutoff_ts, batch_size)
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def iter_bucketed_klines(self, stock_id: str, since_ts: Optional[int], bucket_seconds: int,
+                                   rollup_table: str) -> AsyncIterator[Tuple[int, float, float, float, float]]:
+        """
+        在 SQLite 中按整数时间桶聚合K线并逐行产出 (bucket_ts, open, high, low, close)，不把原始K线载入内存。
+        原始5分钟K线之前的区间使用汇总表 rollup_table (kline_1h / kline_1d)，与原始K线无重叠。
+        时间桶按本地时间对齐，按周聚合时从周一开始。
+        """
+        stock_key = self._stock_keys.get(stock_id)
+        if stock_key is None:
+            return
+        shift = bucket_shift(bucket_seconds)
+        since_ts = since_ts or 0
+        query = f"""
+            WITH src AS (
+                SELECT ts, open, high, low, close FROM {rollup_table}
+                WHERE stock_key = :key AND ts >= :since
+                  AND ts < (SELECT COALESCE(MIN(ts), 9223372036854775807) FROM kline_5m WHERE stock_key = :key)
+                UNION ALL
+                SELECT ts, open, high, low, close FROM kline_5m WHERE stock_key = :key AND ts >= :since
+            ),
+            bucketed AS (
+                SELECT ts - (ts + :shift) % :bucket AS bucket, high, low,
+                       FIRST_VALUE(open) OVER w AS first_open,
+                       LAST_VALUE(close) OVER w AS last_close
+                FROM src
+                WINDOW w AS (PARTITION BY ts - (ts + :shift) % :bucket ORDER BY ts
+                             ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
             )
+            SELECT bucket, MIN(first_open), MAX(high), MIN(low), MIN(last_close)
+            FROM bucketed GROUP BY bucket ORDER BY bucket
+        """
+        params = {"key": stock_key, "since": since_ts, "shift": shift, "bucket": bucket_seconds}
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(query, params) as cursor:
+                async for row in cursor:
+                    yield row
+
+    async def iter_klines(self, stock_ids: List[str], start_ts: Optional[int], end_ts: Optional[int],
+                          table: str = 'kline_5m', page_size: int = 5000
+                          ) -> AsyncIterator[Tuple[str, int, float, float, float, float]]:
+        """
+        按股票、时间顺序逐行产出指定区间的K线 (stock_id, ts, open, high, low, close)，供流式导出使用。
+        按 (stock_key, ts) 分页，每页一条独立的查询: 导出再慢也不会长时间占着读事务而阻塞 WAL 检查点。
+        """
+        key_to_id = {self._stock_keys[sid]: sid for sid in stock_ids if sid in self._stock_keys}
+        if not key_to_id:
+            return
+        placeholders = ", ".join("?" for _ in key_to_id)
+        query = (f"SELECT stock_key, ts, open, high, low, close FROM {table} "
+                 f"WHERE stock_key IN ({placeholders}) AND ts >= ? AND ts < ? AND (stock_key, ts) > (?, ?) "
+                 f"ORDER BY stock_key, ts LIMIT ?")
+        cursor_key = (-1, -1)
+        async with aiosqlite.connect(self.db_path) as db:
+            while True:
+                cursor = await db.execute(query, (*key_to_id, start_ts or 0, end_ts or 9223372036854775807,
+                                                  *cursor_key, page_size))
+                rows = await cursor.fetchall()
+                await cursor.close()
+                for stock_key, ts, o, h, l, c in rows:
+                    yield key_to_id[stock_key], ts, o, h, l, c
+                if len(rows) < page_size:
+                    return
+                cursor_key = rows[-1][:2]
+
+    def get_stock_keys(self) -> Dict[str, int]:
+        """获取 stock_id -> stock_key 映射。"""
+        return dict(self._stock_keys)
+
+    async def get_user_holdings(self, user_id: str) -> List[Tuple[str, int]]:
+        """获取指定用户的所有持仓。"""
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute("SELECT stock_id, quantity FROM positions WHERE user_id = ?", (user_id,))
             return await cursor.fetchall()
             
     async def get_all_user_ids_with_holdings(self) -> set:
         """获取所有持有股票的用户ID集合。"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT DISTINCT user_id FROM holdings")
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute("SELECT DISTINCT user_id FROM positions")
             return {row[0] for row in await cursor.fetchall()}
 
     async def get_user_holdings_aggregated(self, user_id: str) -> dict:
-        """获取并聚合指定用户的持仓数据。"""
-        aggregated_holdings = {}
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT stock_id, quantity, purchase_price FROM holdings WHERE user_id=?", (user_id,))
-            raw_holdings = await cursor.fetchall()
-
-        for stock_id, qty, price in raw_holdings:
-            if stock_id not in aggregated_holdings:
-                aggregated_holdings[stock_id] = {'quantity': 0, 'cost_basis': 0}
-            aggregated_holdings[stock_id]['quantity'] += qty
-            aggregated_holdings[stock_id]['cost_basis'] += qty * price
-
-        return aggregated_holdings
+        """获取指定用户按股票汇总的持仓数据 {stock_id: {'quantity', 'cost_basis'}}。"""
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute("SELECT stock_id, quantity, cost_basis FROM positions WHERE user_id = ?", (user_id,))
+            rows = await cursor.fetchall()
+        return {stock_id: {'quantity': qty, 'cost_basis': cost} for stock_id, qty, cost in rows}
 
     async def get_user_by_qq_id(self, qq_user_id: str) -> bool:
         """根据QQ号检查用户是否存在"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             cursor = await db.execute("SELECT 1 FROM users WHERE user_id = ?", (qq_user_id,))
             return await cursor.fetchone() is not None
 
     async def register_web_user(self, login_id: str, password_hash: str, qq_user_id: str, timestamp: str):
         """注册一个新的Web用户并绑定QQ"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             await db.execute(
                 "INSERT INTO users (login_id, password_hash, user_id, created_at) VALUES (?, ?, ?, ?)",
                 (login_id, password_hash, qq_user_id, timestamp)
             )
+            await self._register_user_hash(db, qq_user_id)
             await db.commit()
 
     async def get_user_by_login_id(self, login_id: str) -> Optional[dict]:
         """根据登录ID查找用户记录。"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("SELECT user_id, login_id, password_hash FROM users WHERE login_id = ?", (login_id,))
             record = await cursor.fetchone()
@@ -223,23 +639,72 @@ class DatabaseManager:
 
     async def update_user_password(self, login_id: str, new_password_hash: str) -> None:
         """更新指定用户的密码。"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             await db.execute("UPDATE users SET password_hash = ? WHERE login_id = ?", (new_password_hash, login_id))
             await db.commit()
 
     async def add_holding(self, user_id: str, stock_id: str, quantity: int, purchase_price: float):
         """新增一笔持仓记录。"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._holdings_lock, aiosqlite.connect(self.ledger_db_path) as db:
             await db.execute(
                 "INSERT INTO holdings (user_id, stock_id, quantity, purchase_price, purchase_timestamp) VALUES (?, ?, ?, ?, ?)",
                 (user_id, stock_id, quantity, purchase_price, datetime.now().isoformat())
             )
+            await db.execute(
+                "INSERT INTO positions (user_id, stock_id, quantity, cost_basis) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id, stock_id) DO UPDATE SET quantity = quantity + excluded.quantity, "
+                "cost_basis = cost_basis + excluded.cost_basis",
+                (user_id, stock_id, quantity, quantity * purchase_price)
+            )
+            await self._register_user_hash(db, user_id)
             await db.commit()
+            await self._notify_position_changed(db, user_id, stock_id)
+
+    async def import_holdings(self, names: List[str], rows: List[tuple]) -> int:
+        """
+        导入持仓批次 (列式导入)，返回新写入的行数。
+        按 holding_id 去重 (INSERT OR IGNORE)，重复导入或部分失败后重试都不会产生重复持仓；
+        文件中没有 holding_id 时只允许导入到空账本。
+        在 _holdings_lock 内写入并重建汇总持仓，交易会等待导入完成而不是遇到 SQLITE_BUSY。
+        """
+        allowed = {'holding_id', 'user_id', 'stock_id', 'quantity', 'purchase_price', 'purchase_timestamp'}
+        unknown = set(names) - allowed
+        if unknown:
+            raise ValueError(f"持仓文件包含未知列: {', '.join(sorted(unknown))}")
+        async with self._holdings_lock, aiosqlite.connect(self.ledger_db_path) as db:
+            if 'holding_id' not in names:
+                if await (await db.execute("SELECT 1 FROM holdings LIMIT 1")).fetchone():
+                    raise ValueError("持仓文件缺少 holding_id，无法去重，只能导入到空账本")
+            before = db.total_changes
+            await db.executemany(
+                f"INSERT OR IGNORE INTO holdings ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})", rows)
+            inserted = db.total_changes - before
+            if inserted:
+                await db.execute("DELETE FROM positions")
+                await db.execute(REBUILD_POSITIONS_SQL)
+                await db.create_function("user_hash", 1, generate_user_hash, deterministic=True)
+                await db.execute(BACKFILL_USER_HASHES_SQL)
+            await db.commit()
+        if inserted:
+            await self._load_user_hashes()
+        return inserted
+
+    async def _notify_position_changed(self, db, user_id: str, stock_id: str):
+        """在持有 _holdings_lock 时读取提交后的汇总持仓并通知回调。"""
+        if not self.on_position_changed:
+            return
+        cursor = await db.execute("SELECT quantity, cost_basis FROM positions WHERE user_id = ? AND stock_id = ?", (user_id, stock_id))
+        row = await cursor.fetchone()
+        quantity, cost_basis = row if row else (0, 0.0)
+        try:
+            self.on_position_changed(user_id, stock_id, quantity, cost_basis)
+        except Exception as e:
+            logger.error(f"持仓变化回调出错: {e}", exc_info=True)
 
     async def get_sellable_quantity(self, user_id: str, stock_id: str) -> int:
         """获取指定股票的可卖出总量。"""
         unlock_time_str = (datetime.now() - timedelta(minutes=SELL_LOCK_MINUTES)).isoformat()
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             cursor = await db.execute("SELECT SUM(quantity) FROM holdings WHERE user_id=? AND stock_id=? AND purchase_timestamp <= ?", 
                                       (user_id, stock_id, unlock_time_str))
             result = await cursor.fetchone()
@@ -248,7 +713,7 @@ class DatabaseManager:
     async def get_next_unlock_time_str(self, user_id: str, stock_id: str) -> Optional[str]:
         """获取下一批持仓的解锁时间提示。"""
         unlock_time_str = (datetime.now() - timedelta(minutes=SELL_LOCK_MINUTES)).isoformat()
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             cursor = await db.execute(
                 "SELECT MIN(purchase_timestamp) FROM holdings WHERE user_id=? AND stock_id=? AND purchase_timestamp > ?",
                 (user_id, stock_id, unlock_time_str))
@@ -267,7 +732,7 @@ class DatabaseManager:
         """
         unlock_time = (datetime.now() - timedelta(minutes=SELL_LOCK_MINUTES)).isoformat()
         total_cost_basis = 0
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._holdings_lock, aiosqlite.connect(self.ledger_db_path) as db:
             cursor = await db.execute(
                 "SELECT holding_id, quantity, purchase_price FROM holdings WHERE user_id=? AND stock_id=? AND purchase_timestamp <= ? ORDER BY purchase_timestamp ASC",
                 (user_id, stock_id, unlock_time)
@@ -288,31 +753,134 @@ class DatabaseManager:
                     await db.execute("UPDATE holdings SET quantity=? WHERE holding_id=?", (new_qty, holding_id))
                 
                 remaining_to_sell -= sell_from_this_holding
+
+            sold_quantity = quantity_to_sell - max(remaining_to_sell, 0)
+            if sold_quantity > 0:
+                await db.execute(
+                    "UPDATE positions SET quantity = quantity - ?, cost_basis = cost_basis - ? WHERE user_id = ? AND stock_id = ?",
+                    (sold_quantity, total_cost_basis, user_id, stock_id)
+                )
+                await db.execute("DELETE FROM positions WHERE user_id = ? AND stock_id = ? AND quantity <= 0", (user_id, stock_id))
             await db.commit()
+            if sold_quantity > 0:
+                await self._notify_position_changed(db, user_id, stock_id)
         return total_cost_basis
 
+    async def consolidate_unlocked_lots(self, batch_size: int) -> int:
+        """
+        将已过锁定期的碎片持仓按 (用户, 股票) 合并为一笔成本加权的持仓。
+        每次最多处理 batch_size 组，返回本批减少的行数 (为 0 表示已无可合并的持仓)。
+        """
+        unlock_time_str = (datetime.now() - timedelta(minutes=SELL_LOCK_MINUTES)).isoformat()
+        reclaimed = 0
+        async with self._holdings_lock, aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute(
+                "SELECT user_id, stock_id, COUNT(*), SUM(quantity), SUM(quantity * purchase_price), MAX(purchase_timestamp) "
+                "FROM holdings WHERE purchase_timestamp <= ? GROUP BY user_id, stock_id HAVING COUNT(*) > 1 LIMIT ?",
+                (unlock_time_str, batch_size)
+            )
+            groups = await cursor.fetchall()
+            for user_id, stock_id, lot_count, total_qty, total_cost, last_purchase in groups:
+                await db.execute(
+                    "DELETE FROM holdings WHERE user_id=? AND stock_id=? AND purchase_timestamp <= ?",
+                    (user_id, stock_id, unlock_time_str)
+                )
+                # 合并后的持仓沿用最晚的买入时间，它仍早于解锁线，因此不影响可卖数量和 FIFO 顺序
+                await db.execute(
+                    "INSERT INTO holdings (user_id, stock_id, quantity, purchase_price, purchase_timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, stock_id, total_qty, total_cost / total_qty, last_purchase)
+                )
+                reclaimed += lot_count - 1
+            await db.commit()
+        return reclaimed
+
+    async def get_stock_holdings(self, stock_id: str) -> List[Tuple[str, int, float]]:
+        """获取某支股票每个持有者的汇总持仓 (user_id, quantity, cost_basis)，按持股数量降序。"""
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute(
+                "SELECT user_id, quantity, cost_basis FROM positions WHERE stock_id = ? ORDER BY quantity DESC", (stock_id,))
+            return await cursor.fetchall()
+
+    async def get_all_positions(self) -> List[Tuple[str, str, int, float]]:
+        """获取全部汇总持仓 (user_id, stock_id, quantity, cost_basis)，用于构建持有者索引。"""
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute("SELECT user_id, stock_id, quantity, cost_basis FROM positions WHERE quantity > 0")
+            return await cursor.fetchall()
+
     async def get_sellable_portfolio(self, user_id: str) -> List[Tuple[str, int]]:
         """获取用户所有可卖出的持仓（汇总后）。"""
         unlock_time_str = (datetime.now() - timedelta(minutes=SELL_LOCK_MINUTES)).isoformat()
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             cursor = await db.execute(
                 "SELECT stock_id, SUM(quantity) FROM holdings WHERE user_id=? AND purchase_timestamp <= ? GROUP BY stock_id",
                 (user_id, unlock_time_str))
             return await cursor.fetchall()
 
+    async def insert_trades(self, trades: List[Tuple]):
+        """批量写入成交记录。每条为 (user_id, stock_id, side, quantity, price, amount, fee, slippage, realized_pnl, timestamp)。"""
+        if not trades:
+            return
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            await db.executemany(
+                "INSERT INTO trades (user_id, stock_id, side, quantity, price, amount, fee, slippage, realized_pnl, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                trades
+            )
+            await db.commit()
+
+    async def get_trades(self, user_id: Optional[str] = None, stock_id: Optional[str] = None,
+                         before_id: Optional[int] = None, limit: int = 20) -> List[dict]:
+        """按 trade_id 倒序分页查询成交记录 (游标分页，before_id 为上一页最后一条的 trade_id)。"""
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if stock_id is not None:
+            conditions.append("stock_id = ?")
+            params.append(stock_id)
+        if before_id is not None:
+            conditions.append("trade_id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(limit)
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                "SELECT trade_id, user_id, stock_id, side, quantity, price, amount, fee, slippage, realized_pnl, timestamp "
+                f"FROM trades {where} ORDER BY trade_id DESC LIMIT ?",
+                params
+            )
+            return [dict(row) for row in await cursor.fetchall()]
+
+    async def get_trade_volume_since(self, since_iso: str) -> List[Tuple[str, int, int, float]]:
+        """统计某时间点之后各股票的 (stock_id, 成交笔数, 成交股数, 成交额)，仅用于启动时恢复当日统计。"""
+        async with aiosqlite.connect(self.ledger_db_path) as db:
+            cursor = await db.execute(
+                "SELECT stock_id, COUNT(*), SUM(quantity), SUM(amount) FROM trades WHERE timestamp >= ? GROUP BY stock_id",
+                (since_iso,)
+            )
+            return await cursor.fetchall()
+
     async def add_stock(self, stock_id: str, name: str, initial_price: float, volatility: float, industry: str):
         """[DB] 添加一支新股票。"""
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
-                "INSERT INTO stocks (stock_id, name, current_price, volatility, industry, fundamental_value) VALUES (?, ?, ?, ?, ?, ?)",
+                "INSERT INTO stocks (stock_id, name, current_price, volatility, industry, fundamental_value, stock_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(stock_key), 0) + 1 FROM stocks))",
                 (stock_id, name, initial_price, volatility, industry, initial_price)
             )
+            cursor = await db.execute("SELECT stock_key FROM stocks WHERE stock_id = ?", (stock_id,))
+            self._stock_keys[stock_id] = (await cursor.fetchone())[0]
             await db.commit()
 
     async def delete_stock(self, stock_id: str):
         """[DB] 删除一支股票及其所有關聯數據。"""
+        stock_key = self._stock_keys.pop(stock_id, None)
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute("DELETE FROM stocks WHERE stock_id = ?", (stock_id,))
+            if stock_key is not None:
+                for kline_table in KLINE_TABLES.values():
+                    await db.execute(f"DELETE FROM {kline_table} WHERE stock_key = ?", (stock_key,))
             await db.commit()
 
     async def update_stock_name(self, stock_id: str, new_name: str):
@@ -322,22 +890,28 @@ class DatabaseManager:
             await db.commit()
 
     async def update_stock_id(self, old_stock_id: str, new_stock_id: str):
-        """[DB] 更新股票代碼 (這是一個複雜操作，需要事務)。"""
+        """[DB] 更新股票代碼 (這是一個複雜操作，需要事務)。账本库通过 ATTACH 在同一连接中更新。"""
         async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("ATTACH DATABASE ? AS ledger", (self.ledger_db_path,))
             try:
                 await db.execute("PRAGMA foreign_keys = OFF")
                 await db.execute("BEGIN TRANSACTION")
                 
-                await db.execute("UPDATE stocks SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
-                await db.execute("UPDATE holdings SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
-                await db.execute("UPDATE kline_history SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
+                await db.execute("UPDATE main.stocks SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
+                await db.execute("UPDATE ledger.holdings SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
+                await db.execute("UPDATE ledger.positions SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
+                await db.execute("UPDATE ledger.trades SET stock_id = ? WHERE stock_id = ?", (new_stock_id, old_stock_id))
                 
                 await db.execute("COMMIT")
+                # K线表以 stock_key 关联，代码变更后只需更新映射
+                if old_stock_id in self._stock_keys:
+                    self._stock_keys[new_stock_id] = self._stock_keys.pop(old_stock_id)
             except Exception as e:
                 await db.execute("ROLLBACK")
                 raise e
             finally:
                 await db.execute("PRAGMA foreign_keys = ON")
+                await db.execute("DETACH DATABASE ledger")
 
     async def update_stock_industry(self, stock_id: str, new_industry: str):
         """[DB] 更新股票行業。"""
@@ -361,7 +935,10 @@ class DatabaseManager:
         query = """
             SELECT
                 s.stock_id, s.name,
-                (SELECT open FROM kline_history WHERE stock_id = s.stock_id ORDER BY timestamp ASC LIMIT 1) AS initial_price,
+                COALESCE(
+                    (SELECT open FROM kline_1d WHERE stock_key = s.stock_key ORDER BY ts ASC LIMIT 1),
+                    (SELECT open FROM kline_5m WHERE stock_key = s.stock_key ORDER BY ts ASC LIMIT 1)
+                ) AS initial_price,
                 s.current_price, s.volatility, s.industry
             FROM stocks s
             ORDER BY s.stock_id ASC
@@ -375,12 +952,12 @@ class DatabaseManager:
 
     async def add_subscriber(self, umo: str):
         """[DB] 添加一个新的订阅者。"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             await db.execute("INSERT INTO subscriptions (umo) VALUES (?)", (umo,))
             await db.commit()
 
     async def remove_subscriber(self, umo: str):
         """[DB] 移除一个订阅者。"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with aiosqlite.connect(self.ledger_db_path) as db:
             await db.execute("DELETE FROM subscriptions WHERE umo = ?", (umo,))
             await db.commit()
\ No newline at end of file
@@ -0,0 +1,39 @@
+# stock_market/export.py
+
+import json
+from datetime import datetime
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional
+
+if TYPE_CHECKING:
+    from .database import DatabaseManager
+
+# 导出粒度 -> K线表。1h/1d 为保留策略生成的汇总表，只包含已过期的历史区间
+KLINE_INTERVAL_TABLES = {'5m': 'kline_5m', '1h': 'kline_1h', '1d': 'kline_1d'}
+KLINE_INTERVAL_SECONDS = {'5m': 300, '1h': 3600, '1d': 86400}
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+CSV_HEADER = "stock_id,timestamp,ts,open,high,low,close\n"
+
+
+async def iter_kline_export(db_manager: "DatabaseManager", stock_ids: List[str], start_ts: Optional[int],
+                            end_ts: Optional[int], interval: str = '5m', fmt: str = 'csv',
+                            chunk_rows: int = 1000) -> AsyncIterator[str]:
+    """
+    逐块产出K线导出文本 (CSV 或 NDJSON)。
+    数据直接来自数据库游标，每块最多 chunk_rows 行，内存占用与导出总量无关。
+    """
+    if fmt == 'csv':
+        yield CSV_HEADER
+    lines = []
+    async for stock_id, ts, o, h, l, c in db_manager.iter_klines(
+            stock_ids, start_ts, end_ts, KLINE_INTERVAL_TABLES[interval]):
+        timestamp = datetime.fromtimestamp(ts).isoformat()
+        if fmt == 'csv':
+            lines.append(f"{stock_id},{timestamp},{ts},{o},{h},{l},{c}\n")
+        else:
+            lines.append(json.dumps({"stock_id": stock_id, "timestamp": timestamp, "ts": ts,
+                                     "open": o, "high": h, "low": l, "close": c}, ensure_ascii=False) + "\n")
+        if len(lines) >= chunk_rows:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
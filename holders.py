@@ -0,0 +1,110 @@
+# stock_market/holders.py
+
+import asyncio
+import time
+from bisect import bisect_left, insort
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from astrbot.api import logger
+from .config_defaults import NICKNAME_CACHE_TTL_SECONDS
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+
+class HolderIndex:
+    """
+    按股票维护的持有者索引，随每笔成交增量更新。
+    每支股票保存一个按 (-持股数, user_id) 有序的列表，取前K名只需切片，与持有者总数无关。
+    同一支股票内市值 = 持股数 × 现价，因此按市值排序与按持股数排序一致，共用同一顺序。
+    """
+    def __init__(self, plugin: "StockMarketRefactored"):
+        self.plugin = plugin
+        self._positions: Dict[str, Dict[str, Tuple[int, float]]] = {}  # stock_id -> {user_id: (quantity, cost_basis)}
+        self._ranked: Dict[str, List[Tuple[int, str]]] = {}            # stock_id -> [(-quantity, user_id)]
+        self.version = 0  # 任一持仓变化时递增，用于生成包含持仓数据的接口 ETag
+
+    async def load(self):
+        """从汇总持仓表重建整个索引。"""
+        positions: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        for user_id, stock_id, quantity, cost_basis in await self.plugin.db_manager.get_all_positions():
+            positions.setdefault(stock_id, {})[user_id] = (quantity, cost_basis)
+        self._positions = positions
+        self.version += 1
+        self._ranked = {
+            stock_id: sorted((-qty, user_id) for user_id, (qty, _) in holders.items())
+            for stock_id, holders in positions.items()
+        }
+        logger.info(f"持有者索引已加载: {sum(len(h) for h in positions.values())} 个持仓。")
+
+    def update(self, user_id: str, stock_id: str, quantity: int, cost_basis: float):
+        """某个持仓变化后调用 (quantity 为 0 表示已清仓)。"""
+        self.version += 1
+        holders = self._positions.setdefault(stock_id, {})
+        ranked = self._ranked.setdefault(stock_id, [])
+        previous = holders.pop(user_id, None)
+        if previous:
+            index = bisect_left(ranked, (-previous[0], user_id))
+            if index < len(ranked) and ranked[index] == (-previous[0], user_id):
+                del ranked[index]
+        if quantity > 0:
+            holders[user_id] = (quantity, cost_basis)
+            insort(ranked, (-quantity, user_id))
+
+    def holder_count(self, stock_id: str) -> int:
+        return len(self._positions.get(stock_id, ()))
+
+    def top(self, stock_id: str, k: int) -> List[Tuple[str, int, float]]:
+        """返回持股最多的前 k 名 (user_id, quantity, cost_basis)。"""
+        holders = self._positions.get(stock_id, {})
+        return [(user_id, -neg_qty, holders[user_id][1]) for neg_qty, user_id in self._ranked.get(stock_id, [])[:k]]
+
+
+class NicknameCache:
+    """
+    用户显示名称缓存 (带过期时间)。
+    优先级与 get_display_name 一致: nickname_api 自定义昵称 > economy_api 游戏内昵称。
+    没有昵称的用户也会缓存，避免重复查询。
+    """
+    def __init__(self, plugin: "StockMarketRefactored", ttl_seconds: float = NICKNAME_CACHE_TTL_SECONDS):
+        self.plugin = plugin
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, Optional[str]]] = {}
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, Optional[str]]:
+        """批量获取昵称，只为缓存缺失或过期的用户调用外部 API。"""
+        now = time.monotonic()
+        result: Dict[str, Optional[str]] = {}
+        missing = []
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                result[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        if not missing:
+            return result
+
+        fetched: Dict[str, Optional[str]] = {uid: None for uid in missing}
+        if self.plugin.nickname_api:
+            try:
+                custom_nicknames = await self.plugin.nickname_api.get_nicknames_batch(missing)
+                fetched.update({uid: name for uid, name in custom_nicknames.items() if name})
+            except Exception as e:
+                logger.warning(f"调用 nickname_api.get_nicknames_batch 时出错: {e}")
+        unresolved = [uid for uid in missing if not fetched[uid]]
+        if self.plugin.economy_api and unresolved:
+            profiles = await asyncio.gather(
+                *(self.plugin.economy_api.get_user_profile(uid) for uid in unresolved), return_exceptions=True)
+            for uid, profile in zip(unresolved, profiles):
+                if isinstance(profile, dict) and profile.get('nickname'):
+                    fetched[uid] = profile['nickname']
+
+        expires_at = now + self.ttl_seconds
+        for uid, name in fetched.items():
+            self._entries[uid] = (expires_at, name)
+        result.update(fetched)
+        return result
@@ -0,0 +1,114 @@
+# stock_market/kline_codec.py
+
+import json
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Optional
+
+from .database import to_epoch
+from .utils import decimation_buckets
+
+# 二进制K线格式 (小端):
+#   0   4 字节魔数 b'KLN1'
+#   4   u32 元数据长度 m (已用空格补齐到 4 的倍数，保证后续列按 4 字节对齐)
+#   8   m 字节 UTF-8 JSON 元数据: {"count": n, "decimated": bool, "user_holdings": [...]}
+#   8+m u32[n] 纪元秒, f32[n] 开盘, f32[n] 最高, f32[n] 最低, f32[n] 收盘
+# 每根K线 20 字节；价格为 float32，约 7 位有效数字，客户端按分四舍五入还原
+KLINE_BINARY_MAGIC = b'KLN1'
+KLINE_BINARY_CONTENT_TYPE = 'application/octet-stream'
+_HEADER = struct.Struct('<4sI')
+
+
+class KlineColumns:
+    """按列存放的K线 (纪元秒 + OHLC)，直接编码为二进制格式，不为每根K线构造 dict。"""
+    __slots__ = ('ts', 'open', 'high', 'low', 'close')
+
+    def __init__(self):
+        self.ts = array('I')
+        self.open = array('f')
+        self.high = array('f')
+        self.low = array('f')
+        self.close = array('f')
+
+    def append(self, ts: int, o: float, h: float, l: float, c: float):
+        self.ts.append(ts)
+        self.open.append(o)
+        self.high.append(h)
+        self.low.append(l)
+        self.close.append(c)
+
+    @classmethod
+    def from_klines(cls, klines: Iterable[Dict[str, Any]], timestamps: Optional[Iterable[int]] = None) -> "KlineColumns":
+        """
+        由 {"date", "open", "high", "low", "close"} 列表生成。
+        timestamps 为与 klines 一一对应的纪元秒 (如 VirtualStock.kline_ts)，给出时不再解析 date。
+        """
+        columns = cls()
+        if timestamps is None:
+            timestamps = (to_epoch(kline['date']) for kline in klines)
+        for ts, kline in zip(timestamps, klines):
+            columns.append(ts, kline['open'], kline['high'], kline['low'], kline['close'])
+        return columns
+
+    def decimate(self, max_points: int) -> "KlineColumns":
+        """与 utils.decimate_ohlc 相同的等根数分桶 OHLC 降采样，直接在列上计算。"""
+        n = len(self)
+        if max_points < 2 or n <= max_points:
+            return self
+        decimated = KlineColumns()
+        for start, end in decimation_buckets(n, max_points):
+            decimated.append(self.ts[start], self.open[start], max(self.high[start:end]), min(self.low[start:end]),
+                             self.close[end - 1])
+        decimated.append(self.ts[-1], self.open[-1], self.high[-1], self.low[-1], self.close[-1])
+        return decimated
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+def prefers_binary(accept: str) -> bool:
+    """
+    Accept 头是否选择二进制格式: application/octet-stream 必须显式列出且 q > 0，
+    并且不低于显式列出的 application/json (未列出时按 0 计)；通配符不会选中二进制。
+    """
+    weights = {}
+    for media_range in accept.split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[media_type.lower()] = weight
+    binary = weights.get(KLINE_BINARY_CONTENT_TYPE, 0.0)
+    return binary > 0 and binary >= weights.get('application/json', 0.0)
+
+
+def _encode_meta(meta: Dict[str, Any]) -> bytes:
+    body = json.dumps(meta).encode()
+    return body + b' ' * (-len(body) % 4)
+
+
+def encode_klines(columns: KlineColumns, user_holdings: Optional[list] = None, decimated: bool = False) -> bytes:
+    """decimated 表示K线经过降采样 (宽度不再是一个周期)，客户端据此决定能否把实时推送并入最后一根。"""
+    meta = _encode_meta({"count": len(columns), "decimated": decimated, "user_holdings": user_holdings or []})
+    parts = [_HEADER.pack(KLINE_BINARY_MAGIC, len(meta)), meta]
+    for column in (columns.ts, columns.open, columns.high, columns.low, columns.close):
+        if sys.byteorder == 'big':
+            column = array(column.typecode, column)
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+
+
+def replace_user_holdings(body: bytes, user_holdings: list) -> bytes:
+    """替换已编码数据中的 user_holdings (缓存里是游客版本)，列数据原样复用。"""
+    _, meta_len = _HEADER.unpack_from(body)
+    meta = json.loads(body[_HEADER.size:_HEADER.size + meta_len])
+    meta['user_holdings'] = user_holdings
+    new_meta = _encode_meta(meta)
+    return _HEADER.pack(KLINE_BINARY_MAGIC, len(new_meta)) + new_meta + body[_HEADER.size + meta_len:]
@@ -0,0 +1,122 @@
+# stock_market/ledger.py
+
+import asyncio
+from datetime import datetime, date
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from astrbot.api import logger
+from .config_defaults import TRADE_LEDGER_FLUSH_SECONDS, TRADE_LEDGER_BATCH_SIZE
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+class TradeLedger:
+    """
+    成交流水管理器。
+    成交发生时只在内存中追加记录并累加当日统计，由后台任务攒批写入 `trades` 表，
+    不占用交易本身的数据库往返。
+    """
+    def __init__(self, plugin: "StockMarketRefactored"):
+        self.plugin = plugin
+        self.task: Optional[asyncio.Task] = None
+        self._buffer: List[Tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_needed = asyncio.Event()
+        self._stopping = asyncio.Event()
+        # 当日成交统计: stock_id -> {'trades', 'shares', 'turnover'}，随每笔成交增量更新
+        self._volume_date: date = date.today()
+        self._daily_volume: Dict[str, Dict[str, float]] = {}
+
+    async def load(self):
+        """启动时从流水恢复当日成交统计 (只扫描今天的记录，走时间索引)。"""
+        today_start = datetime.combine(date.today(), datetime.min.time()).isoformat()
+        rows = await self.plugin.db_manager.get_trade_volume_since(today_start)
+        self._volume_date = date.today()
+        self._daily_volume = {
+            stock_id: {'trades': count, 'shares': shares or 0, 'turnover': turnover or 0.0}
+            for stock_id, count, shares, turnover in rows
+        }
+
+    def start(self):
+        """启动后台批量写入任务。"""
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._flush_loop())
+            logger.info("成交流水写入任务已启动。")
+
+    async def close(self):
+        """停止后台任务并写入剩余的缓冲记录。"""
+        # 不取消写入任务: 让它写完手上的批次后自行退出，避免正在写入的成交随取消丢失
+        self._stopping.set()
+        self._flush_needed.set()
+        if self.task and not self.task.done():
+            await self.task
+        await self.flush()
+
+    def record(self, user_id: str, stock_id: str, side: str, quantity: int, price: float, amount: float,
+               fee: float = 0.0, slippage: float = 0.0, realized_pnl: Optional[float] = None):
+        """记录一笔成交 (仅写入内存缓冲)。side 为 'buy' 或 'sell'。"""
+        self._buffer.append((user_id, stock_id, side, quantity, price, amount, fee, slippage, realized_pnl,
+                             datetime.now().isoformat()))
+
+        stats = self._get_volume_bucket(stock_id)
+        stats['trades'] += 1
+        stats['shares'] += quantity
+        stats['turnover'] += amount
+
+        if len(self._buffer) >= TRADE_LEDGER_BATCH_SIZE:
+            self._flush_needed.set()
+
+    def get_daily_volume(self, stock_id: str) -> Dict[str, float]:
+        """获取指定股票当日的成交笔数、成交股数和成交额。"""
+        return dict(self._get_volume_bucket(stock_id))
+
+    def _get_volume_bucket(self, stock_id: str) -> Dict[str, float]:
+        today = date.today()
+        if today != self._volume_date:
+            self._volume_date = today
+            self._daily_volume = {}
+        return self._daily_volume.setdefault(stock_id, {'trades': 0, 'shares': 0, 'turnover': 0.0})
+
+    async def get_history(self, user_id: Optional[str] = None, stock_id: Optional[str] = None,
+                          before_id: Optional[int] = None, limit: int = 20) -> List[dict]:
+        """查询成交记录。查询前先落盘缓冲，保证结果包含刚刚发生的成交。"""
+        await self.flush()
+        return await self.plugin.db_manager.get_trades(user_id, stock_id, before_id, limit)
+
+    async def flush(self):
+        """将缓冲中的记录一次性写入数据库，失败时放回缓冲等待下次重试。"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            write = asyncio.ensure_future(self.plugin.db_manager.insert_trades(batch))
+            try:
+                # 调用方被取消时写入照常完成；流水只追加，不能重放批次，否则可能重复写入
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                write.add_done_callback(lambda task: self._restore_failed_batch(task, batch))
+                raise
+            except Exception as e:
+                self._buffer[:0] = batch
+                logger.error(f"写入 {len(batch)} 条成交记录失败，将稍后重试: {e}", exc_info=True)
+
+    def _restore_failed_batch(self, task: asyncio.Future, batch: List[Tuple]):
+        if not task.cancelled() and task.exception() is not None:
+            self._buffer[:0] = batch
+            logger.error(f"写入 {len(batch)} 条成交记录失败，将稍后重试: {task.exception()}")
+
+    async def _flush_loop(self):
+        while not self._stopping.is_set():
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_needed.wait(), timeout=TRADE_LEDGER_FLUSH_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_needed.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                logger.info("成交流水写入任务被取消。")
+                break
+            except Exception as e:
+                logger.error(f"成交流水写入任务出现错误: {e}", exc_info=True)
+                await asyncio.sleep(TRADE_LEDGER_FLUSH_SECONDS)
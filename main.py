@@ -4,6 +4,7 @@ import asyncio
 import os
 from pathlib import Path
 import random
+from collections import deque
 from datetime import datetime, date, time, timedelta
 from typing import Optional, List, Dict, Any, Tuple
 from playwright.async_api import async_playwright, Browser, Error as PlaywrightError
@@ -31,12 +32,20 @@ except (ImportError, AttributeError):
 
 # --- 内部模块导入 ---
 from .config import DATA_DIR, TEMPLATES_DIR, SERVER_BASE_URL, SERVER_PUBLIC_IP, SERVER_PORT, IS_SERVER_DOMAIN, SERVER_DOMAIN, T_OPEN, T_CLOSE, SELL_LOCK_MINUTES, DEFAULT_LISTED_COMPANY_VOLATILITY, EARNINGS_SENSITIVITY_FACTOR, INTRINSIC_VALUE_PRESSURE_FACTOR
+from .config_defaults import STARTUP_KLINE_PRELOAD, HOLDER_BOARD_TOP_K, KLINE_CHART_MAX_CANDLES
 from .models import VirtualStock, MarketSimulator, MarketStatus
-from .utils import format_large_number, generate_user_hash, get_price_change_percentage_30m, get_stock_price_history_24h
+from .utils import format_large_number, generate_user_hash, decimate_ohlc, get_price_change_percentage_30m, get_stock_price_history_24h
 from .api import StockMarketAPI
 from .database import DatabaseManager
 from .simulation import MarketSimulation
 from .trading import TradingManager
+from .ledger import TradeLedger
+from .maintenance import MaintenanceManager
+from .snapshot import SnapshotManager
+from .persistence import PersistenceQueue
+from .holders import HolderIndex, NicknameCache
+from .export import iter_kline_export, EXPORT_CONTENT_TYPES
+from .columnar import export_market_history, import_market_history, read_holdings, FILE_SUFFIXES
 from .web_server import WebServer
 from .treemap_generator import create_market_treemap
 
@@ -52,6 +61,7 @@ class StockMarketRefactored(Star):
         self.market_status: MarketStatus = MarketStatus.CLOSED
         self.market_simulator = MarketSimulator()
         self.last_update_date: Optional[date] = None
+        self.tick_version: int = 0  # 每完成一次 tick 或管理员修改行情数据后递增 (见 mark_market_changed)
         self.broadcast_subscribers = set()
         self.pending_verifications: Dict[str, Dict[str, Any]] = {}
 
@@ -65,21 +75,36 @@ class StockMarketRefactored(Star):
         
         # --- 模块化管理器 ---
         self.db_path = os.path.join(DATA_DIR, "stock_market.db")
+        self.ledger_db_path = os.path.join(DATA_DIR, "stock_market_ledger.db")
+        self.snapshot_path = os.path.join(DATA_DIR, "market_state.snap")
         self.db_manager: Optional[DatabaseManager] = None
         self.simulation_manager: Optional[MarketSimulation] = None
         self.trading_manager: Optional[TradingManager] = None
+        self.trade_ledger: Optional[TradeLedger] = None
+        self.maintenance_manager: Optional[MaintenanceManager] = None
+        self.snapshot_manager: Optional[SnapshotManager] = None
+        self.persistence_queue: Optional[PersistenceQueue] = None
+        self.holder_index: Optional[HolderIndex] = None
+        self.nickname_cache = NicknameCache(self)
         self.web_server: Optional[WebServer] = None
         self.pending_password_resets: Dict[str, Dict[str, Any]] = {}
         self.api = StockMarketAPI(self)
         self._ready_event = asyncio.Event()
+        self.klines_ready = asyncio.Event()  # 完整K线历史补全后置位
+        self.hydrate_task: Optional[asyncio.Task] = None
         # --- 初始化任务 ---
         self.init_task = asyncio.create_task(self.plugin_init())
     async def terminate(self):
         logger.info("开始关闭模拟炒股插件...")
         shared_services.pop("stock_market_api", None) # <--- 修改此行
         if self.init_task and not self.init_task.done(): self.init_task.cancel()
+        if self.hydrate_task and not self.hydrate_task.done(): self.hydrate_task.cancel()
         if self.simulation_manager: self.simulation_manager.stop()
+        if self.persistence_queue: await self.persistence_queue.close()
+        if self.snapshot_manager and self._ready_event.is_set(): await self.snapshot_manager.save()
+        if self.maintenance_manager: self.maintenance_manager.stop()
         if self.web_server: await self.web_server.stop()
+        if self.trade_ledger: await self.trade_ledger.close()
         await self._close_playwright_browser()
         logger.info("模拟炒股插件已成功关闭。")
 
@@ -87,21 +112,65 @@ class StockMarketRefactored(Star):
         """插件的异步初始化流程。"""
         await self._wait_for_services()
         
-        self.db_manager = DatabaseManager(self.db_path)
+        self.db_manager = DatabaseManager(self.db_path, self.ledger_db_path)
         await self.db_manager.initialize()
-        self.stocks = await self.db_manager.load_stocks()
+        load_start = asyncio.get_event_loop().time()
+        self.snapshot_manager = SnapshotManager(self, self.snapshot_path)
+        snapshot = await self.snapshot_manager.read()
+        self.stocks = await self.db_manager.load_stocks(0 if snapshot else STARTUP_KLINE_PRELOAD)
+        if snapshot and self.snapshot_manager.apply(snapshot):
+            self.klines_ready.set()
+        else:
+            if snapshot:
+                self.stocks = await self.db_manager.load_stocks(STARTUP_KLINE_PRELOAD)
+            self.hydrate_task = asyncio.create_task(self._hydrate_kline_history())
         self.broadcast_subscribers = await self.db_manager.load_subscriptions()
+        self.holder_index = HolderIndex(self)
+        await self.holder_index.load()
+        self.db_manager.on_position_changed = self.holder_index.update
+        logger.info(f"行情数据加载完成，用时 {(asyncio.get_event_loop().time() - load_start) * 1000:.0f} ms。")
         
         await self._start_playwright_browser()
+        self.persistence_queue = PersistenceQueue(self)
         self.simulation_manager = MarketSimulation(self)
         self.trading_manager = TradingManager(self)
+        self.trade_ledger = TradeLedger(self)
+        await self.trade_ledger.load()
+        self.maintenance_manager = MaintenanceManager(self)
         self.web_server = WebServer(self)
+        self.persistence_queue.start()
         self.simulation_manager.start()
+        self.trade_ledger.start()
+        self.maintenance_manager.start()
         await self.web_server.start()
         shared_services["stock_market_api"] = self.api
-        logger.info(f"模拟炒股插件已加载。数据库: {self.db_path}")
+        logger.info(f"模拟炒股插件已加载。行情数据库: {self.db_path}，账本数据库: {self.ledger_db_path}")
         self._ready_event.set()
 
+    async def _hydrate_kline_history(self):
+        """后台一次性补全所有股票的完整K线历史，并与加载期间新产生的K线合并。"""
+        try:
+            start = asyncio.get_event_loop().time()
+            maxlen = next(iter(self.stocks.values())).kline_history.maxlen if self.stocks else 0
+            if maxlen > STARTUP_KLINE_PRELOAD:
+                history = await self.db_manager.load_kline_history(maxlen)
+                for stock_id, klines in history.items():
+                    stock = self.stocks.get(stock_id)
+                    if not stock or not klines:
+                        continue
+                    # 内存中的K线可能已包含查询期间新增的 tick，只补充比它更早的部分
+                    first_date = stock.kline_history[0]['date'] if stock.kline_history else None
+                    older = [k for k in klines if first_date is None or k['date'] < first_date]
+                    stock.kline_history = deque(older + list(stock.kline_history), maxlen=maxlen)
+                    stock.rebuild_derived()
+            logger.info(f"K线历史补全完成，用时 {(asyncio.get_event_loop().time() - start) * 1000:.0f} ms。")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"补全K线历史失败，仅保留最近 {STARTUP_KLINE_PRELOAD} 根K线: {e}", exc_info=True)
+        finally:
+            self.klines_ready.set()
+
     async def _start_playwright_browser(self):
         """启动并初始化 Playwright 浏览器实例"""
         try:
@@ -171,6 +240,10 @@ class StockMarketRefactored(Star):
             if s.name == identifier: return s
         return None
 
+    def mark_market_changed(self):
+        """tick 之外修改了股票数据 (管理员操作) 后调用，使依赖 tick_version 的 ETag 和缓存失效。"""
+        self.tick_version += 1
+
     async def get_display_name(self, user_id: str) -> str:
         """
         获取用户的最佳显示名称。
@@ -204,9 +277,9 @@ class StockMarketRefactored(Star):
             return None
 
         # --- 计算24小时数据 ---
-        k_history_24h = list(stock.kline_history)[-288:] # 最近24小时 (288 * 5分钟)
+        k_history_24h = stock.recent_klines(stock.window_24h.size) # 最近24小时 (288 * 5分钟)
         
-        day_open = k_history_24h[0]['open'] if k_history_24h else stock.previous_close
+        day_open = stock.window_24h.open if len(stock.window_24h) else stock.previous_close
         day_close = stock.current_price
         
         change = day_close - day_open
@@ -239,6 +312,7 @@ class StockMarketRefactored(Star):
             "day_open": round(day_open, 2),
             "day_close": round(day_close, 2),
             "short_term_trend": trend_text,
+            "volume_today": self.trade_ledger.get_daily_volume(stock.stock_id) if self.trade_ledger else None,
             "kline_data_24h": k_history_24h
         }
 
@@ -267,16 +341,22 @@ class StockMarketRefactored(Star):
             df = pd.DataFrame(kline_data)
             df['date'] = pd.to_datetime(df['date'])
             df.set_index('date', inplace=True)
-            df.rename(columns={"open": "Open", "high": "High", "low": "Low", "close": "Close"}, inplace=True)
 
             if granularity > 5:
                 rule = f'{granularity}T'
                 logger.info(f"开始将数据聚合为 {rule} 周期...")
                 df = df.resample(rule).agg({
-                    'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'
+                    'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'
                 }).dropna()
                 logger.info(f"数据聚合完成，剩余 {len(df)} 个数据点。")
 
+            if len(df) > KLINE_CHART_MAX_CANDLES:
+                # 蜡烛过密时分桶合并，保留桶内高低点
+                records = decimate_ohlc(df.reset_index().to_dict('records'), KLINE_CHART_MAX_CANDLES)
+                df = pd.DataFrame(records).set_index('date')
+                logger.info(f"K线降采样完成，剩余 {len(df)} 个数据点。")
+            df.rename(columns={"open": "Open", "high": "High", "low": "Low", "close": "Close"}, inplace=True)
+
             # --- 【样式与颜色设置 】 ---
             mc = mpf.make_marketcolors(up='#ff4747', down='#00b060', inherit=True)
             style = mpf.make_mpf_style(
@@ -526,10 +606,10 @@ class StockMarketRefactored(Star):
         yield event.plain_result(reply)
 
     @filter.permission_type(filter.PermissionType.ADMIN)
-    @filter.command("股东列表", alias={"持股查询"})
+    @filter.command("股东列表", alias={"持股查询", "持仓榜"})
     async def stock_holders(self, event: AstrMessageEvent, stock_identifier: str):
         """
-        查询指定股票的持股用户列表及其详细盈亏信息。
+        查询指定股票持股最多的前几名用户及其详细盈亏信息。
         用法: /股东列表 [股票代码/名称]
         """
         # 1. 验证输入并查找股票
@@ -543,53 +623,26 @@ class StockMarketRefactored(Star):
             yield event.plain_result(f"❌ 找不到股票 `'{stock_identifier}'`。请检查代码或名称是否正确。")
             return
 
-        # 2. 从数据库查询该股票的所有持仓记录
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "SELECT user_id, quantity, purchase_price FROM holdings WHERE stock_id=?",
-                (stock.stock_id,)
-            )
-            raw_holdings = await cursor.fetchall()
+        # 2. 从持有者索引取前K名 (已按持股数量降序，同一股票内即市值降序)
+        top_holders = self.holder_index.top(stock.stock_id, HOLDER_BOARD_TOP_K)
+        holder_count = self.holder_index.holder_count(stock.stock_id)
 
-        if not raw_holdings:
+        if not top_holders:
             yield event.plain_result(f"ℹ️ 当前无人持有 **【{stock.name}】**。")
             return
 
-        # 3. 按 user_id 聚合数据
-        holders_data = {}
-        for user_id, qty, price in raw_holdings:
-            if user_id not in holders_data:
-                holders_data[user_id] = {'quantity': 0, 'cost_basis': 0.0}
-            holders_data[user_id]['quantity'] += qty
-            holders_data[user_id]['cost_basis'] += qty * price
-
-        # 4. 【核心修正V2：确保自定义昵称的最高优先级】
-        user_ids = list(holders_data.keys())
-        final_names = {}
+        # 3. 只为上榜用户解析昵称 (带缓存)
+        final_names = await self.nickname_cache.get_many([user_id for user_id, _, _ in top_holders])
 
-        if self.economy_api:
-            profile_tasks = [self.economy_api.get_user_profile(uid) for uid in user_ids]
-            profiles = await asyncio.gather(*profile_tasks)
-            for profile in profiles:
-                if profile and profile.get('nickname'):
-                    final_names[profile['user_id']] = profile['nickname']
-
-        if self.nickname_api:
-            custom_nicknames = await self.nickname_api.get_nicknames_batch(user_ids)
-            final_names.update(custom_nicknames)
-
-        # 5. 计算每个用户的盈亏详情
-        holder_details_list = []
-        for user_id, data in holders_data.items():
+        # 4. 计算每个用户的盈亏详情
+        sorted_holders = []
+        for user_id, quantity, cost_basis in top_holders:
             display_name = final_names.get(user_id) or f"用户({user_id[:6]}...)"
-
-            quantity = data['quantity']
-            cost_basis = data['cost_basis']
             market_value = quantity * stock.current_price
             pnl = market_value - cost_basis
             pnl_percent = (pnl / cost_basis) * 100 if cost_basis > 0 else 0
 
-            holder_details_list.append({
+            sorted_holders.append({
                 'name': display_name,
                 'quantity': quantity,
                 'market_value': market_value,
@@ -597,13 +650,10 @@ class StockMarketRefactored(Star):
                 'pnl_percent': pnl_percent
             })
 
-        # 6. 按持股数量从高到低排序
-        sorted_holders = sorted(holder_details_list, key=lambda x: x['quantity'], reverse=True)
-
-        # 7. 构建包含 Markdown 表格语法的字符串
+        # 5. 构建包含 Markdown 表格语法的字符串
         response_lines = [
             f"### 📊 【**{stock.name}** ({stock.stock_id})】股东盈亏榜",
-            f"**当前价格:** `${stock.current_price:.2f}`",
+            f"**当前价格:** `${stock.current_price:.2f}`　**持有人数:** {holder_count}",
             "| 排名 | 股东 | 持仓(股) | 市值 | 盈亏 | 盈亏比例 |",
             "| :--: | :--- | :---: | :---: | :---: | :---: |"
         ]
@@ -622,7 +672,7 @@ class StockMarketRefactored(Star):
         
         markdown_text = "\n".join(response_lines)
         
-        # 8. 【核心修改】将 Markdown 文本转换为图片并发送
+        # 6. 【核心修改】将 Markdown 文本转换为图片并发送
         url = await self.text_to_image(markdown_text)
         yield event.image_result(url)
 
@@ -644,22 +694,19 @@ class StockMarketRefactored(Star):
             return
 
         # --- 基础价格计算 ---
-        last_price = k_history[-2]['close']
+        window = stock.window_24h
+        last_price = window.previous_close() if len(window) >= 2 else k_history[-2]['close']
         change = stock.current_price - last_price
         change_percent = (change / last_price) * 100 if last_price > 0 else 0
         emoji = "📈" if change > 0 else "📉" if change < 0 else "➖"
         
-        # --- 增强信息计算 ---
-        relevant_history = list(k_history)[-288:]
-        day_high = max(k['high'] for k in relevant_history) if relevant_history else stock.current_price
-        day_low = min(k['low'] for k in relevant_history) if relevant_history else stock.current_price
-        day_open = relevant_history[0]['open'] if relevant_history else stock.previous_close
-
-        sma5_text = "数据不足"
-        if len(k_history) >= 5:
-            recent_closes = [k['close'] for k in list(k_history)[-5:]]
-            sma5 = sum(recent_closes) / 5
-            sma5_text = f"${sma5:.2f}"
+        # --- 增强信息计算 (读取滚动窗口，不扫描K线) ---
+        day_high = window.high if len(window) else stock.current_price
+        day_low = window.low if len(window) else stock.current_price
+        day_open = window.open if len(window) else stock.previous_close
+
+        sma5 = stock.window_1h.sma(5)
+        sma5_text = f"${sma5:.2f}" if sma5 is not None else "数据不足"
             
         # --- 获取内部趋势状态 (基于动能值转换) ---
         momentum = stock.intraday_momentum
@@ -684,6 +731,9 @@ class StockMarketRefactored(Star):
             f"短期趋势: {current_trend_text}\n"
             f"所属行业: {stock.industry}"
         )
+        if self.trade_ledger:
+            volume = self.trade_ledger.get_daily_volume(stock.stock_id)
+            reply += f"\n今日成交: {volume['shares']} 股 / {format_large_number(volume['turnover'])} 金币 ({volume['trades']} 笔)"
         yield event.plain_result(reply)
 
     @filter.command("K线", alias={"k线图", "k线", "K线图"})
@@ -720,7 +770,7 @@ class StockMarketRefactored(Star):
         screenshot_path = ""
         try:
             # 依然获取288个5分钟数据点作为基础数据源
-            kline_data_for_image = list(stock.kline_history)[-288:]
+            kline_data_for_image = stock.recent_klines(288)
             
             # 调用新的绘图函数，并传入颗粒度
             screenshot_path = await self._generate_kline_chart_image(
@@ -998,6 +1048,36 @@ class StockMarketRefactored(Star):
         
         yield event.plain_result("\n".join(response_lines))
 
+    @filter.command("交易记录", alias={"成交记录", "我的交易"})
+    async def trade_history(self, event: AstrMessageEvent, identifier: Optional[str] = None):
+        """查看我最近的成交记录，可指定股票"""
+        await self._ready_event.wait()
+        user_id = event.get_sender_id()
+        stock_id = None
+        if identifier:
+            stock = await self.find_stock(str(identifier))
+            if not stock:
+                yield event.plain_result(f"❌ 找不到标识符为 '{identifier}' 的股票。")
+                return
+            stock_id = stock.stock_id
+
+        trades = await self.trade_ledger.get_history(user_id=user_id, stock_id=stock_id, limit=10)
+        if not trades:
+            yield event.plain_result("您还没有任何成交记录。")
+            return
+
+        response_lines = [f"🧾 {event.get_sender_name()} 最近的成交记录：\n----------------"]
+        for t in trades:
+            stock = self.stocks.get(t['stock_id'])
+            stock_name = stock.name if stock else t['stock_id']
+            trade_time = datetime.fromisoformat(t['timestamp']).strftime('%m-%d %H:%M')
+            if t['side'] == 'buy':
+                response_lines.append(f"🟥 {trade_time} 买入 {stock_name} {t['quantity']}股 @ ${t['price']:.2f}")
+            else:
+                response_lines.append(f"🟩 {trade_time} 卖出 {stock_name} {t['quantity']}股 @ ${t['price']:.2f}, "
+                                      f"手续费 {t['fee']:.2f}, 盈亏 {t['realized_pnl']:+.2f}")
+        yield event.plain_result("\n".join(response_lines))
+
     @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("添加股票")
     async def admin_add_stock(self, event: AstrMessageEvent, stock_id: str, name: str, initial_price: float, volatility: float = 0.05, industry: str = "综合"):
@@ -1015,6 +1095,7 @@ class StockMarketRefactored(Star):
         stock = VirtualStock(stock_id=stock_id, name=name, current_price=initial_price, volatility=volatility, industry=industry)
         stock.price_history.append(initial_price)
         self.stocks[stock_id] = stock
+        self.mark_market_changed()
         
         yield event.plain_result(f"✅ 成功添加股票: {name} ({stock_id})")
 
@@ -1036,6 +1117,7 @@ class StockMarketRefactored(Star):
         
         # 更新內存
         del self.stocks[stock_id]
+        self.mark_market_changed()
         yield event.plain_result(f"🗑️ 已成功删除股票 {stock_name} ({stock_id}) 及其所有持仓和历史数据。")
 
 
@@ -1056,6 +1138,7 @@ class StockMarketRefactored(Star):
             # 【修正】调用 db_manager
             await self.db_manager.update_stock_name(old_stock_id, value)
             stock.name = value
+            self.mark_market_changed()
             yield event.plain_result(f"✅ 成功将股票 {old_stock_id} 的名称修改为: {value}")
 
         elif param in ("stock_id", "股票代码","代码"):
@@ -1064,10 +1147,14 @@ class StockMarketRefactored(Star):
                 yield event.plain_result(f"❌ 操作失败：新的股票代码 {new_stock_id} 已存在！")
                 return
             try:
-                # 【修正】调用 db_manager
-                await self.db_manager.update_stock_id(old_stock_id, new_stock_id)
-                stock.stock_id = new_stock_id
-                self.stocks[new_stock_id] = self.stocks.pop(old_stock_id)
+                # 改写期间暂停写后队列的提交，并把缓冲中旧代码的数据改记到新代码下，避免K线因找不到旧代码被丢弃
+                async with self.persistence_queue.hold_commits():
+                    await self.db_manager.update_stock_id(old_stock_id, new_stock_id)
+                    self.persistence_queue.rename_stock(old_stock_id, new_stock_id)
+                    stock.stock_id = new_stock_id
+                    self.stocks[new_stock_id] = self.stocks.pop(old_stock_id)
+                await self.holder_index.load()
+                self.mark_market_changed()
                 yield event.plain_result(f"✅ 成功将股票代码 {old_stock_id} 修改为: {new_stock_id}，所有关联数据已同步更新。")
             except Exception as e:
                 logger.error(f"修改股票代码时发生数据库错误: {e}", exc_info=True)
@@ -1077,6 +1164,7 @@ class StockMarketRefactored(Star):
             # 【修正】调用 db_manager
             await self.db_manager.update_stock_industry(old_stock_id, value)
             stock.industry = value
+            self.mark_market_changed()
             yield event.plain_result(f"✅ 成功将股票 {old_stock_id} 的行业修改为: {value}")
             
         elif param in ("volatility", "波动率"):
@@ -1085,6 +1173,7 @@ class StockMarketRefactored(Star):
                 # 【修正】调用 db_manager
                 await self.db_manager.update_stock_volatility(old_stock_id, new_vol)
                 stock.volatility = new_vol
+                self.mark_market_changed()
                 yield event.plain_result(f"✅ 成功将股票 {old_stock_id} 的波动率修改为: {new_vol:.4f}")
             except ValueError:
                 yield event.plain_result("❌ 波动率必须是有效的数字。")
@@ -1115,9 +1204,11 @@ class StockMarketRefactored(Star):
         # 1. 更新内存中的价格
         stock.current_price = new_price
         stock.price_history.append(new_price)
+        self.mark_market_changed()
 
-        # 2. 【修正】调用 db_manager 更新数据库
-        await self.db_manager.update_stock_price(stock_id, new_price)
+        # 2. 经写后队列落库: 缓冲中同一股票较旧的价格被新价格覆盖，不会在之后提交而改回旧价
+        self.persistence_queue.enqueue([(stock_id, new_price, stock.market_pressure)], [])
+        await self.persistence_queue.flush()
         
         # 3. 发送成功确认信息
         yield event.plain_result(
@@ -1195,6 +1286,172 @@ class StockMarketRefactored(Star):
         full_response = "```\n" + "\n".join(response_lines) + "\n```"
         yield event.plain_result(full_response)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("整理持仓")
+    async def admin_consolidate_holdings(self, event: AstrMessageEvent):
+        """[管理员] 立即合并所有已解锁的碎片持仓"""
+        await self._ready_event.wait()
+        yield event.plain_result("正在合并已解锁的碎片持仓，请稍候...")
+        try:
+            reclaimed = await self.maintenance_manager.consolidate_holdings()
+        except Exception as e:
+            logger.error(f"手动整理持仓时出错: {e}", exc_info=True)
+            yield event.plain_result("❌ 整理持仓时出错，请检查日志。")
+            return
+        yield event.plain_result(f"✅ 持仓整理完成，共回收 {reclaimed} 行持仓记录。")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("清理K线")
+    async def admin_kline_retention(self, event: AstrMessageEvent):
+        """[管理员] 立即执行K线保留策略 (汇总并删除过期K线)"""
+        await self._ready_event.wait()
+        yield event.plain_result("正在汇总并清理过期K线，请稍候...")
+        try:
+            deleted = await self.maintenance_manager.run_kline_retention()
+        except Exception as e:
+            logger.error(f"手动清理K线时出错: {e}", exc_info=True)
+            yield event.plain_result("❌ 清理K线时出错，请检查日志。")
+            return
+        yield event.plain_result(
+            f"✅ K线清理完成。\n已删除5分钟K: {deleted['kline_5m']} 行\n已删除小时K: {deleted['kline_1h']} 行"
+        )
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("备份数据库")
+    async def admin_backup(self, event: AstrMessageEvent):
+        """[管理员] 立即在线备份行情库和账本库 (不暂停交易)"""
+        await self._ready_event.wait()
+        yield event.plain_result("正在在线备份数据库，请稍候...")
+        try:
+            results = await self.maintenance_manager.run_backup()
+        except Exception as e:
+            logger.error(f"备份数据库时出错: {e}", exc_info=True)
+            yield event.plain_result(f"❌ 备份失败: {e}")
+            return
+        lines = [f"{os.path.basename(r['path'])}: {r['size_mb']} MB, 用时 {r['total_seconds']} 秒" for r in results]
+        yield event.plain_result("✅ 备份完成，已通过完整性校验。\n" + "\n".join(lines))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导出K线")
+    async def admin_export_kline(self, event: AstrMessageEvent, identifier: str = "all", days: int = 30, fmt: str = "csv"):
+        """[管理员] 导出K线到数据目录。用法: /导出K线 [股票|all] [天数] [csv|ndjson]"""
+        await self._ready_event.wait()
+        fmt = str(fmt).lower()
+        if fmt not in EXPORT_CONTENT_TYPES:
+            yield event.plain_result("❌ 格式必须是 csv 或 ndjson。")
+            return
+        if str(identifier).lower() == "all":
+            stock_ids = sorted(self.stocks)
+        else:
+            stock = await self.find_stock(str(identifier))
+            if not stock:
+                yield event.plain_result(f"❌ 找不到标识符为 '{identifier}' 的股票。")
+                return
+            stock_ids = [stock.stock_id]
+
+        export_dir = os.path.join(DATA_DIR, "exports")
+        os.makedirs(export_dir, exist_ok=True)
+        label = "all" if len(stock_ids) > 1 else stock_ids[0]
+        path = os.path.join(export_dir, f"kline_{label}_{datetime.now():%Y%m%d%H%M%S}.{fmt}")
+        start_ts = int((datetime.now() - timedelta(days=int(days))).timestamp())
+        yield event.plain_result(f"正在导出 {len(stock_ids)} 支股票最近 {days} 天的K线，请稍候...")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                async for chunk in iter_kline_export(self.db_manager, stock_ids, start_ts, None, '5m', fmt):
+                    await asyncio.to_thread(f.write, chunk)
+        except Exception as e:
+            logger.error(f"导出K线时出错: {e}", exc_info=True)
+            yield event.plain_result("❌ 导出K线时出错，请检查日志。")
+            return
+        yield event.plain_result(f"✅ K线导出完成 ({os.path.getsize(path) / 1024:.1f} KB)。\n文件: {path}")
+
+    async def _await_with_progress(self, task: asyncio.Task, progress: Dict[str, Any], label: str):
+        """等待后台线程任务完成，期间每30秒产出一条进度消息。"""
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=30)
+            if done:
+                return
+            if progress.get('total'):
+                yield f"⏳ {label}进度: {progress['done']}/{progress['total']} ({progress['desc']})"
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导出历史")
+    async def admin_export_history(self, event: AstrMessageEvent, fmt: str = "parquet"):
+        """[管理员] 将股票、持仓和全部K线导出为按股票/月份分区的列式文件 (parquet|arrow，需要 pyarrow)"""
+        await self._ready_event.wait()
+        fmt = str(fmt).lower()
+        if fmt not in FILE_SUFFIXES:
+            yield event.plain_result("❌ 格式必须是 parquet 或 arrow。")
+            return
+        await self.persistence_queue.flush()
+        output_dir = os.path.join(DATA_DIR, "columnar", datetime.now().strftime("%Y%m%d%H%M%S"))
+        progress: Dict[str, Any] = {}
+        task = asyncio.create_task(asyncio.to_thread(
+            export_market_history, self.db_path, self.ledger_db_path, output_dir, fmt,
+            lambda done, total, desc: progress.update(done=done, total=total, desc=desc)))
+        yield event.plain_result(f"正在导出市场历史到 {output_dir} ，请稍候...")
+        async for message in self._await_with_progress(task, progress, "导出"):
+            yield event.plain_result(message)
+        try:
+            counts = task.result()
+        except Exception as e:
+            logger.error(f"列式导出失败: {e}", exc_info=True)
+            yield event.plain_result(f"❌ 导出失败: {e}")
+            return
+        summary = "\n".join(f"{name}: {count} 行" for name, count in counts.items())
+        yield event.plain_result(f"✅ 导出完成。\n{summary}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导入历史")
+    async def admin_import_history(self, event: AstrMessageEvent, directory: str):
+        """[管理员] 从 /导出历史 生成的目录批量导入 (目录名或绝对路径)，K线需重启插件后载入内存"""
+        await self._ready_event.wait()
+        input_dir = directory if os.path.isabs(directory) else os.path.join(DATA_DIR, "columnar", directory)
+        if not os.path.isdir(input_dir):
+            yield event.plain_result(f"❌ 找不到目录: {input_dir}")
+            return
+        await self.persistence_queue.flush()
+        progress: Dict[str, Any] = {}
+        task = asyncio.create_task(asyncio.to_thread(
+            import_market_history, self.db_path, input_dir,
+            lambda done, total, desc: progress.update(done=done, total=total, desc=desc)))
+        yield event.plain_result(f"正在从 {input_dir} 导入市场历史，请稍候...")
+        async for message in self._await_with_progress(task, progress, "导入"):
+            yield event.plain_result(message)
+        try:
+            counts = task.result()
+            holdings = await asyncio.to_thread(read_holdings, input_dir)
+            if holdings is not None:
+                counts['holdings'] = await self.db_manager.import_holdings(*holdings)
+                if counts['holdings']:
+                    await self.holder_index.load()
+        except Exception as e:
+            logger.error(f"列式导入失败: {e}", exc_info=True)
+            yield event.plain_result(f"❌ 导入失败: {e}")
+            return
+        summary = "\n".join(f"{name}: {count} 行" for name, count in counts.items())
+        yield event.plain_result(f"✅ 导入完成，持仓已即时生效，股票与K线需重启插件后载入内存。\n{summary}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("写入队列", alias={"持久化状态"})
+    async def admin_persistence_status(self, event: AstrMessageEvent):
+        """[管理员] 查看行情数据写后队列的深度与提交耗时"""
+        await self._ready_event.wait()
+        stats = self.persistence_queue.get_stats()
+        last_commit = datetime.fromtimestamp(stats['last_commit_at']).strftime('%H:%M:%S') if stats['last_commit_at'] else "尚未提交"
+        reply = (
+            f"【行情写入队列】\n"
+            f"--------------------\n"
+            f"待写入: {stats['depth']} 行 (价格 {stats['pending_prices']} / K线 {stats['pending_klines']})\n"
+            f"已提交: {stats['commits']} 次, 失败: {stats['failures']} 次\n"
+            f"提交耗时: 最近 {stats['last_commit_ms']:.1f} ms / 最大 {stats['max_commit_ms']:.1f} ms\n"
+            f"最近提交: {last_commit}\n"
+            f"已丢弃K线: {stats['dropped_klines']} 根"
+        )
+        if stats['last_error']:
+            reply += f"\n最近错误: {stats['last_error']}"
+        yield event.plain_result(reply)
+
     @filter.command("订阅股票", alias={"订阅市场"})
     async def subscribe_news(self, event: AstrMessageEvent):
         """订阅随机市场事件快讯"""
@@ -1472,6 +1729,7 @@ class StockMarketRefactored(Star):
 /webk - 在线网页K线图及持仓信息(推荐)
 
 /资产 - 查看您的当前总资产
+/交易记录 [标识符] - 查看您最近的成交记录
 【交易指令】
 /买入 <标识符> <数量> - 买入指定数量股票
 /卖出 <标识符> <数量> - 卖出指定数量股票
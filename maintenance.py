@@ -0,0 +1,150 @@
+# stock_market/maintenance.py
+
+import asyncio
+import time
+from datetime import datetime, date, timedelta
+from typing import TYPE_CHECKING, Optional, Dict, List
+
+from astrbot.api import logger
+from .models import MarketStatus
+from .backup import backup_database
+from .config_defaults import (HOLDINGS_CONSOLIDATION_INTERVAL_MINUTES, HOLDINGS_CONSOLIDATION_BATCH_SIZE,
+                              KLINE_RAW_RETENTION_DAYS, KLINE_HOURLY_RETENTION_DAYS, KLINE_PRUNE_BATCH_SIZE,
+                              KLINE_ROLLUP_WINDOW_DAYS,
+                              BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, BACKUP_STEP_PAGES,
+                              BACKUP_STEP_SLEEP)
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+class MaintenanceManager:
+    """后台数据库维护任务，只在市场空闲时段分批执行，不与 tick 落库抢写锁。"""
+    def __init__(self, plugin: "StockMarketRefactored"):
+        self.plugin = plugin
+        self.task: Optional[asyncio.Task] = None
+        self._consolidation_lock = asyncio.Lock()
+        self._retention_lock = asyncio.Lock()
+        self._backup_lock = asyncio.Lock()
+        self._last_retention_date: Optional[date] = None
+
+    def start(self):
+        """启动后台维护循环。"""
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._maintenance_loop())
+            logger.info("后台维护任务已启动。")
+
+    def stop(self):
+        """停止后台维护循环。"""
+        if self.task and not self.task.done():
+            self.task.cancel()
+            logger.info("后台维护任务已停止。")
+
+    async def _wait_for_quiet_period(self):
+        """休市时立即返回；交易时段等到两个 tick 之间 (每个5分钟周期的中点)。"""
+        status, _ = self.plugin.get_market_status_and_wait()
+        if status != MarketStatus.OPEN:
+            return
+        now = datetime.now()
+        seconds_into_interval = (now.minute % 5) * 60 + now.second
+        await asyncio.sleep((150 - seconds_into_interval) % 300)
+
+    async def consolidate_holdings(self) -> int:
+        """分批合并所有已解锁的碎片持仓，返回总共减少的行数。"""
+        async with self._consolidation_lock:
+            total_reclaimed = 0
+            while True:
+                reclaimed = await self.plugin.db_manager.consolidate_unlocked_lots(HOLDINGS_CONSOLIDATION_BATCH_SIZE)
+                if reclaimed == 0:
+                    break
+                total_reclaimed += reclaimed
+                await asyncio.sleep(0.1)  # 批次之间让出写锁给交易
+            if total_reclaimed:
+                logger.info(f"[持仓整理] 已合并碎片持仓，共回收 {total_reclaimed} 行。")
+            return total_reclaimed
+
+    async def run_kline_retention(self) -> Dict[str, int]:
+        """
+        执行K线保留策略：过期的5分钟K线先按时间窗口分批汇总为小时K/日K，再分批删除；过期的小时K直接分批删除。
+        保留期按自然日对齐，保证被汇总的小时/日桶总是完整的。返回各表删除的行数。
+        """
+        async with self._retention_lock:
+            today_start = datetime.combine(date.today(), datetime.min.time())
+            raw_cutoff = int((today_start - timedelta(days=KLINE_RAW_RETENTION_DAYS)).timestamp())
+            hourly_cutoff = int((today_start - timedelta(days=KLINE_HOURLY_RETENTION_DAYS)).timestamp())
+            db_manager = self.plugin.db_manager
+            deleted = {'kline_5m': 0, 'kline_1h': 0}
+
+            for stock_key in db_manager.get_stock_keys().values():
+                await self._rollup_expired_klines(stock_key, raw_cutoff)
+                for table, cutoff in (('kline_5m', raw_cutoff), ('kline_1h', hourly_cutoff)):
+                    while True:
+                        count = await db_manager.prune_klines_batch(table, stock_key, cutoff, KLINE_PRUNE_BATCH_SIZE)
+                        deleted[table] += count
+                        if count < KLINE_PRUNE_BATCH_SIZE:
+                            break
+                        await asyncio.sleep(0.05)
+
+            self._last_retention_date = date.today()
+            logger.info(f"[K线保留策略] 已删除 5分钟K {deleted['kline_5m']} 行, 小时K {deleted['kline_1h']} 行。")
+            return deleted
+
+    async def _rollup_expired_klines(self, stock_key: int, cutoff_ts: int):
+        """
+        把早于 cutoff (本地零点) 的5分钟K线按 KLINE_ROLLUP_WINDOW_DAYS 天一段汇总，每段单独提交。
+        首次运行面对很长的历史时，也不会在一条 INSERT … SELECT 里长时间占住写锁。
+        """
+        db_manager = self.plugin.db_manager
+        start_ts = await db_manager.get_oldest_kline_ts(stock_key)
+        if start_ts is None or start_ts >= cutoff_ts:
+            return
+        # 对齐到本地零点，使每个日桶完整地落在一个窗口内
+        utc_offset = int(datetime.now().astimezone().utcoffset().total_seconds())
+        start_ts -= (start_ts + utc_offset) % 86400
+        window = KLINE_ROLLUP_WINDOW_DAYS * 86400
+        while start_ts < cutoff_ts:
+            end_ts = min(start_ts + window, cutoff_ts)
+            await db_manager.rollup_klines_window(stock_key, start_ts, end_ts)
+            start_ts = end_ts
+            if start_ts < cutoff_ts:
+                await asyncio.sleep(0.05)
+
+    async def run_backup(self) -> List[Dict[str, object]]:
+        """
+        在线备份行情库和账本库。复制在工作线程中分步进行，事件循环和数据库写入不受阻塞；
+        交易时段会等到两个 tick 之间再开始。返回每个库的备份结果。
+        """
+        async with self._backup_lock:
+            await self._wait_for_quiet_period()
+            await self.plugin.persistence_queue.flush()
+            results = []
+            for db_path in (self.plugin.db_path, self.plugin.ledger_db_path):
+                results.append(await asyncio.to_thread(
+                    backup_database, db_path, BACKUP_DIR, BACKUP_KEEP, BACKUP_STEP_PAGES, BACKUP_STEP_SLEEP))
+            return results
+
+    def _retention_due(self) -> bool:
+        """K线清理每天只在休市后执行一次。"""
+        status, _ = self.plugin.get_market_status_and_wait()
+        return status != MarketStatus.OPEN and self._last_retention_date != date.today()
+
+    async def _maintenance_loop(self):
+        last_consolidation = time.monotonic()
+        last_backup = time.monotonic()
+        while True:
+            try:
+                await asyncio.sleep(300)
+                if self._retention_due():
+                    await self.run_kline_retention()
+                if time.monotonic() - last_consolidation >= HOLDINGS_CONSOLIDATION_INTERVAL_MINUTES * 60:
+                    await self._wait_for_quiet_period()
+                    await self.consolidate_holdings()
+                    last_consolidation = time.monotonic()
+                if time.monotonic() - last_backup >= BACKUP_INTERVAL_HOURS * 3600:
+                    last_backup = time.monotonic()
+                    await self.run_backup()
+            except asyncio.CancelledError:
+                logger.info("后台维护任务被取消。")
+                break
+            except Exception as e:
+                logger.error(f"后台维护任务出现错误: {e}", exc_info=True)
+                await asyncio.sleep(60)
@@ -2,9 +2,10 @@
 
 from enum import Enum
 from dataclasses import dataclass, field
-from datetime import date
-from typing import Optional
+from datetime import date, datetime
+from typing import Optional, Iterable
 from collections import deque
+from itertools import islice
 import random
 
 # --- 市场状态枚举 ---
@@ -33,6 +34,72 @@ class Trend(Enum):
     NEUTRAL = 0
 # ▲▲▲【修改结束】▲▲▲
 
+# --- 滚动窗口统计 ---
+class RollingWindow:
+    """
+    最近 size 根K线的开/高/低/收滚动统计。
+    最高价和最低价用单调队列维护，每根新K线的更新为均摊 O(1)，读取为 O(1)。
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._seq = 0  # 已推入的K线总数，用作单调队列中的位置
+        self._candles: deque = deque(maxlen=size)  # (open, close)
+        self._highs: deque = deque()  # (seq, high)，high 单调递减
+        self._lows: deque = deque()   # (seq, low)，low 单调递增
+
+    def push(self, open_: float, high: float, low: float, close: float):
+        self._seq += 1
+        self._candles.append((open_, close))
+        while self._highs and self._highs[-1][1] <= high:
+            self._highs.pop()
+        self._highs.append((self._seq, high))
+        while self._lows and self._lows[-1][1] >= low:
+            self._lows.pop()
+        self._lows.append((self._seq, low))
+        oldest = self._seq - self.size
+        if self._highs[0][0] <= oldest:
+            self._highs.popleft()
+        if self._lows[0][0] <= oldest:
+            self._lows.popleft()
+
+    def reset(self, klines: Iterable[dict]):
+        """用一段K线 (按时间顺序) 重建窗口，只取最后 size 根。"""
+        self._seq = 0
+        self._candles.clear()
+        self._highs.clear()
+        self._lows.clear()
+        for k in klines:
+            self.push(k['open'], k['high'], k['low'], k['close'])
+
+    def __len__(self) -> int:
+        return len(self._candles)
+
+    @property
+    def open(self) -> Optional[float]:
+        return self._candles[0][0] if self._candles else None
+
+    @property
+    def close(self) -> Optional[float]:
+        return self._candles[-1][1] if self._candles else None
+
+    @property
+    def high(self) -> Optional[float]:
+        return self._highs[0][1] if self._highs else None
+
+    @property
+    def low(self) -> Optional[float]:
+        return self._lows[0][1] if self._lows else None
+
+    def previous_close(self, n: int = 1) -> Optional[float]:
+        """倒数第 n+1 根K线的收盘价 (n=1 即上一根)。"""
+        return self._candles[-1 - n][1] if len(self._candles) > n else None
+
+    def sma(self, n: int) -> Optional[float]:
+        """最近 n 根收盘价的均值 (n 不超过窗口大小)，不足 n 根时返回 None。"""
+        if len(self._candles) < n:
+            return None
+        return sum(c for _, c in islice(reversed(self._candles), n)) / n
+
 # --- 数据类 ---
 @dataclass
 class DailyScript:
@@ -94,11 +161,39 @@ class VirtualStock:
     price_history: deque = field(default_factory=lambda: deque(maxlen=60))
     daily_close_history: deque = field(default_factory=lambda: deque(maxlen=20))
     kline_history: deque = field(default_factory=lambda: deque(maxlen=9000))
+    # 与 kline_history 一一对应的纪元秒，随 append_kline 维护；按时间筛选和二进制编码时不必再解析 date
+    kline_ts: deque = field(default_factory=lambda: deque(maxlen=9000), repr=False)
+    # 最近1小时 (12根) 和24小时 (288根) 的滚动统计，随 append_kline 增量更新
+    window_1h: RollingWindow = field(default_factory=lambda: RollingWindow(12), repr=False)
+    window_24h: RollingWindow = field(default_factory=lambda: RollingWindow(288), repr=False)
     market_pressure: float = 0.0
     is_listed_company: bool = False
     owner_id: Optional[str] = None
     total_shares: int = 0
 
+    def append_kline(self, kline: dict):
+        """追加一根新K线并更新时间戳和滚动窗口。"""
+        self.kline_history.append(kline)
+        self.kline_ts.append(int(datetime.fromisoformat(kline['date']).timestamp()))
+        for window in (self.window_1h, self.window_24h):
+            window.push(kline['open'], kline['high'], kline['low'], kline['close'])
+
+    def rebuild_derived(self, timestamps: Optional[Iterable[int]] = None):
+        """
+        整体替换 kline_history 后 (加载、快照恢复、历史补全) 重建时间戳和滚动窗口。
+        调用方已有对应的纪元秒 (如快照中的时间戳列) 时通过 timestamps 传入，不再逐根解析 date。
+        """
+        if timestamps is None:
+            timestamps = (int(datetime.fromisoformat(k['date']).timestamp()) for k in self.kline_history)
+        self.kline_ts = deque(timestamps, maxlen=self.kline_history.maxlen)
+        recent = list(islice(reversed(self.kline_history), self.window_24h.size))[::-1]
+        self.window_24h.reset(recent)
+        self.window_1h.reset(recent[-self.window_1h.size:])
+
+    def recent_klines(self, n: int) -> list:
+        """最近 n 根K线 (按时间顺序)，只遍历尾部，不复制整个缓冲。"""
+        return list(islice(reversed(self.kline_history), n))[::-1]
+
     def get_last_day_close(self) -> float:
         return self.previous_close if self.previous_close > 0 else self.current_price
 
@@ -0,0 +1,198 @@
+# stock_market/persistence.py
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+
+from astrbot.api import logger
+from .config_defaults import PERSIST_MAX_PENDING_KLINES, PERSIST_RETRY_MAX_SECONDS
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+# (current_price, market_pressure)
+PriceRow = Tuple[float, float]
+# (open, high, low, close)
+KlineRow = Tuple[float, float, float, float]
+
+
+class PersistenceQueue:
+    """
+    行情数据的写后缓冲队列。
+    tick 循环只把本次的价格和K线 (不可变元组) 合并进待写缓冲后立即返回，
+    由唯一的后台写入任务批量提交到数据库；写入失败时保留数据并指数退避重试。
+    同一股票的价格只保留最新值，同一根K线 (stock_id, date) 只保留最后一次写入。
+    """
+    def __init__(self, plugin: "StockMarketRefactored"):
+        self.plugin = plugin
+        self.task: Optional[asyncio.Task] = None
+        self._pending_prices: Dict[str, PriceRow] = {}
+        self._pending_klines: "OrderedDict[Tuple[str, str], KlineRow]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._commit_lock = asyncio.Lock()
+        # --- 运行指标 ---
+        self.commits = 0
+        # 每次成功提交后递增；直接读库的接口以它区分缓存和 ETag，保证不会把提交前读到的数据当作最新
+        self.committed_version = 0
+        self.failures = 0
+        self.dropped_klines = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.last_commit_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """启动后台写入任务。"""
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._writer_loop())
+            logger.info("行情数据写入任务已启动。")
+
+    async def close(self):
+        """停止后台任务，并尽量把剩余数据写入数据库。"""
+        # 不取消写入任务: 让它提交完手上的批次后自行退出，避免正在提交的批次随取消丢失
+        self._stopping.set()
+        self._wakeup.set()
+        if self.task and not self.task.done():
+            await self.task
+        for _ in range(3):
+            if await self._commit_pending():
+                return
+            await asyncio.sleep(1)
+        logger.error(f"关闭时仍有 {self.depth} 条行情数据未能写入数据库。")
+
+    async def flush(self) -> bool:
+        """立即提交缓冲中的数据 (例如在直接读取数据库文件之前)，返回是否成功。"""
+        return await self._commit_pending()
+
+    @asynccontextmanager
+    async def hold_commits(self):
+        """
+        期间不提交任何批次 (正在提交的批次完成后才进入)，供改写股票代码等直接写库的管理操作使用:
+        不会有按旧代码取出的批次在改写之后才落库。
+        """
+        async with self._commit_lock:
+            yield
+
+    def rename_stock(self, old_stock_id: str, new_stock_id: str):
+        """股票代码变更后，把缓冲中记在旧代码下的价格和K线改记到新代码下。"""
+        if old_stock_id in self._pending_prices:
+            self._pending_prices[new_stock_id] = self._pending_prices.pop(old_stock_id)
+        self._pending_klines = OrderedDict(
+            ((new_stock_id if stock_id == old_stock_id else stock_id, date_iso), row)
+            for (stock_id, date_iso), row in self._pending_klines.items())
+
+    @property
+    def depth(self) -> int:
+        """待写入的行数 (价格 + K线)。"""
+        return len(self._pending_prices) + len(self._pending_klines)
+
+    def enqueue(self, prices: Iterable[Tuple[str, float, float]],
+                klines: Iterable[Tuple[str, str, float, float, float, float]]):
+        """
+        合并一批更新到待写缓冲，不做任何 I/O。
+        prices: (stock_id, current_price, market_pressure)
+        klines: (stock_id, date_iso, open, high, low, close)
+        """
+        for stock_id, price, pressure in prices:
+            self._pending_prices[stock_id] = (price, pressure)
+        for stock_id, date_iso, o, h, l, c in klines:
+            key = (stock_id, date_iso)
+            self._pending_klines[key] = (o, h, l, c)
+            self._pending_klines.move_to_end(key)
+        self._enforce_bound()
+        self._wakeup.set()
+
+    def _enforce_bound(self):
+        """数据库长时间不可用时限制内存占用：丢弃最旧的K线 (最新状态仍保存在内存和快照中)。"""
+        overflow = len(self._pending_klines) - PERSIST_MAX_PENDING_KLINES
+        if overflow > 0:
+            for _ in range(overflow):
+                self._pending_klines.popitem(last=False)
+            self.dropped_klines += overflow
+            logger.error(f"行情写入队列已满，丢弃了 {overflow} 根最旧的待写K线。")
+
+    def _requeue(self, prices: Dict[str, PriceRow], klines: "OrderedDict[Tuple[str, str], KlineRow]"):
+        """写入失败时把批次放回缓冲；期间新入队的数据更新，优先保留。"""
+        for stock_id, row in prices.items():
+            self._pending_prices.setdefault(stock_id, row)
+        merged = OrderedDict(klines)
+        for key, row in self._pending_klines.items():
+            merged[key] = row
+            merged.move_to_end(key)
+        self._pending_klines = merged
+        self._enforce_bound()
+
+    async def _commit_pending(self) -> bool:
+        """提交当前缓冲，返回是否成功 (缓冲为空也视为成功)。"""
+        async with self._commit_lock:
+            if not self._pending_prices and not self._pending_klines:
+                return True
+            prices, self._pending_prices = self._pending_prices, {}
+            klines, self._pending_klines = self._pending_klines, OrderedDict()
+            start = time.perf_counter()
+            try:
+                await self.plugin.db_manager.batch_update_stock_data(
+                    [(stock_id, price, pressure) for stock_id, (price, pressure) in prices.items()],
+                    [(stock_id, date_iso, *row) for (stock_id, date_iso), row in klines.items()],
+                )
+            except asyncio.CancelledError:
+                # 批次已从缓冲中取出，被取消时放回 (写入按主键覆盖，重复提交无副作用)
+                self._requeue(prices, klines)
+                raise
+            except Exception as e:
+                self._requeue(prices, klines)
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error(f"行情数据写入失败，{self.depth} 条数据将稍后重试: {e}", exc_info=True)
+                return False
+            self.last_commit_ms = (time.perf_counter() - start) * 1000
+            self.max_commit_ms = max(self.max_commit_ms, self.last_commit_ms)
+            self.last_commit_at = time.time()
+            self.commits += 1
+            self.committed_version += 1
+            self.last_error = None
+            return True
+
+    async def _writer_loop(self):
+        retry_delay = 1
+        while not self._stopping.is_set():
+            try:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if await self._commit_pending():
+                    retry_delay = 1
+                else:
+                    await self._sleep_unless_stopping(retry_delay)
+                    retry_delay = min(retry_delay * 2, PERSIST_RETRY_MAX_SECONDS)
+                    self._wakeup.set()
+            except asyncio.CancelledError:
+                logger.info("行情数据写入任务被取消。")
+                break
+            except Exception as e:
+                logger.error(f"行情数据写入任务出现错误: {e}", exc_info=True)
+                await self._sleep_unless_stopping(retry_delay)
+
+    async def _sleep_unless_stopping(self, seconds: float):
+        """退避等待，关闭时提前结束。"""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def get_stats(self) -> Dict[str, object]:
+        """返回队列深度与提交耗时等指标。"""
+        return {
+            "depth": self.depth,
+            "pending_prices": len(self._pending_prices),
+            "pending_klines": len(self._pending_klines),
+            "commits": self.commits,
+            "failures": self.failures,
+            "dropped_klines": self.dropped_klines,
+            "last_commit_ms": round(self.last_commit_ms, 2),
+            "max_commit_ms": round(self.max_commit_ms, 2),
+            "last_commit_at": self.last_commit_at,
+            "last_error": self.last_error,
+        }
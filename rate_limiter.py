@@ -0,0 +1,92 @@
+# stock_market/rate_limiter.py
+
+import ipaddress
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from astrbot.api import logger
+
+
+class RateLimiter:
+    """
+    速率限制器。
+    - 白名单网段在构造时解析一次，每个IP的判定结果缓存在有界的 LRU 中。
+    - 所有规则的路径正则编译为一个带命名分组的正则，按规则顺序匹配，一次 match 即可确定命中的规则。
+    - 限流采用 GCRA (通用信元速率算法)，每个 (规则, key) 只保存一个浮点数 (理论到达时间 TAT)，
+      允许 limit 次突发，之后按 period/limit 的间隔匀速放行。
+    - 状态存放在容量为 max_keys 的 LRU 中；TAT 已过期的条目与新 key 等价，可随时淘汰。
+    """
+    def __init__(self, rules: List[Dict[str, Any]], whitelist: Iterable[str], max_keys: int):
+        self.rules = rules
+        self.max_keys = max_keys
+        self._networks = []
+        for entry in whitelist:
+            try:
+                self._networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError as e:
+                logger.error(f"速率限制白名单配置错误，已忽略 '{entry}': {e}")
+        self._whitelist_cache: "OrderedDict[str, bool]" = OrderedDict()
+        self._dispatcher = re.compile("|".join(f"(?P<r{i}>{rule['path_regex']})" for i, rule in enumerate(rules)))
+        self._tat: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def is_whitelisted(self, remote_ip: Optional[str]) -> bool:
+        if not remote_ip or not self._networks:
+            return False
+        cached = self._whitelist_cache.get(remote_ip)
+        if cached is None:
+            try:
+                ip = ipaddress.ip_address(remote_ip)
+                cached = any(ip in network for network in self._networks)
+            except ValueError:
+                cached = False
+            self._whitelist_cache[remote_ip] = cached
+            if len(self._whitelist_cache) > self.max_keys:
+                self._whitelist_cache.popitem(last=False)
+        return cached
+
+    def match_rule(self, path: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """返回第一个匹配路径的规则 (序号, 规则)。"""
+        match = self._dispatcher.match(path)
+        if not match:
+            return None
+        index = int(match.lastgroup[1:])
+        return index, self.rules[index]
+
+    def hit(self, rule_index: int, key: str, limit: int, period: float, now: Optional[float] = None) -> float:
+        """记录一次请求。允许时返回 0，被限流时返回需要等待的秒数。"""
+        now = time.monotonic() if now is None else now
+        interval = period / limit
+        state_key = (rule_index, key)
+        tat = max(self._tat.get(state_key, now), now)
+        new_tat = tat + interval
+        if new_tat - now > period:
+            return new_tat - period - now
+        self._tat[state_key] = new_tat
+        self._tat.move_to_end(state_key)
+        self._evict(now)
+        return 0.0
+
+    def _evict(self, now: float):
+        # 先清掉最久未访问且已过期的条目，仍超出容量时再按 LRU 淘汰
+        while self._tat:
+            oldest_key = next(iter(self._tat))
+            if self._tat[oldest_key] > now and len(self._tat) <= self.max_keys:
+                break
+            del self._tat[oldest_key]
+
+    def check(self, request) -> Tuple[Optional[Dict[str, Any]], float]:
+        """
+        检查一个请求。返回 (命中的规则, 需要等待的秒数)；未命中任何规则或在白名单中时返回 (None, 0)。
+        """
+        if self.is_whitelisted(request.remote):
+            return None, 0.0
+        matched = self.match_rule(request.path)
+        if matched is None:
+            return None, 0.0
+        index, rule = matched
+        return rule, self.hit(index, rule['get_key_func'](request), rule['limit'], rule['period'])
+
+    def __len__(self) -> int:
+        return len(self._tat)
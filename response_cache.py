@@ -0,0 +1,97 @@
+# stock_market/response_cache.py
+
+import gzip
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时只提供 gzip
+    brotli = None
+
+from aiohttp import web
+from .config_defaults import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MIN_COMPRESS_BYTES
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+
+@dataclass
+class CachedPayload:
+    body: bytes
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
+    content_type: str = 'application/json'
+
+
+class ResponseCache:
+    """
+    公共行情接口的响应缓存: 按 (接口, 参数) 保存序列化好的 JSON 及其 gzip/brotli 压缩版本。
+    两次 tick 之间所有访问者拿到的都是同一份字节；tick_version 一变 (tick 或管理员修改) 或
+    写后队列提交了新数据 (committed_version) 时整体失效。
+    跨 await 计算的响应应先取 version，再把它传给 put/put_body：计算期间版本变化时结果不入缓存，
+    避免把旧数据当作本版本的内容缓存一整个 tick。
+    """
+    def __init__(self, plugin: "StockMarketRefactored", max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.plugin = plugin
+        self.max_entries = max_entries
+        self._version: Optional[Tuple[int, int]] = None
+        self._entries: "OrderedDict[Hashable, CachedPayload]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        queue = self.plugin.persistence_queue
+        return self.plugin.tick_version, queue.committed_version if queue else 0
+
+    def _sync_version(self):
+        version = self.version
+        if self._version != version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: Hashable) -> Optional[CachedPayload]:
+        self._sync_version()
+        payload = self._entries.get(key)
+        if payload is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, key: Hashable, data: Any, version: Optional[Tuple[int, int]] = None) -> CachedPayload:
+        """序列化并压缩 data，存入缓存后返回。version 为开始计算时的 self.version。"""
+        return self.put_body(key, json.dumps(data).encode(), version=version)
+
+    def put_body(self, key: Hashable, body: bytes, content_type: str = 'application/json',
+                 version: Optional[Tuple[int, int]] = None) -> CachedPayload:
+        """压缩已编码好的 body (如二进制K线)，存入缓存后返回；计算期间版本已变化时只返回不缓存。"""
+        self._sync_version()
+        payload = CachedPayload(body, content_type=content_type)
+        if len(body) >= RESPONSE_CACHE_MIN_COMPRESS_BYTES:
+            payload.gzip_body = gzip.compress(body, compresslevel=6)
+            if brotli is not None:
+                payload.br_body = brotli.compress(body, quality=5)
+        if version is not None and version != self._version:
+            return payload
+        self._entries[key] = payload
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return payload
+
+    @staticmethod
+    def respond(request: web.Request, payload: CachedPayload) -> web.Response:
+        """按 Accept-Encoding 选择预压缩的版本，不在请求路径上做任何序列化或压缩。"""
+        accept = request.headers.get('Accept-Encoding', '')
+        headers = {'Vary': 'Accept-Encoding'}
+        body = payload.body
+        if payload.br_body is not None and 'br' in accept:
+            body, headers['Content-Encoding'] = payload.br_body, 'br'
+        elif payload.gzip_body is not None and 'gzip' in accept:
+            body, headers['Content-Encoding'] = payload.gzip_body, 'gzip'
+        return web.Response(body=body, content_type=payload.content_type, headers=headers)
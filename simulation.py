@@ -22,6 +22,8 @@ class MarketSimulation:
     def __init__(self, plugin: "StockMarketRefactored"):
         self.plugin = plugin
         self.task: Optional[asyncio.Task] = None
+        # 模拟 tick 计数 (只随 tick 递增，不受管理员修改影响)，推送给订阅者用于检测漏收
+        self.tick_count = 0
 
     def start(self):
         """启动价格更新循环任务。"""
@@ -86,6 +88,32 @@ class MarketSimulation:
         
         return None
 
+    def _publish_tick_delta(self, tick_time: datetime, db_updates: list, tick_events: list):
+        """将本 tick 的行情增量推送给通过 StockMarketAPI 订阅的其他插件。"""
+        prices, klines = {}, {}
+        for data in db_updates:
+            k = data['kline']
+            klines[data['stock_id']] = [k['open'], k['high'], k['low'], k['close']]
+            if k['close'] != k['open']:
+                prices[data['stock_id']] = data['current_price']
+
+        changes = [(s.current_price - s.get_last_day_close()) / s.get_last_day_close() * 100
+                   for s in self.plugin.stocks.values() if s.get_last_day_close() > 0]
+        simulator = self.plugin.market_simulator
+        delta = {
+            "tick": self.tick_count,
+            "timestamp": tick_time.isoformat(),
+            "prices": prices,
+            "klines": klines,
+            "events": tick_events,
+            "index": {"avg_change_percent": round(sum(changes) / len(changes), 4) if changes else 0.0},
+            "market": {"cycle": simulator.cycle.value, "volatility_regime": simulator.volatility_regime.value},
+        }
+        try:
+            self.plugin.api.publish_tick(delta)
+        except Exception as e:
+            logger.error(f"推送行情增量时出错: {e}", exc_info=True)
+
     async def _update_stock_prices_loop(self):
         """后台任务循环，更新股票价格 (V2.1 分级动能波)。"""
         from .config import (BIG_WAVE_PROBABILITY, SMALL_WAVE_PEAK_MIN, SMALL_WAVE_PEAK_MAX,
@@ -121,6 +149,7 @@ class MarketSimulation:
                     self.plugin.last_update_date = today
 
                 db_updates = []
+                tick_events = []
                 current_interval_minute = (now.minute // 5) * 5
                 five_minute_start = now.replace(minute=current_interval_minute, second=0, microsecond=0)
 
@@ -136,6 +165,7 @@ class MarketSimulation:
 
                     if event_message:
                         logger.info(f"[随机市场事件] {event_message}")
+                        tick_events.append({"stock_id": stock.stock_id, "message": event_message})
                         message_chain = MessageChain().message(f"【市场快讯】\n{event_message}")
                         subscribers_copy = list(self.plugin.broadcast_subscribers)
                         for umo in subscribers_copy:
@@ -213,11 +243,21 @@ class MarketSimulation:
                     
                     stock.price_history.append(stock.current_price)
                     kline_entry = {"date": five_minute_start.isoformat(), "open": open_price, "high": high_price, "low": low_price, "close": stock.current_price}
-                    stock.kline_history.append(kline_entry)
+                    stock.append_kline(kline_entry)
                     db_updates.append({"stock_id": stock.stock_id, "current_price": stock.current_price, "kline": kline_entry, "market_pressure": stock.market_pressure})
 
-                if self.plugin.db_manager:
-                    await self.plugin.db_manager.batch_update_stock_data(db_updates)
+                # 落库交给写后队列，tick 的节奏不受磁盘 I/O 影响
+                if self.plugin.persistence_queue:
+                    self.plugin.persistence_queue.enqueue(
+                        ((d['stock_id'], d['current_price'], d['market_pressure']) for d in db_updates),
+                        ((d['stock_id'], d['kline']['date'], d['kline']['open'], d['kline']['high'],
+                          d['kline']['low'], d['kline']['close']) for d in db_updates),
+                    )
+                self.plugin.tick_version += 1
+                self.tick_count += 1
+                self._publish_tick_delta(five_minute_start, db_updates, tick_events)
+                if self.plugin.snapshot_manager:
+                    self.plugin.snapshot_manager.schedule_save()
 
                 now_after_update = datetime.now()
                 seconds_to_wait = (5 - (now_after_update.minute % 5)) * 60 - now_after_update.second
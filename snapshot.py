@@ -0,0 +1,329 @@
+# stock_market/snapshot.py
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from astrbot.api import logger
+from .models import DailyScript, DailyBias, MarketCycle, VolatilityRegime
+from .database import to_epoch, from_epoch
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+# 快照文件格式 (小端序)，所有数组段按 8 字节对齐，可直接通过 mmap + memoryview.cast 读取:
+#   [文件头] magic, 版本, 保存时间, 股票数, 市场宏观状态
+#   [股票表] 每支股票一条定长记录: 动态状态 + 每日剧本 + 各数组长度与偏移
+#   [数据区] 每支股票依次为 price_history(f8)、daily_close_history(f8)、
+#            K线列存: ts(i8)、open(f8)、high(f8)、low(f8)、close(f8)
+SNAPSHOT_MAGIC = b"SMKTSNAP"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct("<8sHHqIBBiiq")
+_STOCK_RECORD = struct.Struct("<IddddddiiiBdd3IQ")
+# 枚举按定义顺序编码为下标，调整枚举顺序时必须提升 SNAPSHOT_VERSION
+_CYCLES = list(MarketCycle)
+_VOL_REGIMES = list(VolatilityRegime)
+_BIASES = list(DailyBias)
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# K线列存: (ts q, open d, high d, low d, close d)
+KlineColumns = Tuple[array, array, array, array, array]
+
+
+def _empty_columns() -> KlineColumns:
+    return array("q"), array("d"), array("d"), array("d"), array("d")
+
+
+class _KlineMirror:
+    """
+    单支股票 kline_history 的列存镜像，随 tick 增量维护: 每次只解析新追加的K线日期，
+    并从头部丢弃已被 deque 挤出的部分。K线 dict 追加后不再修改，以对象身份判断哪些是新的；
+    首尾对不上 (整体替换、历史补全向前插入) 时从头重建。
+    """
+    __slots__ = ("columns", "last")
+
+    def __init__(self):
+        self.columns: KlineColumns = _empty_columns()
+        self.last = None
+
+    def _append(self, klines):
+        ts, o, h, l, c = self.columns
+        for kline in klines:
+            ts.append(to_epoch(kline['date']))
+            o.append(kline['open'])
+            h.append(kline['high'])
+            l.append(kline['low'])
+            c.append(kline['close'])
+
+    def sync(self, history: deque):
+        new = []
+        for kline in reversed(history):
+            if kline is self.last:
+                break
+            new.append(kline)
+        else:
+            self.columns = _empty_columns()
+        self._append(reversed(new))
+        excess = len(self.columns[0]) - len(history)
+        if excess > 0:
+            for column in self.columns:
+                del column[:excess]
+        if history and (excess < 0 or self.columns[0][0] != to_epoch(history[0]['date'])):
+            self.columns = _empty_columns()
+            self._append(history)
+        self.last = history[-1] if history else None
+
+    def copy(self) -> KlineColumns:
+        return tuple(array(column.typecode, column) for column in self.columns)
+
+
+@dataclass
+class StockState:
+    """快照中单支股票的动态状态。"""
+    stock_key: int
+    current_price: float
+    previous_close: float
+    fundamental_value: float
+    market_pressure: float
+    intraday_momentum: float
+    momentum_target_peak: float
+    momentum_duration_ticks: int
+    momentum_current_tick: int
+    daily_script: Optional[DailyScript]
+    price_history: List[float] = field(default_factory=list)
+    daily_close_history: List[float] = field(default_factory=list)
+    kline_columns: KlineColumns = field(default_factory=_empty_columns)
+
+
+@dataclass
+class MarketSnapshot:
+    saved_at: int
+    cycle: MarketCycle
+    volatility_regime: VolatilityRegime
+    steps_in_current_cycle: int
+    steps_in_current_vol_regime: int
+    last_update_date: Optional[date]
+    stocks: List[StockState]
+
+
+def encode_snapshot(snapshot: MarketSnapshot) -> bytes:
+    """将快照编码为二进制。"""
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, snapshot.saved_at, len(snapshot.stocks),
+        _CYCLES.index(snapshot.cycle), _VOL_REGIMES.index(snapshot.volatility_regime),
+        snapshot.steps_in_current_cycle, snapshot.steps_in_current_vol_regime,
+        snapshot.last_update_date.toordinal() if snapshot.last_update_date else 0,
+    )
+    data_offset = _align8(_HEADER.size + _STOCK_RECORD.size * len(snapshot.stocks))
+    records, chunks = [], []
+    offset = data_offset
+    for s in snapshot.stocks:
+        script = s.daily_script
+        records.append(_STOCK_RECORD.pack(
+            s.stock_key, s.current_price, s.previous_close, s.fundamental_value, s.market_pressure,
+            s.intraday_momentum, s.momentum_target_peak, s.momentum_duration_ticks, s.momentum_current_tick,
+            script.date.toordinal() if script else 0,
+            _BIASES.index(script.bias) if script else 0,
+            script.expected_range_factor if script else 0.0,
+            script.target_close if script else 0.0,
+            len(s.price_history), len(s.daily_close_history), len(s.kline_columns[0]), offset,
+        ))
+        for arr in (array("d", s.price_history), array("d", s.daily_close_history), *s.kline_columns):
+            chunk = arr.tobytes()
+            chunks.append(chunk)
+            offset += len(chunk)
+    padding = b"\0" * (data_offset - _HEADER.size - _STOCK_RECORD.size * len(snapshot.stocks))
+    return b"".join([header, *records, padding, *chunks])
+
+
+def _decode_stock(buf, i: int, doubles: memoryview, int64s: memoryview) -> StockState:
+    (stock_key, current_price, previous_close, fundamental_value, market_pressure,
+     momentum, target_peak, duration_ticks, current_tick, script_ordinal, bias_idx,
+     range_factor, target_close, n_prices, n_closes, n_klines, offset) = \
+        _STOCK_RECORD.unpack_from(buf, _HEADER.size + i * _STOCK_RECORD.size)
+    if offset % 8 or offset + 8 * (n_prices + n_closes + 5 * n_klines) > len(buf):
+        raise ValueError("快照数据区越界")
+    pos = offset // 8
+    price_history = doubles[pos:pos + n_prices].tolist(); pos += n_prices
+    daily_closes = doubles[pos:pos + n_closes].tolist(); pos += n_closes
+    ts_col = array("q", int64s[pos:pos + n_klines].tobytes()); pos += n_klines
+    ohlc = []
+    for _ in range(4):
+        ohlc.append(array("d", doubles[pos:pos + n_klines].tobytes())); pos += n_klines
+    script = DailyScript(date=date.fromordinal(script_ordinal), bias=_BIASES[bias_idx],
+                         expected_range_factor=range_factor, target_close=target_close) if script_ordinal else None
+    return StockState(
+        stock_key=stock_key, current_price=current_price, previous_close=previous_close,
+        fundamental_value=fundamental_value, market_pressure=market_pressure,
+        intraday_momentum=momentum, momentum_target_peak=target_peak,
+        momentum_duration_ticks=duration_ticks, momentum_current_tick=current_tick,
+        daily_script=script, price_history=price_history, daily_close_history=daily_closes,
+        kline_columns=(ts_col, *ohlc),
+    )
+
+
+def decode_snapshot(buf) -> MarketSnapshot:
+    """从 bytes/mmap 解码快照，格式或版本不符时抛出 ValueError。"""
+    if len(buf) < _HEADER.size:
+        raise ValueError("快照文件过短")
+    (magic, version, _flags, saved_at, stock_count, cycle_idx, vol_idx,
+     steps_cycle, steps_vol, last_update_ordinal) = _HEADER.unpack_from(buf, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("不是有效的快照文件")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"快照版本 {version} 与当前版本 {SNAPSHOT_VERSION} 不兼容")
+
+    view = memoryview(buf)
+    doubles, int64s = view.cast("d"), view.cast("q")
+    try:
+        stocks = [_decode_stock(buf, i, doubles, int64s) for i in range(stock_count)]
+    finally:
+        doubles.release()
+        int64s.release()
+        view.release()
+    return MarketSnapshot(
+        saved_at=saved_at, cycle=_CYCLES[cycle_idx], volatility_regime=_VOL_REGIMES[vol_idx],
+        steps_in_current_cycle=steps_cycle, steps_in_current_vol_regime=steps_vol,
+        last_update_date=date.fromordinal(last_update_ordinal) if last_update_ordinal else None,
+        stocks=stocks,
+    )
+
+
+def _write_atomic(path: str, payload: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_mapped(path: str) -> Optional[MarketSnapshot]:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return decode_snapshot(mm)
+
+
+class SnapshotManager:
+    """
+    市场状态快照。每个 tick 落库后 (以及插件关闭时) 原子地写入完整模拟状态，
+    重启时优先从快照恢复，包括 SQLite 中不保存的动能波、每日剧本和宏观周期状态。
+    K线以列存镜像增量维护，每个 tick 只解析新增的那根，写快照时只需复制数组。
+    """
+    def __init__(self, plugin: "StockMarketRefactored", path: str):
+        self.plugin = plugin
+        self.path = path
+        self._write_lock = asyncio.Lock()
+        self._save_task: Optional[asyncio.Task] = None
+        self._kline_mirrors: Dict[str, _KlineMirror] = {}
+
+    def _capture(self) -> MarketSnapshot:
+        """在事件循环中拷贝当前状态 (K线只复制列存数组，编码和写盘放到线程中)。"""
+        simulator = self.plugin.market_simulator
+        stock_keys = self.plugin.db_manager.get_stock_keys()
+        states = []
+        for stale in self._kline_mirrors.keys() - self.plugin.stocks.keys():
+            del self._kline_mirrors[stale]
+        for stock in self.plugin.stocks.values():
+            stock_key = stock_keys.get(stock.stock_id)
+            if stock_key is None:
+                continue
+            mirror = self._kline_mirrors.setdefault(stock.stock_id, _KlineMirror())
+            mirror.sync(stock.kline_history)
+            states.append(StockState(
+                stock_key=stock_key, current_price=stock.current_price, previous_close=stock.previous_close,
+                fundamental_value=stock.fundamental_value, market_pressure=stock.market_pressure,
+                intraday_momentum=stock.intraday_momentum, momentum_target_peak=stock.momentum_target_peak,
+                momentum_duration_ticks=stock.momentum_duration_ticks, momentum_current_tick=stock.momentum_current_tick,
+                daily_script=stock.daily_script, price_history=list(stock.price_history),
+                daily_close_history=list(stock.daily_close_history), kline_columns=mirror.copy(),
+            ))
+        return MarketSnapshot(
+            saved_at=int(time.time()), cycle=simulator.cycle, volatility_regime=simulator.volatility_regime,
+            steps_in_current_cycle=simulator.steps_in_current_cycle,
+            steps_in_current_vol_regime=simulator.steps_in_current_vol_regime,
+            last_update_date=self.plugin.last_update_date, stocks=states,
+        )
+
+    async def save(self):
+        """写入快照。失败只记录日志，不影响行情循环。"""
+        try:
+            snapshot = self._capture()
+            async with self._write_lock:
+                await asyncio.to_thread(self._encode_and_write, snapshot)
+        except Exception as e:
+            logger.error(f"写入市场状态快照失败: {e}", exc_info=True)
+
+    def schedule_save(self):
+        """在后台写入快照而不等待完成；上一次写入尚未结束时跳过本次。"""
+        if self._save_task and not self._save_task.done():
+            return
+        self._save_task = asyncio.create_task(self.save())
+
+    def _encode_and_write(self, snapshot: MarketSnapshot):
+        _write_atomic(self.path, encode_snapshot(snapshot))
+
+    async def read(self) -> Optional[MarketSnapshot]:
+        """读取快照文件；不存在或损坏时返回 None。"""
+        try:
+            return await asyncio.to_thread(_read_mapped, self.path)
+        except Exception as e:
+            logger.warning(f"市场状态快照不可用，将从数据库加载: {e}")
+            return None
+
+    def apply(self, snapshot: MarketSnapshot) -> bool:
+        """
+        将快照恢复到已从数据库加载静态信息的 plugin.stocks 上。
+        只有股票集合与数据库一致、且价格与数据库最新值相同 (即快照不落后于数据库) 时才使用快照。
+        """
+        key_to_stock = {key: self.plugin.stocks.get(stock_id)
+                        for stock_id, key in self.plugin.db_manager.get_stock_keys().items()}
+        states = {s.stock_key: s for s in snapshot.stocks}
+        if set(states) != set(key_to_stock):
+            logger.info("快照中的股票列表与数据库不一致，改为从数据库加载。")
+            return False
+        for key, state in states.items():
+            stock = key_to_stock[key]
+            if stock is None or abs(stock.current_price - state.current_price) > 1e-9:
+                logger.info("快照落后于数据库中的价格，改为从数据库加载。")
+                return False
+
+        for key, state in states.items():
+            stock = key_to_stock[key]
+            stock.previous_close = state.previous_close
+            stock.fundamental_value = state.fundamental_value
+            stock.market_pressure = state.market_pressure
+            stock.intraday_momentum = state.intraday_momentum
+            stock.momentum_target_peak = state.momentum_target_peak
+            stock.momentum_duration_ticks = state.momentum_duration_ticks
+            stock.momentum_current_tick = state.momentum_current_tick
+            stock.daily_script = state.daily_script
+            stock.price_history = deque(state.price_history, maxlen=stock.price_history.maxlen)
+            stock.daily_close_history = deque(state.daily_close_history, maxlen=stock.daily_close_history.maxlen)
+            stock.kline_history = deque(
+                ({"date": from_epoch(ts), "open": o, "high": h, "low": l, "close": c}
+                 for ts, o, h, l, c in zip(*state.kline_columns)),
+                maxlen=stock.kline_history.maxlen)
+            stock.rebuild_derived(state.kline_columns[0])
+
+        simulator = self.plugin.market_simulator
+        simulator.cycle = snapshot.cycle
+        simulator.volatility_regime = snapshot.volatility_regime
+        simulator.steps_in_current_cycle = snapshot.steps_in_current_cycle
+        simulator.steps_in_current_vol_regime = snapshot.steps_in_current_vol_regime
+        self.plugin.last_update_date = snapshot.last_update_date
+        logger.info(f"已从 {datetime.fromtimestamp(snapshot.saved_at):%Y-%m-%d %H:%M:%S} 的快照恢复市场状态。")
+        return True
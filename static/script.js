@@ -2,6 +2,7 @@
 let initialUserHash, allStocks;
 const klineDataCache = {};
 let myChart = null;
+let chartState = null;
 let currentPeriod = '1d';
 let isLoggedIn = false;
 let authToken = null;
@@ -10,7 +11,7 @@ let currentUserHashForKline = '';
 
 // --- ECharts 核心渲染函数 (V2: 带MA线) ---
 function renderChart(stockName, stockId, klineData) {
-    const periodMap = { '1d': '最近 288 K线', '7d': '最近 2016 K线', '30d': '最近 30 天 (小时K)' };
+    const periodMap = { '1d': '最近 288 K线', '7d': '最近 2016 K线', '30d': '最近 30 天 (小时K)', '90d': '最近 90 天 (4小时K)', '1y': '最近 1 年 (日K)', 'all': '全部历史 (周K)' };
     const dataPeriod = periodMap[currentPeriod] || '自定义周期';
 
     // 定义将在图表中使用的最终数据变量
@@ -64,6 +65,8 @@ function renderChart(stockName, stockId, klineData) {
         ma30Data = calculateMA(30, klineValues);
     }
     // ▲▲▲ 修改结束 ▲▲▲
+    // 记下当前图表使用的数组，实时推送时原地更新最后一根 (见 updateChartTail)
+    chartState = { history: all_kline_history, dates, klineValues, ma5Data, ma10Data, ma30Data };
 
     const isMobile = window.innerWidth < 768;
     let gridOption = isMobile ? { left: 50, right: 15, bottom: 80, top: 55 } : { left: '8%', right: '8%', bottom: '20%', top: '15%' };
@@ -101,11 +104,35 @@ function renderChart(stockName, stockId, klineData) {
 }
 
 // --- 数据获取与股票切换 ---
+// 每根K线至少占用的像素数；超出图表宽度能容纳的根数时由服务端按等根数分桶合并为 OHLC (保留每桶的开/高/低/收)
+const KLINE_PIXELS_PER_CANDLE = 3;
+function chartMaxPoints() { const el = document.getElementById('kline-chart'); return Math.max(100, Math.floor((el ? el.clientWidth : window.innerWidth) / KLINE_PIXELS_PER_CANDLE)); }
+
+// 二进制K线: 'KLN1' + u32 元数据长度 + JSON 元数据 + u32 纪元秒列 + f32 开/高/低/收列 (小端，每根 20 字节)
+const KLINE_BINARY_TYPE = 'application/octet-stream';
+function decodeKlineBinary(buffer) {
+    const view = new DataView(buffer);
+    if (String.fromCharCode(...new Uint8Array(buffer, 0, 4)) !== 'KLN1') throw new Error('Unknown kline format');
+    const metaLen = view.getUint32(4, true);
+    const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, metaLen)));
+    const n = meta.count;
+    let offset = 8 + metaLen;
+    const column = (Type) => { const arr = new Type(buffer, offset, n); offset += 4 * n; return arr; };
+    const ts = column(Uint32Array), open = column(Float32Array), high = column(Float32Array), low = column(Float32Array), close = column(Float32Array);
+    const cents = v => Math.round(v * 100) / 100;  // float32 还原为两位小数的价格
+    const history = new Array(n);
+    for (let i = 0; i < n; i++) {
+        history[i] = { date: toLocalIso(ts[i] * 1000), open: cents(open[i]), high: cents(high[i]), low: cents(low[i]), close: cents(close[i]) };
+    }
+    return { kline_history: history, decimated: !!meta.decimated, user_holdings: meta.user_holdings };
+}
+
 async function switchStock(stockId) {
     const stock = allStocks.find(s => s.stock_id === stockId);
     if (!stock) return;
     document.querySelectorAll('.tab[data-stock-id]').forEach(tab => { tab.classList.toggle('active', tab.dataset.stockId === stockId); });
     window.location.hash = stockId;
+    subscribeLiveStock(stockId);
     if (isLoggedIn) { document.getElementById('trade-panel-title').innerText = `交易: ${stock.name} (${stock.stock_id})`; }
 
     const cacheKey = `${currentUserHashForKline}_${stockId}_${currentPeriod}`;
@@ -114,12 +141,13 @@ async function switchStock(stockId) {
         return;
     }
 
-    const fetchUrl = `/api/kline/${stockId}?period=${currentPeriod}&user_hash=${currentUserHashForKline}`;
+    const fetchUrl = `/api/kline/${stockId}?period=${currentPeriod}&user_hash=${currentUserHashForKline}&max_points=${chartMaxPoints()}`;
     if (myChart) myChart.showLoading();
     try {
-        const response = await fetch(fetchUrl);
+        const response = await fetch(fetchUrl, { headers: { 'Accept': `${KLINE_BINARY_TYPE}, application/json;q=0.5` } });
         if (!response.ok) throw new Error('Network response was not ok');
-        const responseData = await response.json();
+        const isBinary = (response.headers.get('Content-Type') || '').startsWith(KLINE_BINARY_TYPE);
+        const responseData = isBinary ? decodeKlineBinary(await response.arrayBuffer()) : await response.json();
         klineDataCache[cacheKey] = responseData;
         renderChart(stock.name, stockId, responseData);
     } catch (error) {
@@ -132,6 +160,129 @@ async function switchStock(stockId) {
     }
 }
 
+// --- 实时行情推送 (WebSocket) ---
+// 各周期每根K线覆盖的分钟数，用于把推送来的5分钟K线并入缓存中的最后一根
+const PERIOD_BUCKET_MINUTES = { '1d': 5, '7d': 30, '30d': 60, '90d': 240, '1y': 1440, 'all': 10080 };
+let tickSocket = null;
+let tickSocketRetryMs = 1000;
+let tickSocketOpenedBefore = false;
+let lastTickNumber = null;
+let liveStockId = null;
+
+function toLocalIso(ms) { const d = new Date(ms); const pad = n => String(n).padStart(2, '0'); return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}T${pad(d.getHours())}:${pad(d.getMinutes())}:${pad(d.getSeconds())}`; }
+function isLiveConnected() { return tickSocket !== null && tickSocket.readyState === WebSocket.OPEN; }
+
+function subscribeLiveStock(stockId) {
+    if (isLiveConnected() && liveStockId !== stockId) {
+        if (liveStockId) tickSocket.send(JSON.stringify({ action: 'unsubscribe', stock_ids: [liveStockId] }));
+        tickSocket.send(JSON.stringify({ action: 'subscribe', stock_ids: [stockId] }));
+    }
+    liveStockId = stockId;
+}
+
+// 把5分钟K线并入未降采样的缓存。返回 'update' (并入最后一根)、'append' (新增一根)、
+// 'roll' (新增一根并移除最早一根) 或 null (未改动)
+function applyLiveCandle(history, kline, period) {
+    const bucketMs = (PERIOD_BUCKET_MINUTES[period] || 5) * 60000;
+    const t = new Date(kline.date).getTime();
+    const last = history[history.length - 1];
+    if (!last) { history.push({ ...kline }); return 'append'; }
+    const lastStart = new Date(last.date).getTime();
+    if (t < lastStart) return null;
+    if (t < lastStart + bucketMs) {
+        last.high = Math.max(last.high, kline.high);
+        last.low = Math.min(last.low, kline.low);
+        last.close = kline.close;
+        return 'update';
+    }
+    const start = lastStart + Math.floor((t - lastStart) / bucketMs) * bucketMs;
+    history.push({ date: toLocalIso(start), open: kline.open, high: kline.high, low: kline.low, close: kline.close });
+    if (period === 'all') return 'append';
+    history.shift();  // 保持窗口长度不变
+    return 'roll';
+}
+
+function tailMA(history, dayCount) {
+    if (history.length < dayCount) return '-';
+    let sum = 0;
+    for (let i = history.length - dayCount; i < history.length; i++) sum += parseFloat(history[i].close);
+    return (sum / dayCount).toFixed(2);
+}
+
+// 只改动图表的最后一根K线和均线末端，不重建整个 option (保留缩放位置)
+function updateChartTail(history, change) {
+    const state = chartState;
+    if (!myChart || !state || state.history !== history) return;
+    const last = history[history.length - 1];
+    const value = [last.open, last.close, last.low, last.high];
+    const arrays = [state.dates, state.klineValues, state.ma5Data, state.ma10Data, state.ma30Data];
+    if (change === 'update' && state.klineValues.length > 0) {
+        state.klineValues[state.klineValues.length - 1] = value;
+    } else {
+        if (change === 'roll') arrays.forEach(arr => arr.shift());
+        state.dates.push(last.date);
+        state.klineValues.push(value);
+        state.ma5Data.push('-'); state.ma10Data.push('-'); state.ma30Data.push('-');
+    }
+    const i = state.klineValues.length - 1;
+    state.ma5Data[i] = tailMA(history, 5);
+    state.ma10Data[i] = tailMA(history, 10);
+    state.ma30Data[i] = tailMA(history, 30);
+    myChart.setOption({ xAxis: { data: state.dates }, series: [{ data: state.klineValues }, { data: state.ma5Data }, { data: state.ma10Data }, { data: state.ma30Data }] });
+}
+
+function invalidateStockCache(stockId) { Object.keys(klineDataCache).forEach(key => { if (key.includes(`_${stockId}_`)) delete klineDataCache[key]; }); }
+
+function handleLiveTick(event) {
+    let msg;
+    try { msg = JSON.parse(event.data); } catch (e) { return; }
+    if (msg.type !== 'tick') return;
+    const missedTicks = lastTickNumber !== null && msg.tick > lastTickNumber + 1;
+    lastTickNumber = Math.max(lastTickNumber || 0, msg.tick);
+    const currentStockId = window.location.hash.substring(1);
+    const visible = msg.stock_id === currentStockId && document.visibilityState === 'visible';
+    if (missedTicks) {
+        // 中间漏掉了 tick，缓存已不连续，整段重新拉取
+        invalidateStockCache(msg.stock_id);
+        if (visible) switchStock(currentStockId);
+        return;
+    }
+    let refetch = false;
+    Object.keys(PERIOD_BUCKET_MINUTES).forEach(period => {
+        const key = `${currentUserHashForKline}_${msg.stock_id}_${period}`;
+        const data = klineDataCache[key];
+        if (!data) return;
+        const shown = visible && period === currentPeriod;
+        if (data.decimated) {
+            // 降采样后的K线不是一个周期宽，推送无法正确并入；丢弃缓存，正在显示时重新拉取
+            delete klineDataCache[key];
+            refetch = refetch || shown;
+            return;
+        }
+        const change = applyLiveCandle(data.kline_history, msg.kline, period);
+        if (change && shown) updateChartTail(data.kline_history, change);
+    });
+    if (refetch) switchStock(currentStockId);
+}
+
+function connectTickSocket() {
+    if (!('WebSocket' in window)) return;  // 不支持时沿用定时轮询
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    tickSocket = new WebSocket(`${protocol}://${window.location.host}/ws/ticks`);
+    tickSocket.onopen = () => {
+        tickSocketRetryMs = 1000;
+        if (liveStockId) tickSocket.send(JSON.stringify({ action: 'subscribe', stock_ids: [liveStockId] }));
+        if (tickSocketOpenedBefore && liveStockId) { invalidateStockCache(liveStockId); switchStock(liveStockId); }
+        tickSocketOpenedBefore = true;
+    };
+    tickSocket.onmessage = handleLiveTick;
+    tickSocket.onclose = () => {
+        lastTickNumber = null;
+        setTimeout(connectTickSocket, tickSocketRetryMs);
+        tickSocketRetryMs = Math.min(tickSocketRetryMs * 2, 60000);
+    };
+}
+
 // --- UI & 辅助函数 ---
 function showToast(message, type = 'info') { const container = document.getElementById('toast-container'); const toast = document.createElement('div'); toast.className = `toast ${type}`; toast.textContent = message; container.appendChild(toast); setTimeout(() => { toast.classList.add('show'); }, 10); setTimeout(() => { toast.classList.remove('show'); setTimeout(() => { if (container.contains(toast)) { container.removeChild(toast); } }, 500); }, 3000); }
 function openModal(modalId) { document.getElementById(modalId).style.display = 'flex'; }
@@ -322,7 +473,9 @@ document.addEventListener('DOMContentLoaded', () => {
     checkLoginStatus();
     if (initialStockId) { switchStock(initialStockId); }
     
-    setInterval(() => { const stockId = window.location.hash.substring(1); if (stockId && document.hasFocus()) { const cacheKey = `${currentUserHashForKline}_${stockId}_${currentPeriod}`; delete klineDataCache[cacheKey]; switchStock(stockId); } }, 2.5 * 60 * 1000);
+    connectTickSocket();
+    // WebSocket 不可用或断开期间回退为定时轮询
+    setInterval(() => { const stockId = window.location.hash.substring(1); if (stockId && document.hasFocus() && !isLiveConnected()) { const cacheKey = `${currentUserHashForKline}_${stockId}_${currentPeriod}`; delete klineDataCache[cacheKey]; switchStock(stockId); } }, 2.5 * 60 * 1000);
 });
 
 window.onmousedown = function (event) {
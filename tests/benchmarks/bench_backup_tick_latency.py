@@ -0,0 +1,95 @@
+# stock_market/tests/benchmarks/bench_backup_tick_latency.py
+"""
+在线备份对 tick 落库的影响: 把行情库填充到指定大小，以固定间隔执行模拟 tick 落库 (20 支股票的价格和K线)，
+分别在无备份、分步在线备份 (backup_database，与 MaintenanceManager.run_backup 相同在工作线程中执行)
+和一次性 VACUUM INTO 时统计每次落库的耗时。
+
+    python tests/benchmarks/bench_backup_tick_latency.py [--size-mb 1024] [--tick-interval 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from pathlib import Path
+
+from common import summarize
+
+from stock_market.backup import backup_database
+from stock_market.config_defaults import BACKUP_STEP_PAGES, BACKUP_STEP_SLEEP
+from stock_market.database import DatabaseManager, from_epoch
+
+STOCKS = [f"S{i:02d}" for i in range(20)]
+BASE_TS = 1704038400
+
+
+def fill(db_path: str, size_mb: int):
+    """用随机数据表把库填充到约 size_mb，模拟多年K线积累的大库。"""
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS bench_filler (id INTEGER PRIMARY KEY, data BLOB)")
+        conn.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) "
+            "INSERT INTO bench_filler (data) SELECT randomblob(4000) FROM n", (size_mb * 256,))
+        conn.commit()
+
+
+async def ticks_during(manager: DatabaseManager, interval: float, work, tick_offset: int):
+    """每 interval 秒执行一次 tick 落库，直到 work 完成；返回 (各次落库毫秒数, work 耗时秒数, work 的结果)。"""
+    latencies = []
+    started = time.perf_counter()
+    task = asyncio.ensure_future(work())
+    tick = tick_offset
+    while not task.done():
+        start = time.perf_counter()
+        await manager.batch_update_stock_data(
+            [(s, 50.0 + tick % 7, 0.0) for s in STOCKS],
+            [(s, from_epoch(BASE_TS + tick * 300), 50.0, 51.0, 49.0, 50.5) for s in STOCKS])
+        latencies.append((time.perf_counter() - start) * 1000)
+        tick += 1
+        await asyncio.sleep(interval)
+    return latencies, time.perf_counter() - started, await task
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = DatabaseManager(os.path.join(tmp, "stock_market.db"), os.path.join(tmp, "ledger.db"))
+        await manager.initialize()
+        for stock_id in STOCKS:
+            await manager.add_stock(stock_id, f"测试{stock_id}", 50.0, 0.02, "综合")
+        fill(manager.db_path, args.size_mb)
+        print(f"行情库大小: {os.path.getsize(manager.db_path) / 1024 / 1024:.0f} MiB")
+        backup_dir = Path(tmp) / "backups"
+
+        def online_backup():
+            return asyncio.to_thread(backup_database, manager.db_path, str(backup_dir), 1,
+                                     args.step_pages, args.step_sleep)
+
+        def vacuum_into():
+            def run():
+                with closing(sqlite3.connect(manager.db_path)) as conn:
+                    conn.execute("VACUUM INTO ?", (str(Path(tmp) / "vacuum.db"),))
+            return asyncio.to_thread(run)
+
+        modes = [
+            ("无备份", lambda: asyncio.sleep(args.baseline_seconds)),
+            ("分步在线备份", online_backup),
+            ("VACUUM INTO", vacuum_into),
+        ]
+        for i, (label, work) in enumerate(modes):
+            latencies, seconds, result = await ticks_during(manager, args.tick_interval, work, i * 100000)
+            # 分步备份被 tick 写入打断超过 MAX_STEP_RESTARTS 次后会改为一次性复制，restarts 反映这一点
+            detail = f"  (steps={result['steps']}, restarts={result['restarts']})" if isinstance(result, dict) else ""
+            print(f"{label:<10} 用时 {seconds:6.1f} s  tick 落库 {summarize(latencies)}{detail}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--tick-interval", type=float, default=0.2, help="模拟 tick 的间隔秒数 (实际为 5 分钟)")
+    parser.add_argument("--baseline-seconds", type=float, default=5.0)
+    parser.add_argument("--step-pages", type=int, default=BACKUP_STEP_PAGES)
+    parser.add_argument("--step-sleep", type=float, default=BACKUP_STEP_SLEEP)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+# stock_market/tests/benchmarks/bench_kline_migration.py
+"""
+K线表结构迁移基准: 生成一个旧版 (TEXT 时间戳、(stock_id, timestamp) 复合主键) 的行情库，
+用 DatabaseManager.initialize() 迁移到 WITHOUT ROWID 整数主键表，比较迁移前后的库大小和区间扫描耗时。
+
+    python tests/benchmarks/bench_kline_migration.py [--stocks 20] [--days 35]
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from common import make_klines, summarize
+
+from stock_market.database import DatabaseManager, to_epoch
+
+LEGACY_SCHEMA = """
+CREATE TABLE stocks (
+    stock_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    current_price REAL NOT NULL,
+    volatility REAL NOT NULL DEFAULT 0.05,
+    industry TEXT NOT NULL DEFAULT '综合'
+);
+CREATE TABLE kline_history (
+    stock_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    open REAL NOT NULL,
+    high REAL NOT NULL,
+    low REAL NOT NULL,
+    close REAL NOT NULL,
+    PRIMARY KEY (stock_id, timestamp),
+    FOREIGN KEY (stock_id) REFERENCES stocks(stock_id) ON DELETE CASCADE
+);
+"""
+
+
+def build_legacy(db_path: str, stock_ids, candles: int, end: datetime):
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        for seed, stock_id in enumerate(stock_ids):
+            conn.execute("INSERT INTO stocks (stock_id, name, current_price) VALUES (?, ?, 50.0)",
+                         (stock_id, f"测试{stock_id}"))
+            conn.executemany(
+                "INSERT INTO kline_history VALUES (?, ?, ?, ?, ?, ?)",
+                [(stock_id, k['date'], k['open'], k['high'], k['low'], k['close'])
+                 for k in make_klines(candles, seed, end)])
+        conn.commit()
+        conn.execute("VACUUM")
+
+
+def time_scans(db_path: str, query: str, params_list, repeat: int):
+    samples = []
+    with closing(sqlite3.connect(db_path)) as conn:
+        for _ in range(repeat):
+            for params in params_list:
+                start = time.perf_counter()
+                conn.execute(query, params).fetchall()
+                samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main(args):
+    stock_ids = [f"S{i:02d}" for i in range(args.stocks)]
+    end = datetime(2024, 6, 1)
+    since = end - timedelta(days=7)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stock_market.db")
+        build_legacy(db_path, stock_ids, args.days * 288, end)
+        size_before = os.path.getsize(db_path)
+        scan_before = time_scans(
+            db_path, "SELECT timestamp, open, high, low, close FROM kline_history "
+                     "WHERE stock_id = ? AND timestamp >= ? ORDER BY timestamp",
+            [(stock_id, since.isoformat()) for stock_id in stock_ids], args.repeat)
+
+        started = time.perf_counter()
+        manager = DatabaseManager(db_path, os.path.join(tmp, "ledger.db"))
+        asyncio.run(manager.initialize())
+        migrate_seconds = time.perf_counter() - started
+        size_after = os.path.getsize(db_path)
+        keys = manager.get_stock_keys()
+        scan_after = time_scans(
+            db_path, "SELECT ts, open, high, low, close FROM kline_5m WHERE stock_key = ? AND ts >= ? ORDER BY ts",
+            [(keys[stock_id], to_epoch(since.isoformat())) for stock_id in stock_ids], args.repeat)
+
+    rows = args.stocks * args.days * 288
+    print(f"{rows} 行K线，迁移 (含初始化和 VACUUM) 用时 {migrate_seconds:.1f} s")
+    print(f"库大小      {size_before / 1024 / 1024:8.1f} MiB -> {size_after / 1024 / 1024:8.1f} MiB")
+    print(f"7天区间扫描 迁移前 {summarize(scan_before)}")
+    print(f"            迁移后 {summarize(scan_after)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=20)
+    parser.add_argument("--days", type=int, default=35, help="每支股票的5分钟K线天数")
+    parser.add_argument("--repeat", type=int, default=5, help="每支股票的区间扫描重复次数")
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+# stock_market/tests/benchmarks/bench_ledger_contention.py
+"""
+写锁争用基准: 行情库持续进行大批量K线落库的同时，并发提交用户交易 (add_holding)，
+比较账本表与行情表在同一个库 (改造前) 和拆分为独立账本库时交易提交的延迟。
+
+    python tests/benchmarks/bench_ledger_contention.py [--seconds 10] [--flush-rows 20000] [--traders 8]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+from common import summarize
+
+from stock_market.database import DatabaseManager, from_epoch
+
+STOCKS = [f"S{i:02d}" for i in range(20)]
+BASE_TS = 1704038400
+
+
+async def make_manager(directory: Path, single_file: bool) -> DatabaseManager:
+    manager = DatabaseManager(str(directory / "stock_market.db"), str(directory / "ledger.db"))
+    await manager.initialize()
+    for stock_id in STOCKS:
+        await manager.add_stock(stock_id, f"测试{stock_id}", 50.0, 0.02, "综合")
+    if single_file:
+        # 在行情库中建同样的账本表，之后所有账本读写都指向行情库，即拆分前的单库布局
+        async with aiosqlite.connect(manager.db_path) as db:
+            await db.execute("ATTACH DATABASE ? AS ledger", (manager.ledger_db_path,))
+            cursor = await db.execute(
+                "SELECT sql FROM ledger.sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'")
+            for (sql,) in await cursor.fetchall():
+                await db.execute(sql)
+            await db.commit()
+            await db.execute("DETACH DATABASE ledger")
+        manager.ledger_db_path = manager.db_path
+    return manager
+
+
+async def run(manager: DatabaseManager, seconds: float, flush_rows: int, traders: int):
+    deadline = time.perf_counter() + seconds
+    latencies, flushes = [], 0
+
+    async def flusher():
+        nonlocal flushes
+        offset = 0
+        per_stock = flush_rows // len(STOCKS)
+        while time.perf_counter() < deadline:
+            klines = [(stock_id, from_epoch(BASE_TS + (offset + i) * 300), 50.0, 51.0, 49.0, 50.5)
+                      for stock_id in STOCKS for i in range(per_stock)]
+            offset += per_stock
+            await manager.batch_update_stock_data([(s, 50.5, 0.0) for s in STOCKS], klines)
+            flushes += 1
+
+    async def trader(n: int):
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await manager.add_holding(f"user{n}", STOCKS[i % len(STOCKS)], 10, 50.0)
+            latencies.append((time.perf_counter() - start) * 1000)
+            i += 1
+
+    await asyncio.gather(flusher(), *(trader(n) for n in range(traders)))
+    return latencies, flushes
+
+
+async def main(args):
+    for label, single_file in (("单库", True), ("独立账本库", False)):
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = await make_manager(Path(tmp), single_file)
+            latencies, flushes = await run(manager, args.seconds, args.flush_rows, args.traders)
+            print(f"{label:<8} 交易提交 {summarize(latencies)}  期间落库 {flushes} 批 × {args.flush_rows} 行")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--flush-rows", type=int, default=20000, help="每批落库的K线行数")
+    parser.add_argument("--traders", type=int, default=8, help="并发交易的用户数")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,76 @@
+# stock_market/tests/benchmarks/bench_login_storm.py
+"""
+登录风暴基准: 并发发起大量 bcrypt 校验，同时运行一个每 10ms 醒来一次的模拟 tick 循环，
+比较在事件循环上直接校验 (改造前) 与交给 PasswordHasher 线程池时 tick 的延迟和登录吞吐。
+
+    python tests/benchmarks/bench_login_storm.py [--logins 50] [--rounds 12]
+"""
+
+import argparse
+import asyncio
+import time
+
+import bcrypt
+from common import summarize
+
+from stock_market.config_defaults import PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS
+from stock_market.utils import HasherBusyError, PasswordHasher
+
+
+class BcryptContext:
+    """直接使用 bcrypt 模块、接口与 passlib CryptContext 相同的哈希上下文。"""
+    def __init__(self, rounds: int):
+        self.rounds = rounds
+
+    def hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+class InlineHasher(PasswordHasher):
+    """改造前的做法: 在事件循环线程上直接计算。"""
+    async def _run(self, func, *args):
+        return func(*args)
+
+
+async def storm(hasher: PasswordHasher, password_hash: str, logins: int):
+    lags = []
+    done = False
+
+    async def tick_loop():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - start - 0.01) * 1000)
+
+    ticker = asyncio.create_task(tick_loop())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(hasher.verify("secret", password_hash) for _ in range(logins)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    done = True
+    await ticker
+    rejected = sum(isinstance(r, HasherBusyError) for r in results)
+    return lags, (logins - rejected) / elapsed, rejected
+
+
+async def main(args):
+    context = BcryptContext(args.rounds)
+    password_hash = context.hash("secret")
+    for label, hasher in (("事件循环内", InlineHasher(context)),
+                          ("线程池", PasswordHasher(context, args.workers, args.max_pending))):
+        lags, rate, rejected = await storm(hasher, password_hash, args.logins)
+        hasher.shutdown()
+        print(f"{label:<8} tick 延迟 {summarize(lags)}  登录 {rate:6.1f} 次/秒  拒绝 {rejected}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt 轮数 (passlib 默认 12)")
+    parser.add_argument("--workers", type=int, default=PASSWORD_HASH_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=PASSWORD_HASH_MAX_PENDING)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+# stock_market/tests/benchmarks/bench_rate_limiter.py
+"""
+速率限制器基准: 100k 个不同客户端 IP 各发若干请求，比较旧实现 (每次请求解析白名单、逐条 re.match、
+每个 key 一个不淘汰的 deque) 与 RateLimiter 的单次判定耗时和常驻内存。
+
+    python tests/benchmarks/bench_rate_limiter.py [--ips 100000] [--requests-per-ip 3]
+"""
+
+import argparse
+import ipaddress
+import re
+import time
+import tracemalloc
+from collections import deque
+from types import SimpleNamespace
+
+import common  # noqa: F401  (载入 stock_market 包)
+
+from stock_market.config import RATE_LIMIT_WHITELIST
+from stock_market.config_defaults import RATE_LIMIT_MAX_KEYS
+from stock_market.rate_limiter import RateLimiter
+
+_ip_key = lambda request: f"ip:{request.remote}"  # noqa: E731
+RULES = [
+    {'path_regex': r'^/api/auth/.*', 'limit': 10, 'period': 60, 'get_key_func': _ip_key},
+    {'path_regex': r'^/api/v1/trade/.*', 'limit': 30, 'period': 60, 'get_key_func': _ip_key},
+    {'path_regex': r'^/api/v1/stock/[^/]+/details$', 'limit': 5, 'period': 60, 'get_key_func': _ip_key},
+    {'path_regex': r'^/api/v1/export/.*', 'limit': 5, 'period': 60, 'get_key_func': _ip_key},
+    {'path_regex': r'^/api/.*', 'limit': 60, 'period': 60, 'get_key_func': _ip_key},
+]
+PATHS = ["/api/stocks", "/api/kline/CY", "/api/v1/stock/CY/details", "/api/auth/login"]
+
+
+class LegacyLimiter:
+    """改造前 rate_limit_middleware 的判定逻辑 (不含 HTTP 部分)，作为对照。"""
+    def __init__(self, rules, whitelist):
+        self.rules = rules
+        self.whitelist = whitelist
+        self.storage = {}
+
+    def check(self, request):
+        ip = ipaddress.ip_address(request.remote)
+        for entry in self.whitelist:
+            if ip in ipaddress.ip_network(entry, strict=False):
+                return None, 0.0
+        for rule in self.rules:
+            if re.match(rule['path_regex'], request.path):
+                now = time.monotonic()
+                timestamps = self.storage.setdefault(rule['get_key_func'](request), deque())
+                while timestamps and timestamps[0] <= now - rule['period']:
+                    timestamps.popleft()
+                if len(timestamps) >= rule['limit']:
+                    return rule, 1.0
+                timestamps.append(now)
+                return rule, 0.0
+        return None, 0.0
+
+
+def _requests(ip_count, per_ip):
+    for n in range(per_ip):
+        for i in range(ip_count):
+            yield SimpleNamespace(remote=f"100.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", path=PATHS[(i + n) % len(PATHS)])
+
+
+def run(name, make_limiter, ip_count, per_ip):
+    requests = list(_requests(ip_count, per_ip))
+    limiter = make_limiter()
+    start = time.perf_counter()
+    for request in requests:
+        limiter.check(request)
+    elapsed = time.perf_counter() - start
+    # 内存单独测一遍，tracemalloc 会显著拖慢计时
+    tracemalloc.start()
+    limiter = make_limiter()
+    for request in requests:
+        limiter.check(request)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:<12} {len(requests):>8} 次请求  {elapsed / len(requests) * 1e6:7.2f} µs/次  "
+          f"常驻状态 {retained / 1024 / 1024:7.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ips", type=int, default=100000)
+    parser.add_argument("--requests-per-ip", type=int, default=3)
+    parser.add_argument("--max-keys", type=int, default=RATE_LIMIT_MAX_KEYS)
+    args = parser.parse_args()
+    run("旧实现", lambda: LegacyLimiter(RULES, RATE_LIMIT_WHITELIST), args.ips, args.requests_per_ip)
+    run("RateLimiter", lambda: RateLimiter(RULES, RATE_LIMIT_WHITELIST, args.max_keys), args.ips, args.requests_per_ip)
+
+
+if __name__ == "__main__":
+    main()
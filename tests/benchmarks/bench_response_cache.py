@@ -0,0 +1,93 @@
+# stock_market/tests/benchmarks/bench_response_cache.py
+"""
+公共行情接口压测: 在本机起一个 WebServer (20 支股票，各 9000 根5分钟K线)，用 aiohttp 客户端并发请求，
+分别测关闭和开启响应缓存时各接口的每秒请求数。"缓存关闭"时每个请求都重新构建并序列化、不压缩，
+即改造前的处理方式。
+
+    python tests/benchmarks/bench_response_cache.py [--seconds 5] [--concurrency 50]
+"""
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from common import make_stock
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from stock_market import response_cache
+from stock_market.config_defaults import RATE_LIMIT_MAX_KEYS
+from stock_market.rate_limiter import RateLimiter
+from stock_market.web_server import WebServer
+
+ENDPOINTS = [
+    "/api/v1/stocks",
+    "/api/v1/market/overview",
+    "/api/kline/S00?period=1d&padding=29",
+    "/api/kline/S00?period=7d",
+    "/api/kline/S00?period=30d",
+    "/api/kline/S00?period=7d&format=bin",
+]
+
+
+class BenchPlugin:
+    """WebServer 只读取的那部分插件状态。"""
+    def __init__(self, stock_count: int):
+        self.stocks = {s.stock_id: s for s in (make_stock(f"S{i:02d}", seed=i) for i in range(stock_count))}
+        self.tick_version = 1
+        self.persistence_queue = None
+        self.holder_index = None
+        # 压测的都是游客请求，不解析 user_hash
+        self.db_manager = SimpleNamespace(resolve_user_hash=lambda user_hash: None)
+        self.klines_ready = asyncio.Event()
+        self.klines_ready.set()
+
+    async def find_stock(self, identifier: str):
+        return self.stocks.get(identifier.upper())
+
+
+async def _load(session: ClientSession, url: str, seconds: float, concurrency: int) -> float:
+    deadline = time.perf_counter() + seconds
+    count = 0
+
+    async def worker():
+        nonlocal count
+        while time.perf_counter() < deadline:
+            async with session.get(url, headers={"Accept-Encoding": "gzip, br"}) as response:
+                await response.read()
+                assert response.status == 200, response.status
+            count += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return count / (time.perf_counter() - start)
+
+
+async def main(args):
+    server = WebServer(BenchPlugin(args.stocks))
+    # 压测流量全部来自本机，放行以免被限流
+    server.rate_limiter = RateLimiter(server.rate_limit_rules, ["127.0.0.1", "::1"], RATE_LIMIT_MAX_KEYS)
+    cache_get = server.response_cache.get
+    min_compress = response_cache.RESPONSE_CACHE_MIN_COMPRESS_BYTES
+    results = {}
+    async with TestServer(server.app) as test_server, ClientSession() as session:
+        for label, enabled in (("缓存关闭", False), ("缓存开启", True)):
+            server.response_cache.get = cache_get if enabled else (lambda key: None)
+            response_cache.RESPONSE_CACHE_MIN_COMPRESS_BYTES = min_compress if enabled else float("inf")
+            for path in ENDPOINTS:
+                results[(label, path)] = await _load(session, str(test_server.make_url(path)), args.seconds, args.concurrency)
+    server.password_hasher.shutdown()
+
+    print(f"{'接口':<42}{'缓存关闭':>12}{'缓存开启':>12}  (请求/秒)")
+    for path in ENDPOINTS:
+        print(f"{path:<44}{results[('缓存关闭', path)]:>12.0f}{results[('缓存开启', path)]:>14.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0, help="每个接口每种模式压测的秒数")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stocks", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+# stock_market/tests/benchmarks/bench_user_hash_index.py
+"""
+图表页 user_hash 解析基准: 账本中有 50k 个持仓用户时，比较旧做法 (查出所有持仓用户 ID，逐个 MD5
+直到匹配) 与 user_hashes 反查索引的单次解析耗时，以及启动时载入索引的耗时。
+
+    python tests/benchmarks/bench_user_hash_index.py [--users 50000] [--lookups 20]
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from common import summarize
+
+from stock_market.database import DatabaseManager
+from stock_market.utils import generate_user_hash
+
+
+async def legacy_resolve(db_manager: DatabaseManager, user_hash: str):
+    """改造前 _handle_kline_api / _handle_user_charts_page 的解析方式。"""
+    for user_id in await db_manager.get_all_user_ids_with_holdings():
+        if generate_user_hash(user_id) == user_hash:
+            return user_id
+    return None
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(str(Path(tmp) / "stock_market.db"), str(Path(tmp) / "ledger.db"))
+        await db_manager.initialize()
+        await db_manager.add_stock("CY", "晨宇科技", 57.0, 0.02, "科技")
+        user_ids = [f"{100000000 + i}" for i in range(args.users)]
+        rows = [(user_id, "CY", 100, 57.0, "2024-01-01T09:30:00") for user_id in user_ids]
+        await db_manager.import_holdings(["user_id", "stock_id", "quantity", "purchase_price", "purchase_timestamp"], rows)
+
+        start = time.perf_counter()
+        await db_manager._load_user_hashes()
+        print(f"启动时载入 {len(user_ids)} 个 user_hash: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        rng = random.Random(1)
+        targets = [generate_user_hash(rng.choice(user_ids)) for _ in range(args.lookups)]
+        legacy, indexed = [], []
+        for user_hash in targets:
+            start = time.perf_counter()
+            legacy_user = await legacy_resolve(db_manager, user_hash)
+            legacy.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            indexed_user = db_manager.resolve_user_hash(user_hash)
+            indexed.append((time.perf_counter() - start) * 1000)
+            assert legacy_user == indexed_user
+        print(f"逐个 MD5 解析   {summarize(legacy)}")
+        print(f"反查索引解析   {summarize(indexed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,46 @@
+# stock_market/tests/benchmarks/common.py
+"""基准脚本共用的载入和造数工具。基准脚本不被 pytest 收集，需直接运行: python tests/benchmarks/bench_xxx.py"""
+
+import os
+import random
+import statistics
+import sys
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from support import load_package  # noqa: E402
+
+load_package()
+from stock_market.models import VirtualStock  # noqa: E402
+
+
+def make_klines(count: int, seed: int = 1, end: datetime = None) -> List[dict]:
+    """生成 count 根以 end (默认当前5分钟整点) 结尾的5分钟K线，价格为随机游走。"""
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(second=0, microsecond=0)
+    end -= timedelta(minutes=end.minute % 5)
+    start = end - timedelta(minutes=5 * (count - 1))
+    price, klines = 50.0, []
+    for i in range(count):
+        open_ = price
+        price = round(max(1.0, price * (1 + rng.uniform(-0.01, 0.01))), 2)
+        klines.append({"date": (start + timedelta(minutes=5 * i)).isoformat(), "open": open_,
+                       "high": round(max(open_, price) * 1.002, 2), "low": round(min(open_, price) * 0.998, 2),
+                       "close": price})
+    return klines
+
+
+def make_stock(stock_id: str, kline_count: int = 9000, seed: int = 1) -> VirtualStock:
+    klines = make_klines(kline_count, seed)
+    stock = VirtualStock(stock_id=stock_id, name=f"测试{stock_id}", current_price=klines[-1]["close"])
+    stock.kline_history.extend(klines)
+    stock.rebuild_derived()
+    return stock
+
+
+def summarize(samples_ms: List[float]) -> str:
+    """把一组毫秒耗时格式化为 p50 / p99 / max。"""
+    ordered = sorted(samples_ms)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return f"p50 {statistics.median(ordered):8.2f} ms  p99 {p99:8.2f} ms  max {ordered[-1]:8.2f} ms  (n={len(ordered)})"
@@ -0,0 +1,26 @@
+# stock_market/tests/conftest.py
+
+import asyncio
+
+import pytest
+
+from support import load_package
+
+load_package()
+
+
+@pytest.fixture
+def run():
+    """在新的事件循环中运行协程 (插件代码全部为 asyncio)。"""
+    return asyncio.run
+
+
+@pytest.fixture
+def db_manager(tmp_path, run):
+    """已初始化的空库 (行情库 + 账本库)，含一支股票 CY。"""
+    from stock_market.database import DatabaseManager
+
+    manager = DatabaseManager(str(tmp_path / "stock_market.db"), str(tmp_path / "ledger.db"))
+    run(manager.initialize())
+    run(manager.add_stock("CY", "晨宇科技", 57.0, 0.02, "科技"))
+    return manager
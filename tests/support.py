@@ -0,0 +1,29 @@
+# stock_market/tests/support.py
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "stock_market"
+
+
+def load_package():
+    """
+    以包名 stock_market 载入插件目录 (AstrBot 以包的形式加载插件，模块内均为相对导入)。
+    部署用的 config.py 不在仓库中，缺失时以 config_example.py 代替。
+    """
+    if PACKAGE in sys.modules:
+        return sys.modules[PACKAGE]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE, os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = package
+    spec.loader.exec_module(package)
+    if not os.path.exists(os.path.join(ROOT, "config.py")):
+        config_spec = importlib.util.spec_from_file_location(f"{PACKAGE}.config", os.path.join(ROOT, "config_example.py"))
+        config = importlib.util.module_from_spec(config_spec)
+        sys.modules[config_spec.name] = config
+        config_spec.loader.exec_module(config)
+        package.config = config
+    return package
@@ -0,0 +1,135 @@
+# stock_market/tests/test_database_migrations.py
+
+import sqlite3
+from contextlib import closing
+
+from stock_market.database import DatabaseManager
+
+# 拆分账本库之前的单库结构 (users/holdings/subscriptions/trades 与行情数据在同一个库中)
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY NOT NULL,
+    login_id TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE stocks (
+    stock_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    current_price REAL NOT NULL,
+    volatility REAL NOT NULL DEFAULT 0.05,
+    industry TEXT NOT NULL DEFAULT '综合'
+);
+CREATE TABLE kline_history (
+    stock_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    open REAL NOT NULL,
+    high REAL NOT NULL,
+    low REAL NOT NULL,
+    close REAL NOT NULL,
+    PRIMARY KEY (stock_id, timestamp)
+);
+CREATE TABLE holdings (
+    holding_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    stock_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    purchase_price REAL NOT NULL,
+    purchase_timestamp TEXT NOT NULL
+);
+CREATE TABLE subscriptions (umo TEXT PRIMARY KEY NOT NULL);
+CREATE TABLE trades (
+    trade_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    stock_id TEXT NOT NULL,
+    side TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL,
+    amount REAL NOT NULL,
+    fee REAL NOT NULL DEFAULT 0,
+    slippage REAL NOT NULL DEFAULT 0,
+    realized_pnl REAL,
+    timestamp TEXT NOT NULL
+);
+"""
+
+
+def _create_legacy_db(path):
+    with closing(sqlite3.connect(path)) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        conn.execute("INSERT INTO stocks (stock_id, name, current_price) VALUES ('CY', '晨宇科技', 57)")
+        conn.executemany("INSERT INTO kline_history VALUES ('CY', ?, 1, 2, 0.5, 1.5)",
+                         [("2024-01-01T00:00:00",), ("2024-01-01T00:05:00",)])
+        # 股票已被删除但K线仍在的孤儿行，迁移时丢弃
+        conn.execute("INSERT INTO kline_history VALUES ('GONE', '2024-01-01T00:00:00', 1, 1, 1, 1)")
+        conn.execute("INSERT INTO users (user_id, login_id, password_hash) VALUES ('u1', 'alice', 'x')")
+        conn.executemany(
+            "INSERT INTO holdings (user_id, stock_id, quantity, purchase_price, purchase_timestamp) VALUES (?, ?, ?, ?, ?)",
+            [("u1", "CY", 100, 10.0, "2024-01-01T00:00:00"), ("u1", "CY", 50, 16.0, "2024-01-02T00:00:00"),
+             ("u2", "CY", 10, 20.0, "2024-01-02T00:00:00")])
+        conn.execute("INSERT INTO subscriptions VALUES ('group:1')")
+        conn.execute("INSERT INTO trades (user_id, stock_id, side, quantity, price, amount, timestamp) "
+                     "VALUES ('u1', 'CY', 'buy', 100, 10.0, 1000.0, '2024-01-01T00:00:00')")
+        conn.commit()
+
+
+def _tables(path):
+    with closing(sqlite3.connect(path)) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _query(path, sql):
+    with closing(sqlite3.connect(path)) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def test_upgrade_moves_every_ledger_table(tmp_path, run):
+    market_db, ledger_db = str(tmp_path / "stock_market.db"), str(tmp_path / "ledger.db")
+    _create_legacy_db(market_db)
+
+    manager = DatabaseManager(market_db, ledger_db)
+    run(manager.initialize())
+
+    assert not _tables(market_db) & {"users", "holdings", "subscriptions", "trades"}
+    assert _query(ledger_db, "SELECT user_id, login_id FROM users") == [("u1", "alice")]
+    assert _query(ledger_db, "SELECT user_id, quantity, purchase_price FROM holdings ORDER BY holding_id") == [
+        ("u1", 100, 10.0), ("u1", 50, 16.0), ("u2", 10, 20.0)]
+    assert _query(ledger_db, "SELECT umo FROM subscriptions") == [("group:1",)]
+    assert _query(ledger_db, "SELECT user_id, side, quantity, amount FROM trades") == [("u1", "buy", 100, 1000.0)]
+    # positions 由迁移过来的持仓批次重建
+    assert _query(ledger_db, "SELECT user_id, stock_id, quantity, cost_basis FROM positions ORDER BY user_id") == [
+        ("u1", "CY", 150, 1800.0), ("u2", "CY", 10, 200.0)]
+    assert run(manager.load_subscriptions()) == {"group:1"}
+
+
+def test_upgrade_converts_klines_and_drops_orphans(tmp_path, run):
+    market_db, ledger_db = str(tmp_path / "stock_market.db"), str(tmp_path / "ledger.db")
+    _create_legacy_db(market_db)
+
+    run(DatabaseManager(market_db, ledger_db).initialize())
+
+    assert "kline_history" not in _tables(market_db)
+    assert _query(market_db, "PRAGMA user_version") == [(1,)]
+    rows = _query(market_db, "SELECT s.stock_id, k.open, k.high, k.low, k.close FROM kline_5m k "
+                             "JOIN stocks s ON s.stock_key = k.stock_key")
+    assert rows == [("CY", 1, 2, 0.5, 1.5)] * 2
+
+
+def test_upgrade_finishes_tables_left_behind_by_an_earlier_partial_migration(tmp_path, run):
+    market_db, ledger_db = str(tmp_path / "stock_market.db"), str(tmp_path / "ledger.db")
+    _create_legacy_db(market_db)
+    manager = DatabaseManager(market_db, ledger_db)
+    run(manager.initialize())
+    # 模拟只迁移了 users 的旧版本: 行情库中还留着一张持仓表，而账本库中已有汇总持仓
+    with closing(sqlite3.connect(market_db)) as conn:
+        conn.execute("CREATE TABLE holdings (holding_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                     "stock_id TEXT NOT NULL, quantity INTEGER NOT NULL, purchase_price REAL NOT NULL, "
+                     "purchase_timestamp TEXT NOT NULL)")
+        conn.execute("INSERT INTO holdings VALUES (10, 'u3', 'CY', 5, 30.0, '2024-01-03T00:00:00')")
+        conn.commit()
+
+    run(DatabaseManager(market_db, ledger_db).initialize())
+
+    assert "holdings" not in _tables(market_db)
+    assert ("u3", 5) in _query(ledger_db, "SELECT user_id, quantity FROM holdings")
+    assert ("u3", "CY", 5, 150.0) in _query(ledger_db, "SELECT user_id, stock_id, quantity, cost_basis FROM positions")
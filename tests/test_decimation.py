@@ -0,0 +1,52 @@
+# stock_market/tests/test_decimation.py
+
+import random
+
+import pytest
+
+from stock_market.utils import decimate_ohlc
+
+
+def _klines(n, seed=0):
+    rng = random.Random(seed)
+    klines, price = [], 100.0
+    for i in range(n):
+        o = price
+        price = max(0.01, price + rng.uniform(-3, 3))
+        klines.append({"date": f"2024-01-01T00:00:{i:05d}", "open": o, "high": max(o, price) + rng.uniform(0, 2),
+                       "low": max(0.01, min(o, price) - rng.uniform(0, 2)), "close": price})
+    return klines
+
+
+def test_short_input_is_returned_unchanged():
+    klines = _klines(10)
+    result = decimate_ohlc(klines, 10)
+    assert result == klines and result is not klines
+    assert decimate_ohlc(klines, 1) == klines
+
+
+@pytest.mark.parametrize("n, max_points", [(11, 10), (1000, 50), (1001, 240), (8999, 100), (57, 3)])
+def test_every_bucket_preserves_open_high_low_close(n, max_points):
+    klines = _klines(n, seed=n)
+    result = decimate_ohlc(klines, max_points)
+    assert len(result) == max_points
+
+    # 除最后一根外按根数均分为 max_points - 1 个连续的桶
+    head, buckets = n - 1, max_points - 1
+    for i, candle in enumerate(result[:-1]):
+        bucket = klines[i * head // buckets:(i + 1) * head // buckets]
+        assert bucket, "每个桶至少包含一根K线"
+        assert candle == {"date": bucket[0]["date"], "open": bucket[0]["open"],
+                          "high": max(k["high"] for k in bucket), "low": min(k["low"] for k in bucket),
+                          "close": bucket[-1]["close"]}
+    assert result[-1] is klines[-1]
+
+
+def test_global_extremes_survive():
+    klines = _klines(5000, seed=7)
+    klines[1234]["high"] = 10_000.0
+    klines[4321]["low"] = 0.001
+    result = decimate_ohlc(klines, 60)
+    assert max(k["high"] for k in result) == 10_000.0
+    assert min(k["low"] for k in result) == 0.001
+    assert result[0]["open"] == klines[0]["open"]
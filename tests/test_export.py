@@ -0,0 +1,45 @@
+# stock_market/tests/test_export.py
+
+from stock_market.database import from_epoch
+from stock_market.export import CSV_HEADER, iter_kline_export
+
+BASE_TS = 1704038400  # 2024-01-01 00:00 UTC
+
+
+def _seed(db_manager, run, stock_ids, count):
+    run(db_manager.batch_update_stock_data([], [
+        (stock_id, from_epoch(BASE_TS + i * 300), i, i + 1, i - 1, i + 0.5)
+        for stock_id in stock_ids for i in range(count)]))
+
+
+async def _collect(aiter):
+    return [item async for item in aiter]
+
+
+def test_iter_klines_pages_through_every_row_in_order(db_manager, run):
+    run(db_manager.add_stock("HL", "今州航空", 49.0, 0.025, "航空"))
+    _seed(db_manager, run, ["CY", "HL"], 23)
+
+    rows = run(_collect(db_manager.iter_klines(["HL", "CY"], None, None, page_size=5)))
+
+    assert [(sid, ts) for sid, ts, *_ in rows] == [
+        (sid, BASE_TS + i * 300) for sid in ("CY", "HL") for i in range(23)]
+
+
+def test_iter_klines_respects_the_time_range(db_manager, run):
+    _seed(db_manager, run, ["CY"], 20)
+
+    rows = run(_collect(db_manager.iter_klines(["CY"], BASE_TS + 300 * 5, BASE_TS + 300 * 15, page_size=4)))
+
+    assert [ts for _, ts, *_ in rows] == [BASE_TS + i * 300 for i in range(5, 15)]
+
+
+def test_csv_export(db_manager, run):
+    _seed(db_manager, run, ["CY"], 3)
+
+    text = "".join(run(_collect(iter_kline_export(db_manager, ["CY"], None, None, chunk_rows=2))))
+
+    lines = text.splitlines(keepends=True)
+    assert lines[0] == CSV_HEADER
+    assert lines[1] == f"CY,{from_epoch(BASE_TS)},{BASE_TS},0.0,1.0,-1.0,0.5\n"
+    assert len(lines) == 4
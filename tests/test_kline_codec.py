@@ -0,0 +1,148 @@
+# stock_market/tests/test_kline_codec.py
+
+import json
+import struct
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from stock_market.database import from_epoch, to_epoch
+from stock_market.kline_codec import (KLINE_BINARY_MAGIC, KlineColumns, encode_klines, prefers_binary,
+                                      replace_user_holdings)
+from stock_market.models import VirtualStock
+from stock_market.response_cache import ResponseCache
+from stock_market.utils import decimate_ohlc
+from stock_market.web_server import WebServer
+
+START = datetime(2024, 3, 1, 9, 0)
+
+
+def decode_klines(body: bytes):
+    """按 kline_codec 中描述的格式解码 (与 static/script.js 的 decodeKlineBinary 相同)。"""
+    magic, meta_len = struct.unpack_from('<4sI', body)
+    assert magic == KLINE_BINARY_MAGIC and meta_len % 4 == 0
+    meta = json.loads(body[8:8 + meta_len])
+    n, offset = meta['count'], 8 + meta_len
+    ts = struct.unpack_from(f'<{n}I', body, offset)
+    prices = [struct.unpack_from(f'<{n}f', body, offset + 4 * n * (i + 1)) for i in range(4)]
+    assert len(body) == offset + 20 * n
+    return meta['user_holdings'], [(t, *(round(p[i], 2) for p in prices)) for i, t in enumerate(ts)]
+
+
+def _klines(n):
+    return [{"date": (START + timedelta(minutes=5 * i)).isoformat(), "open": 10 + i, "high": 12.5 + i,
+             "low": 9.25 + i, "close": 11.75 + i} for i in range(n)]
+
+
+def _stock(klines):
+    stock = VirtualStock(stock_id="CY", name="晨宇科技", current_price=10.0)
+    for kline in klines:
+        stock.append_kline(kline)
+    return stock
+
+
+def test_round_trip():
+    klines = _klines(5)
+    holdings = [{"stock_id": "CY", "quantity": 10, "avg_cost": 12.34}]
+
+    user_holdings, rows = decode_klines(encode_klines(KlineColumns.from_klines(klines), holdings))
+
+    assert user_holdings == holdings
+    assert rows == [(to_epoch(k['date']), k['open'], k['high'], k['low'], k['close']) for k in klines]
+
+
+def test_empty_round_trip():
+    assert decode_klines(encode_klines(KlineColumns())) == ([], [])
+
+
+def test_replace_user_holdings_keeps_columns():
+    body = encode_klines(KlineColumns.from_klines(_klines(3)))
+    holdings = [{"stock_id": "CY", "quantity": 1, "avg_cost": 1.5}] * 3
+
+    user_holdings, rows = decode_klines(replace_user_holdings(body, holdings))
+
+    assert user_holdings == holdings
+    assert rows == decode_klines(body)[1]
+
+
+def test_given_timestamps_are_used_instead_of_parsing_dates():
+    klines = _klines(3)
+    columns = KlineColumns.from_klines(klines, [1, 2, 3])
+    assert list(columns.ts) == [1, 2, 3]
+    assert list(KlineColumns.from_klines(klines).ts) == [to_epoch(k['date']) for k in klines]
+
+
+@pytest.mark.parametrize("n, max_points", [(10, 50), (1000, 50), (2016, 300)])
+def test_column_decimation_matches_decimate_ohlc(n, max_points):
+    klines = _klines(n)
+    expected = KlineColumns.from_klines(decimate_ohlc(klines, max_points))
+    decimated = KlineColumns.from_klines(klines).decimate(max_points)
+    for name in KlineColumns.__slots__:
+        assert list(getattr(decimated, name)) == list(getattr(expected, name))
+
+
+@pytest.mark.parametrize("accept, binary", [
+    ("application/octet-stream", True),
+    ("application/octet-stream, application/json;q=0.5", True),
+    ("application/json, application/octet-stream;q=0.9", False),
+    ("application/octet-stream;q=0", False),
+    ("application/octet-stream; q=0.0, */*", False),
+    ("*/*", False),
+    ("application/json", False),
+    ("", False),
+    ("application/octet-stream;q=abc", False),
+])
+def test_accept_negotiation(accept, binary):
+    assert prefers_binary(accept) is binary
+
+
+def test_kline_ts_follows_history():
+    klines = _klines(20)
+    stock = _stock(klines)
+    assert list(stock.kline_ts) == [to_epoch(k['date']) for k in klines]
+    stock.rebuild_derived()
+    assert list(stock.kline_ts) == [to_epoch(k['date']) for k in klines]
+
+
+@pytest.mark.parametrize("period, padding, since", [("1d", 0, None), ("7d", 0, None), ("30d", 10, None),
+                                                    ("1d", 0, 100), ("7d", 0, 1000)])
+def test_binary_and_json_paths_agree(period, padding, since):
+    klines = _klines(3000)
+    stock = _stock(klines)
+    server = WebServer.__new__(WebServer)
+    since_ts = to_epoch(klines[-1]['date']) - since * 60 if since is not None else None
+
+    history = server._build_kline_history(stock, period, padding, since_ts)
+    columns = server._build_kline_columns(stock, period, padding, since_ts)
+
+    assert list(columns.ts) == [to_epoch(k['date']) for k in history]
+    assert list(columns.high) == [k['high'] for k in history]
+    assert list(columns.close) == [k['close'] for k in history]
+
+
+def test_in_memory_aggregation_uses_clock_aligned_buckets():
+    stock = _stock(_klines(24))  # 09:00 起两小时的5分钟K
+    server = WebServer.__new__(WebServer)
+
+    history = server._build_kline_history(stock, "7d", 0, None)
+
+    assert [k['date'] for k in history] == [from_epoch(to_epoch(START.isoformat()) + 1800 * i) for i in range(4)]
+    assert history[0] == {"date": START.isoformat(), "open": 10, "high": 17.5, "low": 9.25, "close": 16.75}
+
+
+@pytest.mark.parametrize("n, max_points, decimated", [(50, None, False), (50, 100, False), (500, 100, True)])
+def test_responses_flag_decimation(n, max_points, decimated):
+    klines = _klines(n)
+    server = WebServer.__new__(WebServer)
+    plugin = SimpleNamespace(tick_version=1, persistence_queue=SimpleNamespace(committed_version=0))
+    server.response_cache = ResponseCache(plugin)
+    version = server.response_cache.version
+
+    payload = json.loads(server._cache_kline_json("json", klines, max_points, version).body)
+    body = server._cache_kline_columns("bin", KlineColumns.from_klines(klines), max_points, version).body
+    meta = json.loads(body[8:8 + struct.unpack_from('<I', body, 4)[0]])
+
+    assert payload["decimated"] is decimated and meta["decimated"] is decimated
+    assert list(payload)[-1] == "user_holdings"  # 换入持仓时依赖它是最后一个字段
+    assert len(payload["kline_history"]) == meta["count"] == (min(n, max_points) if max_points else n)
@@ -0,0 +1,83 @@
+# stock_market/tests/test_kline_retention.py
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import aiosqlite
+
+from stock_market import maintenance
+from stock_market.database import from_epoch
+from stock_market.maintenance import MaintenanceManager
+
+DAY = 86400
+BASE_TS = int(datetime(2024, 1, 1).timestamp())  # 本地零点
+
+
+def _seed(db_manager, run, days):
+    klines = []
+    for i in range(days * 288):
+        o = 50 + (i * 7) % 23
+        klines.append(("CY", from_epoch(BASE_TS + i * 300), o, o + 1 + i % 5, o - 1 - i % 3, o + (i % 4) - 2))
+    run(db_manager.batch_update_stock_data([], klines))
+    return [(BASE_TS + i * 300, *k[2:]) for i, k in enumerate(klines)]
+
+
+def _aggregate(rows, bucket_of):
+    buckets = {}
+    for ts, o, h, l, c in rows:
+        bucket = buckets.setdefault(bucket_of(ts), [o, h, l, c])
+        bucket[1], bucket[2], bucket[3] = max(bucket[1], h), min(bucket[2], l), c
+    return [(ts, *ohlc) for ts, ohlc in sorted(buckets.items())]
+
+
+async def _read(db_manager, table):
+    async with aiosqlite.connect(db_manager.db_path) as db:
+        async with db.execute(f"SELECT ts, open, high, low, close FROM {table} ORDER BY ts") as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+def test_windowed_rollup_matches_whole_history(db_manager, run, monkeypatch):
+    monkeypatch.setattr(maintenance, "KLINE_ROLLUP_WINDOW_DAYS", 3)
+    rows = _seed(db_manager, run, 10)
+    cutoff = BASE_TS + 8 * DAY
+    manager = MaintenanceManager(SimpleNamespace(db_manager=db_manager))
+    stock_key = db_manager.get_stock_keys()["CY"]
+    windows = []
+    original = db_manager.rollup_klines_window
+
+    async def record(key, start_ts, end_ts):
+        windows.append((start_ts, end_ts))
+        await original(key, start_ts, end_ts)
+
+    monkeypatch.setattr(db_manager, "rollup_klines_window", record)
+    run(manager._rollup_expired_klines(stock_key, cutoff))
+
+    assert windows == [(BASE_TS, BASE_TS + 3 * DAY), (BASE_TS + 3 * DAY, BASE_TS + 6 * DAY),
+                       (BASE_TS + 6 * DAY, cutoff)]
+    expired = [row for row in rows if row[0] < cutoff]
+    assert run(_read(db_manager, "kline_1h")) == _aggregate(expired, lambda ts: ts - ts % 3600)
+    assert run(_read(db_manager, "kline_1d")) == _aggregate(expired, lambda ts: BASE_TS + (ts - BASE_TS) // DAY * DAY)
+
+
+def test_rollup_does_not_overwrite_existing_buckets(db_manager, run):
+    _seed(db_manager, run, 2)
+    stock_key = db_manager.get_stock_keys()["CY"]
+    run(db_manager.rollup_klines_window(stock_key, BASE_TS, BASE_TS + DAY))
+    before = run(_read(db_manager, "kline_1d"))
+
+    run(db_manager.batch_update_stock_data([], [("CY", from_epoch(BASE_TS), 1, 999, 0.5, 1)]))
+    run(db_manager.rollup_klines_window(stock_key, BASE_TS, BASE_TS + DAY))
+
+    assert run(_read(db_manager, "kline_1d")) == before
+
+
+def test_prune_deletes_only_expired_rows_in_batches(db_manager, run):
+    rows = _seed(db_manager, run, 1)
+    stock_key = db_manager.get_stock_keys()["CY"]
+    cutoff = BASE_TS + 100 * 300
+
+    counts = [run(db_manager.prune_klines_batch("kline_5m", stock_key, cutoff, 40)) for _ in range(4)]
+
+    assert counts == [40, 40, 20, 0]
+    assert [row[0] for row in run(_read(db_manager, "kline_5m"))] == [row[0] for row in rows[100:]]
+    assert run(db_manager.get_oldest_kline_ts(stock_key)) == cutoff
@@ -0,0 +1,84 @@
+# stock_market/tests/test_password_hasher.py
+
+import asyncio
+import time
+
+import pytest
+
+from stock_market.utils import HasherBusyError, PasswordHasher
+
+bcrypt = pytest.importorskip("bcrypt")
+
+
+class BcryptContext:
+    """直接使用 bcrypt 模块、接口与 CryptContext 相同的哈希上下文 (低轮数以缩短测试时间)。"""
+    def __init__(self, rounds: int = 8):
+        self.rounds = rounds
+
+    def hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+async def _tick_lags(until: asyncio.Future, interval: float = 0.01) -> list:
+    """模拟 tick 循环: 反复 sleep(interval)，记录每次醒来比预期晚了多少秒。"""
+    lags = []
+    while not until.done():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+def test_login_storm_does_not_stall_the_event_loop(run):
+    context = BcryptContext()
+    password_hash = context.hash("secret")
+
+    async def storm():
+        hasher = PasswordHasher(context, workers=2, max_pending=64)
+        try:
+            logins = asyncio.ensure_future(asyncio.gather(
+                *(hasher.verify("secret" if i % 2 else "wrong", password_hash) for i in range(40))))
+            lags = await _tick_lags(logins)
+            return await logins, lags
+        finally:
+            hasher.shutdown()
+
+    results, lags = run(storm())
+
+    assert results == [bool(i % 2) for i in range(40)]
+    # 40 次校验在事件循环上串行执行会阻塞约 40 × 20ms；放到线程池后 tick 只受线程调度影响
+    assert len(lags) > 5
+    assert max(lags) < 0.1
+
+
+def test_saturated_pool_rejects_immediately(run):
+    context = BcryptContext()
+    password_hash = context.hash("secret")
+
+    async def burst():
+        hasher = PasswordHasher(context, workers=1, max_pending=4)
+        try:
+            return await asyncio.gather(*(hasher.verify("secret", password_hash) for _ in range(10)),
+                                        return_exceptions=True)
+        finally:
+            hasher.shutdown()
+
+    results = run(burst())
+
+    assert results[:4] == [True] * 4
+    assert all(isinstance(r, HasherBusyError) for r in results[4:])
+
+
+def test_hash_round_trip(run):
+    async def round_trip():
+        hasher = PasswordHasher(BcryptContext())
+        try:
+            password_hash = await hasher.hash("secret")
+            return await hasher.verify("secret", password_hash), await hasher.verify("other", password_hash)
+        finally:
+            hasher.shutdown()
+
+    assert run(round_trip()) == (True, False)
@@ -0,0 +1,133 @@
+# stock_market/tests/test_persistence.py
+
+import asyncio
+import sqlite3
+from contextlib import closing
+from types import SimpleNamespace
+
+from stock_market.persistence import PersistenceQueue
+
+
+def _queue(db_manager):
+    return PersistenceQueue(SimpleNamespace(db_manager=db_manager))
+
+
+def _price(db_manager, stock_id):
+    with closing(sqlite3.connect(db_manager.db_path)) as conn:
+        return conn.execute("SELECT current_price FROM stocks WHERE stock_id = ?", (stock_id,)).fetchone()[0]
+
+
+def _klines(db_manager):
+    with closing(sqlite3.connect(db_manager.db_path)) as conn:
+        return conn.execute("SELECT s.stock_id, k.close FROM kline_5m k JOIN stocks s ON s.stock_key = k.stock_key "
+                            "ORDER BY k.ts").fetchall()
+
+
+def _slow_writes(db_manager, started: asyncio.Event, release: asyncio.Event):
+    """让 batch_update_stock_data 在真正写库前等待 release，用来构造"提交进行中"的时序。"""
+    write = db_manager.batch_update_stock_data
+
+    async def slow(prices, klines):
+        started.set()
+        await release.wait()
+        await write(prices, klines)
+    db_manager.batch_update_stock_data = slow
+
+
+def test_latest_value_wins_within_the_buffer(db_manager, run):
+    queue = _queue(db_manager)
+    queue.enqueue([("CY", 10.0, 0.0)], [("CY", "2024-01-01T00:00:00", 1, 2, 1, 1.5)])
+    queue.enqueue([("CY", 11.0, 0.0)], [("CY", "2024-01-01T00:00:00", 1, 3, 1, 2.5)])
+    assert queue.depth == 2
+
+    assert run(queue.flush())
+    assert _price(db_manager, "CY") == 11.0
+    assert _klines(db_manager) == [("CY", 2.5)]
+    assert queue.committed_version == 1
+
+
+def test_failed_batch_is_requeued_behind_newer_updates(db_manager, run):
+    queue = _queue(db_manager)
+    write = db_manager.batch_update_stock_data
+
+    async def scenario():
+        async def failing(prices, klines):
+            # 提交期间又有新的 tick 入队，随后本批写入失败
+            queue.enqueue([("CY", 12.0, 0.0)], [("CY", "2024-01-01T00:05:00", 2, 2, 2, 2)])
+            raise sqlite3.OperationalError("database is locked")
+        db_manager.batch_update_stock_data = failing
+        queue.enqueue([("CY", 10.0, 0.0)], [("CY", "2024-01-01T00:00:00", 1, 1, 1, 1)])
+        assert not await queue.flush()
+        db_manager.batch_update_stock_data = write
+        assert await queue.flush()
+    run(scenario())
+
+    # 新价格不被重试的旧批次覆盖，两根K线都写入
+    assert _price(db_manager, "CY") == 12.0
+    assert _klines(db_manager) == [("CY", 1), ("CY", 2)]
+    assert queue.failures == 1
+
+
+def test_admin_price_is_not_overwritten_by_an_in_flight_stale_price(db_manager, run):
+    queue = _queue(db_manager)
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+        _slow_writes(db_manager, started, release)
+        queue.enqueue([("CY", 10.0, 0.0)], [])
+        stale_commit = asyncio.create_task(queue.flush())
+        await started.wait()
+        # 管理员改价与 main.admin_set_price 相同: 经队列写入
+        queue.enqueue([("CY", 99.0, 0.0)], [])
+        admin_commit = asyncio.create_task(queue.flush())
+        release.set()
+        await asyncio.gather(stale_commit, admin_commit)
+    run(scenario())
+
+    assert _price(db_manager, "CY") == 99.0
+
+
+def test_rename_keeps_klines_buffered_under_the_old_id(db_manager, run):
+    queue = _queue(db_manager)
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+        _slow_writes(db_manager, started, release)
+        queue.enqueue([], [("CY", "2024-01-01T00:00:00", 1, 1, 1, 1)])
+        in_flight = asyncio.create_task(queue.flush())
+        await started.wait()
+        queue.enqueue([("CY", 5.0, 0.0)], [("CY", "2024-01-01T00:05:00", 2, 2, 2, 2)])
+
+        async def rename():
+            # 与 main.admin_modify_stock 相同的步骤
+            async with queue.hold_commits():
+                await db_manager.update_stock_id("CY", "CX")
+                queue.rename_stock("CY", "CX")
+        renaming = asyncio.create_task(rename())
+        release.set()
+        await asyncio.gather(in_flight, renaming)
+        await queue.flush()
+    run(scenario())
+
+    assert _klines(db_manager) == [("CX", 1), ("CX", 2)]
+    assert _price(db_manager, "CX") == 5.0
+
+
+def test_close_waits_for_the_in_flight_batch(db_manager, run):
+    queue = _queue(db_manager)
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+        _slow_writes(db_manager, started, release)
+        queue.start()
+        queue.enqueue([("CY", 10.0, 0.0)], [("CY", "2024-01-01T00:00:00", 1, 1, 1, 1)])
+        await started.wait()
+        queue.enqueue([], [("CY", "2024-01-01T00:05:00", 2, 2, 2, 2)])
+        closing_task = asyncio.create_task(queue.close())
+        await asyncio.sleep(0)
+        release.set()
+        await closing_task
+    run(scenario())
+
+    assert _klines(db_manager) == [("CY", 1), ("CY", 2)]
+    assert queue.depth == 0
@@ -0,0 +1,69 @@
+# stock_market/tests/test_rate_limiter.py
+
+from types import SimpleNamespace
+
+from stock_market.rate_limiter import RateLimiter
+
+RULES = [
+    {"path_regex": r"/api/auth/login", "limit": 5, "period": 60, "get_key_func": lambda r: r.remote},
+    {"path_regex": r"/api/.*", "limit": 3, "period": 30, "get_key_func": lambda r: r.remote},
+]
+
+
+def _limiter(whitelist=(), max_keys=1000):
+    return RateLimiter(RULES, whitelist, max_keys)
+
+
+def test_first_matching_rule_wins():
+    limiter = _limiter()
+    assert limiter.match_rule("/api/auth/login")[0] == 0
+    assert limiter.match_rule("/api/stocks")[0] == 1
+    assert limiter.match_rule("/static/script.js") is None
+
+
+def test_gcra_allows_a_burst_then_paces_requests():
+    limiter = _limiter()
+    # limit=3, period=30: 突发 3 次，之后每 10 秒放行一次
+    assert [limiter.hit(1, "ip", 3, 30, now=100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.hit(1, "ip", 3, 30, now=100.0) == 10.0
+    assert limiter.hit(1, "ip", 3, 30, now=105.0) == 5.0
+    assert limiter.hit(1, "ip", 3, 30, now=110.0) == 0.0
+    assert limiter.hit(1, "ip", 3, 30, now=110.0) > 0
+
+
+def test_rejected_requests_do_not_extend_the_wait():
+    limiter = _limiter()
+    for _ in range(3):
+        limiter.hit(1, "ip", 3, 30, now=0.0)
+    for _ in range(50):
+        limiter.hit(1, "ip", 3, 30, now=1.0)
+    assert limiter.hit(1, "ip", 3, 30, now=10.0) == 0.0
+
+
+def test_keys_and_rules_are_limited_independently():
+    limiter = _limiter()
+    for _ in range(3):
+        limiter.hit(1, "a", 3, 30, now=0.0)
+    assert limiter.hit(1, "a", 3, 30, now=0.0) > 0
+    assert limiter.hit(1, "b", 3, 30, now=0.0) == 0.0
+    assert limiter.hit(0, "a", 5, 60, now=0.0) == 0.0
+
+
+def test_state_is_bounded_and_expired_entries_go_first():
+    limiter = _limiter(max_keys=100)
+    for i in range(1000):
+        limiter.hit(1, f"10.0.{i // 256}.{i % 256}", 3, 30, now=float(i))
+    assert len(limiter) <= 100
+    # 每个条目的 TAT 只比写入时晚 10 秒，更早的条目已过期被清掉
+    assert len(limiter) == 10
+
+
+def test_check_honours_the_whitelist():
+    limiter = _limiter(whitelist=["192.168.0.0/16", "not-a-network"])
+    whitelisted = SimpleNamespace(remote="192.168.1.7", path="/api/stocks")
+    for _ in range(10):
+        assert limiter.check(whitelisted) == (None, 0.0)
+
+    other = SimpleNamespace(remote="8.8.8.8", path="/api/stocks")
+    results = [limiter.check(other)[1] for _ in range(4)]
+    assert results[:3] == [0.0, 0.0, 0.0] and results[3] > 0
@@ -0,0 +1,50 @@
+# stock_market/tests/test_response_cache.py
+
+import gzip
+from types import SimpleNamespace
+
+from aiohttp.test_utils import make_mocked_request
+
+from stock_market import response_cache
+from stock_market.response_cache import ResponseCache
+
+LARGE = {"klines": [{"close": i} for i in range(500)]}
+
+
+def _cache():
+    plugin = SimpleNamespace(tick_version=1, persistence_queue=SimpleNamespace(committed_version=0))
+    return plugin, ResponseCache(plugin)
+
+
+def test_gzip_fallback_without_brotli(monkeypatch):
+    monkeypatch.setattr(response_cache, "brotli", None)
+    _, cache = _cache()
+    payload = cache.put("k", LARGE)
+
+    assert payload.br_body is None
+    request = make_mocked_request("GET", "/", headers={"Accept-Encoding": "gzip, br"})
+    response = ResponseCache.respond(request, payload)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.body) == payload.body
+
+
+def test_small_bodies_are_not_precompressed():
+    _, cache = _cache()
+    payload = cache.put("k", {"a": 1})
+    assert payload.gzip_body is None and payload.br_body is None
+
+
+def test_entries_expire_with_the_tick_version():
+    plugin, cache = _cache()
+    cache.put("k", LARGE)
+    assert cache.get("k") is not None
+    plugin.tick_version += 1
+    assert cache.get("k") is None
+
+
+def test_result_computed_across_a_version_change_is_not_cached():
+    plugin, cache = _cache()
+    version = cache.version
+    plugin.persistence_queue.committed_version += 1
+    assert cache.put("k", LARGE, version=version).body
+    assert cache.get("k") is None
@@ -0,0 +1,72 @@
+# stock_market/tests/test_rolling_window.py
+
+import random
+
+import pytest
+
+from stock_market.models import RollingWindow
+
+
+def _candles(n, seed=7):
+    rng = random.Random(seed)
+    price, candles = 50.0, []
+    for _ in range(n):
+        open_ = price
+        price = round(price * (1 + rng.uniform(-0.03, 0.03)), 2)
+        high = round(max(open_, price) + rng.uniform(0, 1), 2)
+        low = round(min(open_, price) - rng.uniform(0, 1), 2)
+        candles.append({"open": open_, "high": high, "low": low, "close": price})
+    return candles
+
+
+def test_empty_window():
+    window = RollingWindow(12)
+    assert len(window) == 0
+    assert (window.open, window.high, window.low, window.close) == (None, None, None, None)
+    assert window.sma(1) is None and window.previous_close() is None
+
+
+@pytest.mark.parametrize("size", [1, 5, 12, 288])
+def test_matches_brute_force_over_every_prefix(size):
+    candles = _candles(600)
+    window = RollingWindow(size)
+    for i, k in enumerate(candles):
+        window.push(k["open"], k["high"], k["low"], k["close"])
+        tail = candles[max(0, i + 1 - size):i + 1]
+        assert len(window) == len(tail)
+        assert window.open == tail[0]["open"]
+        assert window.close == tail[-1]["close"]
+        assert window.high == max(c["high"] for c in tail)
+        assert window.low == min(c["low"] for c in tail)
+
+
+def test_sma_and_previous_close():
+    window = RollingWindow(5)
+    for close in [1, 2, 3, 4, 5, 6, 7]:
+        window.push(close, close, close, close)
+    assert window.sma(5) == 5
+    assert window.sma(2) == 6.5
+    assert window.sma(6) is None
+    assert window.previous_close() == 6
+    assert window.previous_close(4) == 3
+    assert window.previous_close(5) is None
+
+
+def test_equal_extremes_expire_by_position():
+    window = RollingWindow(3)
+    for high in [9, 9, 1, 1, 1]:
+        window.push(1, high, 0, 1)
+    assert window.high == 1
+
+
+def test_reset_keeps_only_the_last_size_candles():
+    candles = _candles(100)
+    window = RollingWindow(10)
+    window.push(1, 1000, -1000, 1)
+    window.reset(candles)
+
+    tail = candles[-10:]
+    assert len(window) == 10
+    assert (window.open, window.close) == (tail[0]["open"], tail[-1]["close"])
+    assert window.high == max(c["high"] for c in tail)
+    assert window.low == min(c["low"] for c in tail)
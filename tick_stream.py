@@ -0,0 +1,122 @@
+# stock_market/tick_stream.py
+
+import asyncio
+import json
+from typing import TYPE_CHECKING, Any, Dict, Set
+
+from aiohttp import web, WSMsgType
+
+from astrbot.api import logger
+from .config_defaults import WS_MAX_CLIENTS, WS_MAX_SUBSCRIPTIONS, WS_SEND_TIMEOUT_SECONDS
+
+if TYPE_CHECKING:
+    from .main import StockMarketRefactored
+
+
+class TickStream:
+    """
+    通过 WebSocket 向图表页推送每个 tick 的行情增量。
+    每个连接按股票订阅；tick 落库后，每支股票的消息只序列化一次，再发给订阅了它的连接。
+    以回调方式订阅行情推送: 回调本身在 WS_SEND_TIMEOUT_SECONDS 内结束 (慢连接被断开)，不会因积压被移除。
+    客户端消息: {"action": "subscribe" | "unsubscribe", "stock_ids": [...]}
+    服务端消息: {"type": "tick", "tick": int, "stock_id": str, "price": float,
+                 "kline": {"date", "open", "high", "low", "close"}}
+    """
+    def __init__(self, plugin: "StockMarketRefactored"):
+        self.plugin = plugin
+        self._subscribed = False
+        self._clients: Dict[web.WebSocketResponse, Set[str]] = {}
+
+    def start(self):
+        """订阅行情推送。"""
+        if not self._subscribed:
+            self.plugin.api.subscribe_ticks(self._on_tick)
+            self._subscribed = True
+            logger.info("WebSocket 行情推送已启动。")
+
+    async def stop(self):
+        """取消订阅并关闭所有连接。"""
+        if self._subscribed:
+            self.plugin.api.unsubscribe_ticks(self._on_tick)
+            self._subscribed = False
+        for ws in list(self._clients):
+            await ws.close(code=1001, message=b'server shutdown')
+        self._clients.clear()
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    async def handle(self, request: web.Request) -> web.WebSocketResponse:
+        """/ws/ticks 的处理函数。"""
+        if len(self._clients) >= WS_MAX_CLIENTS:
+            raise web.HTTPServiceUnavailable(text="Too many live connections")
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self._clients[ws] = set()
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    self._handle_message(ws, msg.data)
+                elif msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self._clients.pop(ws, None)
+        return ws
+
+    def _handle_message(self, ws: web.WebSocketResponse, data: str):
+        try:
+            message = json.loads(data)
+            action = message.get('action')
+            stock_ids = {str(s).upper() for s in message.get('stock_ids', [])}
+        except (ValueError, AttributeError, TypeError):
+            return
+        subscriptions = self._clients.get(ws)
+        if subscriptions is None:
+            return
+        if action == 'subscribe':
+            known = stock_ids & self.plugin.stocks.keys()
+            subscriptions.update(list(known)[:max(0, WS_MAX_SUBSCRIPTIONS - len(subscriptions))])
+        elif action == 'unsubscribe':
+            subscriptions.difference_update(stock_ids)
+
+    def _encode_delta(self, delta: Dict[str, Any]) -> Dict[str, str]:
+        """把 tick 增量拆成每支股票一条已序列化的消息。"""
+        payloads = {}
+        for stock_id, (o, h, l, c) in delta['klines'].items():
+            stock = self.plugin.stocks.get(stock_id)
+            payloads[stock_id] = json.dumps({
+                "type": "tick", "tick": delta['tick'], "stock_id": stock_id,
+                "price": stock.current_price if stock else c,
+                "kline": {"date": delta['timestamp'], "open": o, "high": h, "low": l, "close": c},
+            })
+        return payloads
+
+    @staticmethod
+    async def _send_all(ws: web.WebSocketResponse, messages: list):
+        for message in messages:
+            await ws.send_str(message)
+
+    async def _send(self, ws: web.WebSocketResponse, messages: list):
+        try:
+            await asyncio.wait_for(self._send_all(ws, messages), WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            # 发送超时或连接已断开: 直接关闭，客户端会重连并回退为整段拉取
+            self._clients.pop(ws, None)
+            if not ws.closed:
+                await ws.close()
+
+    async def _on_tick(self, delta: Dict[str, Any]):
+        """行情推送回调: 把本 tick 的增量分发给各连接。"""
+        if not self._clients:
+            return
+        try:
+            payloads = self._encode_delta(delta)
+            sends = []
+            for ws, subscriptions in list(self._clients.items()):
+                messages = [payloads[s] for s in subscriptions if s in payloads]
+                if messages:
+                    sends.append(self._send(ws, messages))
+            await asyncio.gather(*sends)
+        except Exception as e:
+            logger.error(f"WebSocket 行情推送出现错误: {e}", exc_info=True)
@@ -36,6 +36,7 @@ class TradingManager:
         if not success:
             return False, "❗ 扣款失败，购买操作已取消。"
         await self.plugin.db_manager.add_holding(user_id, stock.stock_id, quantity, stock.current_price)
+        self.plugin.trade_ledger.record(user_id, stock.stock_id, 'buy', quantity, stock.current_price, cost)
         pressure_generated = (cost ** 0.98) * COST_PRESSURE_FACTOR
         stock.market_pressure += pressure_generated
         return True, (f"✅ 买入成功！\n以 ${stock.current_price:.2f}/股 的价格买入 {quantity} 股 {stock.name}，花费 {cost:.2f} 金币。\n"
@@ -76,6 +77,8 @@ class TradingManager:
         net_income = gross_income - fee
         profit_loss = gross_income - total_cost_basis
         await self.plugin.economy_api.add_coins(user_id, int(net_income), f"出售 {quantity_to_sell} 股 {self.plugin.stocks[stock_id].name}")
+        self.plugin.trade_ledger.record(user_id, stock_id, 'sell', quantity_to_sell, actual_sell_price, gross_income,
+                                        fee=fee, slippage=price_discount_percent, realized_pnl=profit_loss)
         pressure_generated = (gross_income ** 0.98) * COST_PRESSURE_FACTOR
         self.plugin.stocks[stock_id].market_pressure -= pressure_generated
         pnl_emoji = "🎉" if profit_loss > 0 else "😭" if profit_loss < 0 else "😐"
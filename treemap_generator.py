@@ -44,13 +44,13 @@ async def _get_stock_data_for_treemap(db_path: str) -> Optional[pd.DataFrame]:
     processed_data = []
     try:
         async with aiosqlite.connect(db_path) as db:
-            cursor = await db.execute("SELECT stock_id, name, current_price FROM stocks")
+            cursor = await db.execute("SELECT stock_key, name, current_price FROM stocks")
             stocks = await cursor.fetchall()
             if not stocks: return None
-            for stock_id, name, current_price in stocks:
+            for stock_key, name, current_price in stocks:
                 k_cursor = await db.execute(
-                    "SELECT close FROM kline_history WHERE stock_id = ? ORDER BY timestamp DESC LIMIT ?",
-                    (stock_id, PERIODS_FOR_30_MIN + 1)
+                    "SELECT close FROM kline_5m WHERE stock_key = ? ORDER BY ts DESC LIMIT ?",
+                    (stock_key, PERIODS_FOR_30_MIN + 1)
                 )
                 history_prices = [row[0] for row in await k_cursor.fetchall()]
                 ref_price = history_prices[PERIODS_FOR_30_MIN] if len(history_prices) > PERIODS_FOR_30_MIN else None
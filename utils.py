@@ -1,12 +1,17 @@
+import asyncio
 import hashlib
 import jwt
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from passlib.context import CryptContext
 from aiohttp import web
-from typing import TYPE_CHECKING, List, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 from datetime import datetime, timedelta
 
 from .config import JWT_SECRET_KEY, JWT_ALGORITHM
+from .config_defaults import JWT_CACHE_MAX_ENTRIES, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
 
 # 仅用于类型提示，避免循环导入
 if TYPE_CHECKING:
@@ -16,6 +21,89 @@ if TYPE_CHECKING:
 # --- 安全与认证 ---
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+class HasherBusyError(Exception):
+    """密码哈希线程池排队已满。"""
+
+class PasswordHasher:
+    """
+    在有界线程池中执行 bcrypt 哈希与校验 (bcrypt 计算期间释放 GIL)，单次数十到数百毫秒的计算不再阻塞事件循环。
+    正在执行和排队的任务超过 max_pending 时立即抛出 HasherBusyError，由调用方返回 503。
+    """
+    def __init__(self, context: CryptContext = pwd_context, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self._context = context
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise HasherBusyError()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._context.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(self._context.verify, password, password_hash)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class TokenRevokedError(jwt.InvalidTokenError):
+    """Token 签发于该账号最近一次重置密码之前。"""
+
+class VerifiedTokenCache:
+    """
+    已验证 JWT 的有界 LRU 缓存: token 的 sha256 摘要 -> (payload, exp)。
+    前端每次请求都携带同一个 Token，命中缓存时只需一次哈希和字典查找，不再重复解码和校验 HMAC。
+    - 过期时间在每次命中时重新检查，过期条目直接移除。
+    - revoke_login(login_id) 在重置密码时调用: 记录撤销时间并清掉该账号的缓存，
+      此后签发时间 (iat) 早于撤销时间的 Token 都会被拒绝。登录时签发的 iat 带小数秒，
+      重置之后同一秒内重新登录拿到的 Token 不受影响，重置之前同一秒签发的则会被拒绝。
+    - 撤销记录只保存在内存中，插件重启后失效: 重启前签发、重置密码前的旧 Token 在过期前又可以使用。
+    """
+    def __init__(self, max_entries: int = JWT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._revoked_before: Dict[str, float] = {}
+
+    def _check_revoked(self, payload: Dict[str, Any]):
+        revoked_before = self._revoked_before.get(payload.get('login_id'))
+        if revoked_before is not None and payload.get('iat', 0) < revoked_before:
+            raise TokenRevokedError()
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """返回 Token 的 payload；无效、过期或已撤销时抛出 jwt.InvalidTokenError 的子类。"""
+        digest = hashlib.sha256(token.encode()).digest()
+        cached = self._entries.get(digest)
+        if cached is not None:
+            payload, exp = cached
+            if exp <= time.time():
+                del self._entries[digest]
+                raise jwt.ExpiredSignatureError()
+            self._entries.move_to_end(digest)
+        else:
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            self._check_revoked(payload)
+            self._entries[digest] = (payload, payload.get('exp', float('inf')))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return payload
+        self._check_revoked(payload)
+        return payload
+
+    def revoke_login(self, login_id: str):
+        self._revoked_before[login_id] = time.time()
+        for digest in [d for d, (payload, _) in self._entries.items() if payload.get('login_id') == login_id]:
+            del self._entries[digest]
+
+verified_tokens = VerifiedTokenCache()
+
 def jwt_required(handler):
     """JWT Token 验证装饰器"""
     @wraps(handler)
@@ -26,10 +114,11 @@ def jwt_required(handler):
         
         token = auth_header.split(' ')[1]
         try:
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            request['jwt_payload'] = payload
+            request['jwt_payload'] = verified_tokens.verify(token)
         except jwt.ExpiredSignatureError:
             return web.json_response({'error': 'Token已过期'}, status=401)
+        except TokenRevokedError:
+            return web.json_response({'error': '密码已重置，请重新登录'}, status=401)
         except jwt.InvalidTokenError:
             return web.json_response({'error': '无效的Token'}, status=401)
             
@@ -61,6 +150,32 @@ def format_large_number(num: float) -> str:
             return f"{value:.2f} {suffix}"
     return f"{num:,.2f}"
 
+def decimation_buckets(n: int, max_points: int) -> List[Tuple[int, int]]:
+    """decimate_ohlc 的分桶: 把前 n - 1 根按根数均分为 max_points - 1 个 [start, end) 区间 (最后一根单独保留)。"""
+    head, buckets = n - 1, max_points - 1
+    return [(i * head // buckets, (i + 1) * head // buckets) for i in range(buckets)]
+
+def decimate_ohlc(klines: List[Dict[str, Any]], max_points: int) -> List[Dict[str, Any]]:
+    """
+    等根数分桶的 OHLC 降采样 (不是 LTTB 之类的选点算法): 把 klines 压缩到最多 max_points 根。
+    除最后一根外的K线按根数均分为 max_points - 1 个桶，每个桶合并为一根K线:
+    日期取桶内第一根，开盘/收盘为桶内首根开盘和末根收盘，最高/最低为桶内极值，因此插针和急跌不会被平均掉。
+    最后一根原样保留。合并后的K线宽度不再是一个周期，客户端只应把实时推送并入未降采样的数据。
+    """
+    n = len(klines)
+    if max_points < 2 or n <= max_points:
+        return list(klines)
+    decimated = []
+    for start, end in decimation_buckets(n, max_points):
+        bucket = klines[start:end]
+        decimated.append({
+            "date": bucket[0]['date'], "open": bucket[0]['open'],
+            "high": max(k['high'] for k in bucket), "low": min(k['low'] for k in bucket),
+            "close": bucket[-1]['close'],
+        })
+    decimated.append(klines[-1])
+    return decimated
+
 # --- 为 LLM Tools 新增的数据处理函数 ---
 
 def get_price_change_percentage_30m(stock: "VirtualStock") -> float:
@@ -2,12 +2,10 @@ import json
 import jwt
 import random
 import time
-import re
-import ipaddress
-from collections import deque
+import math
+from itertools import islice
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Dict, Deque
-import pandas as pd
+from typing import TYPE_CHECKING, Optional, Tuple
 import aiohttp_jinja2
 from aiohttp import web
 from jinja2 import Environment, FileSystemLoader, select_autoescape
@@ -16,59 +14,50 @@ from astrbot.api import logger
 from .config import (TEMPLATES_DIR, STATIC_DIR, SERVER_PORT,
                      SERVER_BASE_URL, JWT_SECRET_KEY, JWT_ALGORITHM,
                      JWT_EXPIRATION_MINUTES, RATE_LIMIT_WHITELIST)
-from .utils import jwt_required, generate_user_hash, pwd_context
+from .config_defaults import RATE_LIMIT_MAX_KEYS, STARTUP_KLINE_PRELOAD, EXPORT_MAX_ROWS
+from .utils import jwt_required, generate_user_hash, decimate_ohlc, verified_tokens, PasswordHasher, HasherBusyError
+from .database import bucket_shift, bucket_start, from_epoch, to_epoch
+from .export import iter_kline_export, KLINE_INTERVAL_TABLES, KLINE_INTERVAL_SECONDS, EXPORT_CONTENT_TYPES
+from .tick_stream import TickStream
+from .response_cache import ResponseCache, CachedPayload
+from .kline_codec import KlineColumns, KLINE_BINARY_CONTENT_TYPE, encode_klines, replace_user_holdings, prefers_binary
+from .rate_limiter import RateLimiter
 
 if TYPE_CHECKING:
     from .main import StockMarketRefactored
 
+# 超出内存K线窗口的长周期图表，在数据库中聚合: period -> (回看天数, 时间桶秒数, 使用的汇总表)
+LONG_RANGE_PERIODS = {
+    '90d': (90, 4 * 3600, 'kline_1h'),
+    '1y': (365, 86400, 'kline_1d'),
+    'all': (None, 7 * 86400, 'kline_1d'),
+}
+KLINE_EMPTY_HOLDINGS_TAIL = b'[]}'
+# max_points 向下取整到该步长，使不同宽度的客户端共用缓存条目
+KLINE_MAX_POINTS_STEP = 50
+# 内存K线周期: period -> (5分钟K根数, 聚合时间桶秒数)。桶宽大于5分钟时按本地时间对齐的整数时间桶聚合
+KLINE_PERIODS = {
+    '1d': (288, 300),
+    '7d': (288 * 7, 1800),
+    '30d': (288 * 30, 3600),
+}
+BASE_KLINE_SECONDS = 300
+
 @web.middleware
 async def rate_limit_middleware(request: web.Request, handler):
     """
-    一个原生的 aiohttp 速率限制中间件 (升级版：支持正则表达式路径匹配和IP白名单)。
+    aiohttp 速率限制中间件: 白名单、路径规则匹配和限流判定都交给 WebServer.rate_limiter。
     """
     server_instance = request.app['server_instance']
-
-    # 检查IP白名单
-    # 在执行任何速率限制逻辑之前，首先检查请求的IP是否在白名单中。
-    remote_ip = request.remote
-    if remote_ip:
-        try:
-            # 将请求的IP地址字符串转换为ip_address对象
-            request_ip_obj = ipaddress.ip_address(remote_ip)
-            # 遍历白名单中的每一个规则 (IP或网段)
-            for whitelisted_net in RATE_LIMIT_WHITELIST:
-                # 检查请求IP是否属于该规则定义的网络范围
-                if request_ip_obj in ipaddress.ip_network(whitelisted_net, strict=False):
-                    # 如果IP在白名单内，则直接放行，不执行后续的速率限制检查
-                    return await handler(request)
-        except ValueError as e:
-            # 如果配置中的白名单格式错误或IP地址无效，记录日志但服务不中断
-            logger.error(f"处理速率限制白名单时出错: {e}. 请检查 config.py 中的 RATE_LIMIT_WHITELIST 配置。")
-
-    # (原有的速率限制逻辑保持不变)
-    for rule in server_instance.rate_limit_rules:
-        if re.match(rule['path_regex'], request.path):
-            key = rule['get_key_func'](request)
-            limit = rule['limit']
-            period = rule['period']
-
-            current_time = time.monotonic()
-            timestamps: Deque[float] = server_instance.rate_limit_storage.setdefault(key, deque())
-
-            while timestamps and timestamps[0] <= current_time - period:
-                timestamps.popleft()
-
-            if len(timestamps) >= limit:
-                logger.warning(f"速率限制触发！Key: '{key}', Path: '{request.path}', Rule: {rule['path_regex']}")
-                return web.Response(
-                    status=429,
-                    text=json.dumps({"error": "Too Many Requests", "message": "Rate limit exceeded."}),
-                    content_type="application/json"
-                )
-
-            timestamps.append(current_time)
-            break
-
+    rule, retry_after = server_instance.rate_limiter.check(request)
+    if retry_after > 0:
+        logger.warning(f"速率限制触发！IP: '{request.remote}', Path: '{request.path}', Rule: {rule['path_regex']}")
+        return web.Response(
+            status=429,
+            text=json.dumps({"error": "Too Many Requests", "message": "Rate limit exceeded."}),
+            content_type="application/json",
+            headers={'Retry-After': str(math.ceil(retry_after))}
+        )
     return await handler(request)
 
 class WebServer:
@@ -88,15 +77,20 @@ class WebServer:
         self.app = web.Application(middlewares=[rate_limit_middleware])
         self.app['server_instance'] = self
 
-        self.rate_limit_storage: Dict[str, Deque[float]] = {}
-
         self.rate_limit_rules = [
             {'path_regex': r'^/api/auth/.*', 'limit': 10, 'period': 60, 'get_key_func': self._get_ip_key},
             {'path_regex': r'^/api/v1/trade/.*', 'limit': 30, 'period': 60, 'get_key_func': self._get_user_key},
             {'path_regex': r'^/api/v1/stock/[^/]+/details$', 'limit': 5, 'period': 60, 'get_key_func': self._get_ip_key},
+            {'path_regex': r'^/api/v1/export/.*', 'limit': 5, 'period': 60, 'get_key_func': self._get_ip_key},
             {'path_regex': r'^/api/.*', 'limit': 60, 'period': 60, 'get_key_func': self._get_ip_key}
         ]
+        self.rate_limiter = RateLimiter(self.rate_limit_rules, RATE_LIMIT_WHITELIST, RATE_LIMIT_MAX_KEYS)
 
+        self.tick_stream = TickStream(plugin)
+        self.response_cache = ResponseCache(plugin)
+        self.password_hasher = PasswordHasher()
+        # 进程启动标识，写入 ETag，避免重启后 tick_version 从头计数时误返回 304
+        self._boot_id = format(int(time.time()), 'x')
         self.runner = None
         self._setup_jinja_and_routes()
 
@@ -130,6 +124,8 @@ class WebServer:
         api_v1.router.add_post('/trade/sell_all_stock', self._api_trade_sell_all_stock)
         api_v1.router.add_post('/trade/sell_all_portfolio', self._api_trade_sell_all_portfolio)
         api_v1.router.add_get('/ranking', self._api_get_ranking)
+        api_v1.router.add_get('/trades', self._api_get_trades)
+        api_v1.router.add_get('/export/kline', self._api_export_kline)
         self.app.add_subapp('/api/v1', api_v1)
 
         auth_app = web.Application()
@@ -148,6 +144,7 @@ class WebServer:
         self.app.router.add_get('/charts/{user_hash}', self._handle_user_charts_page)
         self.app.router.add_get('/api/kline/{stock_id}', self._handle_kline_api)
         self.app.router.add_get('/api/get_user_hash', self._handle_get_user_hash)
+        self.app.router.add_get('/ws/ticks', self.tick_stream.handle)
         async def handle_favicon(request):
             return web.HTTPFound('/static/favicon.png')
 
@@ -159,10 +156,13 @@ class WebServer:
         await self.runner.setup()
         site = web.TCPSite(self.runner, '0.0.0.0', SERVER_PORT)
         await site.start()
+        self.tick_stream.start()
         logger.info(f"Web服务及API已在 {SERVER_BASE_URL} 上启动。")
 
     async def stop(self):
         """停止Web服务器。"""
+        await self.tick_stream.stop()
+        self.password_hasher.shutdown()
         if self.runner:
             await self.runner.cleanup()
             logger.info("Web服务已关闭。")
@@ -191,12 +191,7 @@ class WebServer:
     async def _handle_user_charts_page(self, request: web.Request):
         user_hash = request.match_info.get('user_hash')
         stocks_list = sorted([{'stock_id': s.stock_id, 'name': s.name} for s in self.plugin.stocks.values()], key=lambda x: x['stock_id'])
-        user_id = None
-        all_user_ids = await self.plugin.db_manager.get_all_user_ids_with_holdings()
-        for uid in all_user_ids:
-            if generate_user_hash(uid) == user_hash:
-                user_id = uid
-                break
+        user_id = self.plugin.db_manager.resolve_user_hash(user_hash)
         user_portfolio_data = None
         if user_id:
             asset_summary = await self.plugin.get_user_total_asset(user_id)
@@ -211,6 +206,37 @@ class WebServer:
             }
         return {'stocks': stocks_list, 'user_hash': user_hash, 'user_portfolio_data': user_portfolio_data}
 
+    def _make_etag(self, with_holdings: bool = False, variant: Optional[str] = None, from_db: bool = False) -> str:
+        """
+        由 tick 版本生成弱 ETag；响应中带用户持仓时再加上持仓版本，同一资源的不同格式以 variant 区分。
+        直接读库的响应 (from_db) 再加上写后队列的提交版本: tick 之后、K线落库之前读到的数据不能沿用本 tick 的 ETag。
+        """
+        tag = f"{self._boot_id}-{self.plugin.tick_version}"
+        if from_db and self.plugin.persistence_queue:
+            tag += f"-c{self.plugin.persistence_queue.committed_version}"
+        if with_holdings and self.plugin.holder_index:
+            tag += f"-{self.plugin.holder_index.version}"
+        if variant:
+            tag += f"-{variant}"
+        return f'W/"{tag}"'
+
+    @staticmethod
+    def _not_modified(request: web.Request, etag: str) -> bool:
+        header = request.headers.get('If-None-Match')
+        return bool(header) and any(tag.strip() in (etag, '*') for tag in header.split(','))
+
+    @staticmethod
+    def _with_etag(response: web.StreamResponse, etag: str) -> web.StreamResponse:
+        # no-cache: 浏览器可以缓存，但每次都要带 If-None-Match 回来校验
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @staticmethod
+    def _parse_since(value: str) -> int:
+        """since 参数: 纪元秒或本地时间 ISO 字符串，返回纪元秒 (格式错误时抛出 ValueError)。"""
+        return int(value) if value.isdigit() else to_epoch(value)
+
     async def _handle_kline_api(self, request: web.Request):
         stock_id = request.match_info.get('stock_id', "").upper()
         user_hash = request.query.get('user_hash')
@@ -220,64 +246,168 @@ class WebServer:
             padding = int(request.query.get('padding', '0'))
         except (ValueError, TypeError):
             padding = 0
+        try:
+            since_ts = self._parse_since(request.query['since']) if request.query.get('since') else None
+        except ValueError:
+            return web.json_response({'error': 'since 必须是纪元秒或 ISO 时间'}, status=400)
+        try:
+            max_points = self._parse_max_points(request.query.get('max_points'))
+        except ValueError:
+            return web.json_response({'error': 'max_points 必须是正整数'}, status=400)
+        if since_ts is not None:
+            # 增量请求只返回最后几根，不做降采样，客户端按原样合并到已有数据的尾部
+            max_points = None
+
+        # 二进制格式: ?format=bin 或 Accept: application/octet-stream
+        binary = request.query.get('format') == 'bin' or prefers_binary(request.headers.get('Accept', ''))
+
+        etag = self._make_etag(with_holdings=bool(user_hash), variant='bin' if binary else None,
+                               from_db=period in LONG_RANGE_PERIODS)
+        if self._not_modified(request, etag):
+            return self._with_etag(web.Response(status=304), etag)
+
+        if period in LONG_RANGE_PERIODS:
+            stock = await self.plugin.find_stock(stock_id)
+            if not stock:
+                return web.json_response({'error': 'not found'}, status=404)
+            if max_points is None and not binary:
+                response = web.StreamResponse(headers={'Content-Type': 'application/json; charset=utf-8', 'Vary': 'Accept'})
+                self._with_etag(response, etag)
+                return await self._stream_long_range_kline(request, response, stock.stock_id, period, user_hash, since_ts)
+            cache_key = ('kline', stock.stock_id, period, since_ts, max_points, binary)
+            cached = self.response_cache.get(cache_key)
+            if cached is None:
+                version = self.response_cache.version
+                if binary:
+                    # 二进制格式直接把 SQLite 聚合结果写入列，不经过 dict
+                    columns = await self._collect_long_range_columns(stock.stock_id, period, since_ts)
+                    cached = self._cache_kline_columns(cache_key, columns, max_points, version)
+                else:
+                    kline_data = await self._collect_long_range_kline(stock.stock_id, period, since_ts)
+                    cached = self._cache_kline_json(cache_key, kline_data, max_points, version)
+            return self._with_etag(await self._respond_kline(request, cached, user_hash, stock.stock_id), etag)
 
+        if KLINE_PERIODS.get(period, KLINE_PERIODS['1d'])[0] + padding > STARTUP_KLINE_PRELOAD:
+            # 启动时同步预载的 STARTUP_KLINE_PRELOAD 根K线已覆盖 1d，只有更长的周期需要等后台补全历史
+            await self.plugin.klines_ready.wait()
         stock = await self.plugin.find_stock(stock_id)
         if not stock or len(stock.kline_history) < 2:
             return web.json_response({'error': 'not found'}, status=404)
 
-        points_map = {
-            '1d': 288,
-            '7d': 288 * 7,
-            '30d': 288 * 30
-        }
-        num_points = points_map.get(period, 288)
-        total_points = num_points + padding
-        kline_history_slice = list(stock.kline_history)[-total_points:]
-
-        final_kline_data = kline_history_slice
-
-        resample_rule = None
-        if period == '30d':
-            resample_rule = 'H'
-        elif period == '7d':
-            resample_rule = '30T'
-
-        if resample_rule and len(kline_history_slice) > 0:
-            logger.info(f"为 {stock_id} 请求 {period} 数据 (padding={padding})，开始聚合为 {resample_rule} K线...")
-
-            df = pd.DataFrame(kline_history_slice)
-            df['date'] = pd.to_datetime(df['date'])
-            df.set_index('date', inplace=True)
-
-            df_resampled = df.resample(resample_rule).agg({
-                'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'
-            }).dropna()
-
-            # ▼▼▼ 核心修复逻辑 ▼▼▼
-            # 判断聚合和丢弃空值后，是否还有剩余数据
-            if df_resampled.empty:
-                # 如果聚合后数据为空，说明历史数据太稀疏，无法支撑当前时间维度的聚合。
-                # 作为备用方案，我们返回未聚合的原始数据，确保前端不会收到空列表。
-                logger.warning(f"聚合后数据为空！为 {stock_id} 在 {period} 周期回退到原始K线数据。")
-                final_kline_data = kline_history_slice # final_kline_data 已默认为此，这里为清晰起见
+        cache_key = ('kline', stock.stock_id, period, padding, since_ts, max_points, binary)
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            version = self.response_cache.version
+            if binary:
+                cached = self._cache_kline_columns(
+                    cache_key, self._build_kline_columns(stock, period, padding, since_ts), max_points, version)
             else:
-                # 如果有数据，则正常处理
-                aggregated_kline_history = [
-                    {"date": index.isoformat(), "open": row.open, "high": row.high, "low": row.low, "close": row.close}
-                    for index, row in df_resampled.iterrows()
-                ]
-                final_kline_data = aggregated_kline_history
-                logger.info(f"聚合完成，数据点从 {len(kline_history_slice)} 减少到 {len(final_kline_data)}。")
-            # ▲▲▲ 修复结束 ▲▲▲
-
-        target_user_id = None
-        if user_hash:
-            # ... (后续代码无需修改) ...
-            all_user_ids = await self.plugin.db_manager.get_all_user_ids_with_holdings()
-            for uid in all_user_ids:
-                if generate_user_hash(uid) == user_hash:
-                    target_user_id = uid
-                    break
+                cached = self._cache_kline_json(
+                    cache_key, self._build_kline_history(stock, period, padding, since_ts), max_points, version)
+        return self._with_etag(await self._respond_kline(request, cached, user_hash, stock_id), etag)
+
+    def _cache_kline_json(self, cache_key: tuple, kline_data: list, max_points: Optional[int],
+                          version: Tuple[int, int]) -> CachedPayload:
+        """把游客版本 (user_holdings 为空) 的K线 (按需降采样) 编码为 JSON 并缓存。user_holdings 必须是最后一个字段。"""
+        decimated = max_points is not None and len(kline_data) > max_points
+        if decimated:
+            kline_data = decimate_ohlc(kline_data, max_points)
+        return self.response_cache.put(
+            cache_key, {"kline_history": kline_data, "decimated": decimated, "user_holdings": []}, version=version)
+
+    def _cache_kline_columns(self, cache_key: tuple, columns: KlineColumns, max_points: Optional[int],
+                             version: Tuple[int, int]) -> CachedPayload:
+        """把游客版本的K线列 (按需降采样) 编码为二进制格式并缓存。"""
+        decimated = max_points is not None and len(columns) > max_points
+        if decimated:
+            columns = columns.decimate(max_points)
+        return self.response_cache.put_body(cache_key, encode_klines(columns, decimated=decimated),
+                                            KLINE_BINARY_CONTENT_TYPE, version=version)
+
+    @staticmethod
+    def _parse_max_points(value: Optional[str]) -> Optional[int]:
+        """max_points 参数: 为空时不降采样；否则向下取整到 KLINE_MAX_POINTS_STEP 的倍数 (格式错误时抛出 ValueError)。"""
+        if not value:
+            return None
+        max_points = int(value)
+        if max_points <= 0:
+            raise ValueError(value)
+        return max(KLINE_MAX_POINTS_STEP, max_points - max_points % KLINE_MAX_POINTS_STEP)
+
+    async def _respond_kline(self, request: web.Request, cached: CachedPayload, user_hash: str, stock_id: str) -> web.Response:
+        user_holdings = await self._get_kline_user_holdings(user_hash, stock_id)
+        if not user_holdings:
+            response = self.response_cache.respond(request, cached)
+        else:
+            # 缓存里是游客版本 (user_holdings 为空)，换入该用户的持仓
+            if cached.content_type == KLINE_BINARY_CONTENT_TYPE:
+                body = replace_user_holdings(cached.body, user_holdings)
+            else:
+                body = cached.body[:-len(KLINE_EMPTY_HOLDINGS_TAIL)] + json.dumps(user_holdings).encode() + b'}'
+            response = web.Response(body=body, content_type=cached.content_type)
+            response.enable_compression()
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        return response
+
+    @staticmethod
+    def _slice_kline_history(stock, period: str, padding: int, since_ts: Optional[int]) -> Tuple[list, list]:
+        """
+        取内存K线缓冲尾部本周期所需的K线，返回 (K线, 对应的纪元秒)。
+        增量请求时从 since 所在的时间桶开始 (含该桶，便于客户端覆盖尚未走完的最后一根)。
+        只从尾部向前扫描时间戳，不解析日期、不复制整个缓冲。
+        """
+        num_points, bucket_seconds = KLINE_PERIODS.get(period, KLINE_PERIODS['1d'])
+        total_points = num_points + padding
+        count = 0
+        since_bucket = bucket_start(since_ts, bucket_seconds) if since_ts is not None else None
+        for ts in reversed(stock.kline_ts):
+            if count >= total_points or (since_bucket is not None and ts < since_bucket):
+                break
+            count += 1
+        klines = list(islice(reversed(stock.kline_history), count))[::-1]
+        timestamps = list(islice(reversed(stock.kline_ts), count))[::-1]
+        return klines, timestamps
+
+    @staticmethod
+    def _aggregate_klines(klines: list, timestamps: list, bucket_seconds: int):
+        """按本地时间对齐的整数时间桶合并K线 (与长周期的 SQL 聚合方式相同)，逐个产出 (桶起点, 开, 高, 低, 收)。"""
+        current, shift = None, bucket_shift(bucket_seconds)
+        for ts, kline in zip(timestamps, klines):
+            bucket = ts - (ts + shift) % bucket_seconds
+            if current is not None and current[0] == bucket:
+                current[2] = max(current[2], kline['high'])
+                current[3] = min(current[3], kline['low'])
+                current[4] = kline['close']
+                continue
+            if current is not None:
+                yield tuple(current)
+            current = [bucket, kline['open'], kline['high'], kline['low'], kline['close']]
+        if current is not None:
+            yield tuple(current)
+
+    def _build_kline_history(self, stock, period: str, padding: int, since_ts: Optional[int]) -> list:
+        """从内存K线缓冲生成 1d/7d/30d 周期的K线列表 (7d/30d 按时间桶聚合)。"""
+        klines, timestamps = self._slice_kline_history(stock, period, padding, since_ts)
+        bucket_seconds = KLINE_PERIODS.get(period, KLINE_PERIODS['1d'])[1]
+        if bucket_seconds == BASE_KLINE_SECONDS:
+            return klines
+        return [{"date": from_epoch(bucket), "open": o, "high": h, "low": l, "close": c}
+                for bucket, o, h, l, c in self._aggregate_klines(klines, timestamps, bucket_seconds)]
+
+    def _build_kline_columns(self, stock, period: str, padding: int, since_ts: Optional[int]) -> KlineColumns:
+        """与 _build_kline_history 相同的数据，直接按列生成二进制格式，时间取 kline_ts，不解析日期。"""
+        klines, timestamps = self._slice_kline_history(stock, period, padding, since_ts)
+        bucket_seconds = KLINE_PERIODS.get(period, KLINE_PERIODS['1d'])[1]
+        if bucket_seconds == BASE_KLINE_SECONDS:
+            return KlineColumns.from_klines(klines, timestamps)
+        columns = KlineColumns()
+        for row in self._aggregate_klines(klines, timestamps, bucket_seconds):
+            columns.append(*row)
+        return columns
+
+    async def _get_kline_user_holdings(self, user_hash: str, stock_id: str) -> list:
+        """K线图上用于画平均成本线的用户持仓。"""
+        target_user_id = self.plugin.db_manager.resolve_user_hash(user_hash)
 
         user_holdings = []
         if target_user_id:
@@ -285,8 +415,58 @@ class WebServer:
             for holding in asset_info.get('holdings_detailed', []):
                 if holding['stock_id'] == stock_id:
                     user_holdings.append({"stock_id": stock_id, "quantity": holding['quantity'], "avg_cost": holding['avg_cost']})
+        return user_holdings
+
+    @staticmethod
+    def _long_range_start(period: str, since_ts: Optional[int]) -> Optional[int]:
+        """长周期K线的查询起点: 时间窗口起点，增量请求时取 since 所在时间桶 (不早于窗口起点)。"""
+        days, bucket_seconds, _ = LONG_RANGE_PERIODS[period]
+        window_start = int((datetime.now() - timedelta(days=days)).timestamp()) if days else None
+        if since_ts is not None:
+            return max(bucket_start(since_ts, bucket_seconds), window_start or 0)
+        return window_start
+
+    async def _collect_long_range_kline(self, stock_id: str, period: str, since_ts: Optional[int] = None) -> list:
+        """长周期K线的完整列表 (用于降采样)，聚合方式与流式输出相同。"""
+        _, bucket_seconds, rollup_table = LONG_RANGE_PERIODS[period]
+        return [
+            {"date": datetime.fromtimestamp(bucket).isoformat(), "open": o, "high": h, "low": l, "close": c}
+            async for bucket, o, h, l, c in self.plugin.db_manager.iter_bucketed_klines(
+                stock_id, self._long_range_start(period, since_ts), bucket_seconds, rollup_table)
+        ]
 
-        return web.json_response({"kline_history": final_kline_data, "user_holdings": user_holdings})
+    async def _collect_long_range_columns(self, stock_id: str, period: str, since_ts: Optional[int]) -> KlineColumns:
+        """长周期K线按列收集，供二进制格式使用。"""
+        _, bucket_seconds, rollup_table = LONG_RANGE_PERIODS[period]
+        columns = KlineColumns()
+        async for row in self.plugin.db_manager.iter_bucketed_klines(
+                stock_id, self._long_range_start(period, since_ts), bucket_seconds, rollup_table):
+            columns.append(*row)
+        return columns
+
+    async def _stream_long_range_kline(self, request: web.Request, response: web.StreamResponse, stock_id: str,
+                                       period: str, user_hash: str, since_ts: Optional[int] = None):
+        """长周期K线: 在 SQLite 中按时间桶聚合，并把结果分块流式写出，格式与普通K线接口一致。"""
+        _, bucket_seconds, rollup_table = LONG_RANGE_PERIODS[period]
+        since_ts = self._long_range_start(period, since_ts)
+        user_holdings = await self._get_kline_user_holdings(user_hash, stock_id)
+
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        await response.write(b'{"kline_history":[')
+        chunk, first = [], True
+        async for bucket, o, h, l, c in self.plugin.db_manager.iter_bucketed_klines(
+                stock_id, since_ts, bucket_seconds, rollup_table):
+            chunk.append(json.dumps({"date": datetime.fromtimestamp(bucket).isoformat(),
+                                     "open": o, "high": h, "low": l, "close": c}))
+            if len(chunk) >= 500:
+                await response.write((("" if first else ",") + ",".join(chunk)).encode())
+                chunk, first = [], False
+        if chunk:
+            await response.write((("" if first else ",") + ",".join(chunk)).encode())
+        await response.write(f'],"user_holdings":{json.dumps(user_holdings)}}}'.encode())
+        await response.write_eof()
+        return response
 
     async def _handle_get_user_hash(self, request: web.Request):
         qq_id = request.query.get('qq_id')
@@ -306,39 +486,61 @@ class WebServer:
     async def _api_get_stock_details(self, request: web.Request):
         """[API][Public] 获取单支股票的详细信息。"""
         identifier = request.match_info.get('identifier', "")
-        stock_details = await self.plugin.get_stock_details_for_api(identifier)
-        if not stock_details:
+        stock = await self.plugin.find_stock(identifier)
+        if not stock:
             return web.json_response({'error': f'Stock with identifier "{identifier}" not found'}, status=404)
-        return web.json_response(stock_details)
+        volume_today = self.plugin.trade_ledger.get_daily_volume(stock.stock_id) if self.plugin.trade_ledger else None
+        # 当日成交量随每笔成交变化: 以 (日期, 当日成交笔数) 区分缓存和 ETag，两次成交之间复用同一份预压缩响应
+        volume_stamp = f"{datetime.now():%Y%m%d}.{volume_today['trades']}" if volume_today else None
+        etag = self._make_etag(variant=volume_stamp)
+        if self._not_modified(request, etag):
+            return self._with_etag(web.Response(status=304), etag)
+        cache_key = ('details', stock.stock_id, volume_stamp)
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            version = self.response_cache.version
+            stock_details = await self.plugin.get_stock_details_for_api(identifier)
+            if not stock_details:
+                return web.json_response({'error': f'Stock with identifier "{identifier}" not found'}, status=404)
+            stock_details['volume_today'] = volume_today
+            cached = self.response_cache.put(cache_key, stock_details, version=version)
+        return self._with_etag(self.response_cache.respond(request, cached), etag)
 
     async def _api_get_all_stocks(self, request: web.Request):
-        stock_list = [{'stock_id': s.stock_id, 'name': s.name, 'current_price': s.current_price}
-                      for s in sorted(self.plugin.stocks.values(), key=lambda x: x.stock_id)]
-        return web.json_response(stock_list)
+        etag = self._make_etag()
+        if self._not_modified(request, etag):
+            return self._with_etag(web.Response(status=304), etag)
+        cached = self.response_cache.get(('stocks',))
+        if cached is None:
+            stock_list = [{'stock_id': s.stock_id, 'name': s.name, 'current_price': s.current_price}
+                          for s in sorted(self.plugin.stocks.values(), key=lambda x: x.stock_id)]
+            cached = self.response_cache.put(('stocks',), stock_list)
+        return self._with_etag(self.response_cache.respond(request, cached), etag)
 
     async def _api_get_market_overview(self, request: web.Request):
         """[API][Public] 获取市场所有股票的详细行情概览。"""
+        etag = self._make_etag()
+        if self._not_modified(request, etag):
+            return self._with_etag(web.Response(status=304), etag)
+        cached = self.response_cache.get(('overview',))
+        if cached is None:
+            cached = self.response_cache.put(('overview',), self._build_market_overview())
+        return self._with_etag(self.response_cache.respond(request, cached), etag)
+
+    def _build_market_overview(self) -> list:
         market_data = []
 
         for stock in self.plugin.stocks.values():
-            kline = list(stock.kline_history)
-
-            high_1h = None
-            low_1h = None
-            ma5 = None
+            # 直接读取每根K线到来时增量维护的1小时滚动窗口
+            window = stock.window_1h
+            high_1h = window.high
+            low_1h = window.low
+            ma5 = window.sma(5)
             change_5m_value = None
             change_5m_percent = None
             trend = "数据不足"
 
-            if kline:
-                candles_last_hour = kline[-12:]
-                high_1h = max(p['high'] for p in candles_last_hour)
-                low_1h = min(p['low'] for p in candles_last_hour)
-
-            if len(kline) >= 5:
-                last_5_closes = [p['close'] for p in kline[-5:]]
-                ma5 = sum(last_5_closes) / len(last_5_closes)
-                
+            if ma5 is not None:
                 if stock.current_price > ma5:
                     trend = "上涨"
                 elif stock.current_price < ma5:
@@ -346,11 +548,10 @@ class WebServer:
                 else:
                     trend = "震荡"
 
-            if kline:
-                price_5m_ago = kline[-1]['close']
-                if price_5m_ago > 0:
-                    change_5m_value = stock.current_price - price_5m_ago
-                    change_5m_percent = (change_5m_value / price_5m_ago) * 100
+            price_5m_ago = window.close
+            if price_5m_ago:
+                change_5m_value = stock.current_price - price_5m_ago
+                change_5m_percent = (change_5m_value / price_5m_ago) * 100
             
             stock_info = {
                 '股票名称': stock.name,
@@ -367,8 +568,7 @@ class WebServer:
             }
             market_data.append(stock_info)
 
-        sorted_market_data = sorted(market_data, key=lambda x: x['代码'])
-        return web.json_response(sorted_market_data)
+        return sorted(market_data, key=lambda x: x['代码'])
 
     @jwt_required
     async def _api_trade_buy_all_in(self, request: web.Request):
@@ -418,6 +618,83 @@ class WebServer:
             return web.json_response({'error': '获取持仓信息时发生内部错误'}, status=500)
 
 
+    @jwt_required
+    async def _api_get_trades(self, request: web.Request):
+        """[API][Private] 游标分页获取当前用户的成交记录。参数: limit, before (上一页的 next_before), stock。"""
+        try:
+            limit = min(max(int(request.query.get('limit', 20)), 1), 100)
+            before = request.query.get('before')
+            before_id = int(before) if before else None
+        except ValueError:
+            return web.json_response({'error': 'limit 和 before 必须是整数'}, status=400)
+
+        stock_id = None
+        identifier = request.query.get('stock')
+        if identifier:
+            stock = await self.plugin.find_stock(identifier)
+            if not stock:
+                return web.json_response({'error': f'Stock with identifier "{identifier}" not found'}, status=404)
+            stock_id = stock.stock_id
+
+        user_id = request['jwt_payload']['sub']
+        trades = await self.plugin.trade_ledger.get_history(user_id=user_id, stock_id=stock_id, before_id=before_id, limit=limit)
+        next_before = trades[-1]['trade_id'] if len(trades) == limit else None
+        return web.json_response({'trades': trades, 'next_before': next_before})
+
+    async def _api_export_kline(self, request: web.Request):
+        """
+        [API][Public] 流式导出历史K线。
+        参数: stocks (逗号分隔的标识符，或 all), from / to (ISO 日期时间，可选),
+              interval (5m/1h/1d，默认 5m), format (csv/ndjson，默认 csv)。
+        单次导出以 EXPORT_MAX_ROWS 根为上限: 不给 from 时导出截至 to (默认现在) 的、不超过上限的最近一段，
+        给出的区间超过上限时返回 400。
+        """
+        fmt = request.query.get('format', 'csv').lower()
+        interval = request.query.get('interval', '5m')
+        if fmt not in EXPORT_CONTENT_TYPES:
+            return web.json_response({'error': 'format 必须是 csv 或 ndjson'}, status=400)
+        if interval not in KLINE_INTERVAL_TABLES:
+            return web.json_response({'error': f'interval 必须是 {"/".join(KLINE_INTERVAL_TABLES)} 之一'}, status=400)
+        try:
+            start_ts = int(datetime.fromisoformat(request.query['from']).timestamp()) if request.query.get('from') else None
+            end_ts = int(datetime.fromisoformat(request.query['to']).timestamp()) if request.query.get('to') else None
+        except ValueError:
+            return web.json_response({'error': 'from / to 必须是 ISO 格式的日期时间'}, status=400)
+
+        identifiers = request.query.get('stocks', 'all')
+        if identifiers.lower() == 'all':
+            stock_ids = sorted(self.plugin.stocks)
+        else:
+            stock_ids = []
+            for identifier in filter(None, (i.strip() for i in identifiers.split(','))):
+                stock = await self.plugin.find_stock(identifier)
+                if not stock:
+                    return web.json_response({'error': f'Stock with identifier "{identifier}" not found'}, status=404)
+                stock_ids.append(stock.stock_id)
+        if not stock_ids:
+            return web.json_response({'error': '没有可导出的股票'}, status=400)
+
+        # 每支股票每个周期最多一根K线，按区间长度估算行数上限
+        end_ts = end_ts or int(time.time())
+        max_span = EXPORT_MAX_ROWS // len(stock_ids) * KLINE_INTERVAL_SECONDS[interval]
+        if start_ts is None:
+            start_ts = end_ts - max_span
+        elif end_ts - start_ts > max_span:
+            return web.json_response({'error': f'导出区间过大: {len(stock_ids)} 支股票的 {interval} K线单次最多导出 '
+                                               f'{max_span // 86400} 天，请缩小 from / to 区间或减少股票数'}, status=400)
+
+        filename = f"kline_{interval}_{datetime.now():%Y%m%d%H%M%S}.{fmt}"
+        response = web.StreamResponse(headers={
+            'Content-Type': f'{EXPORT_CONTENT_TYPES[fmt]}; charset=utf-8',
+            'Content-Disposition': f'attachment; filename="{filename}"',
+        })
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        async for chunk in iter_kline_export(self.plugin.db_manager, stock_ids, start_ts, end_ts, interval, fmt):
+            await response.write(chunk.encode())
+        await response.write_eof()
+        return response
+
     async def _api_get_ranking(self, request: web.Request):
         limit = int(request.query.get('limit', 10))
         ranking_data = await self.plugin.get_total_asset_ranking(limit)
@@ -445,6 +722,10 @@ class WebServer:
         except (KeyError, ValueError, json.JSONDecodeError) as e:
             return web.json_response({'error': f'无效的请求体: {e}'}, status=400)
 
+    @staticmethod
+    def _hasher_busy_response() -> web.Response:
+        return web.json_response({'error': '服务器繁忙，请稍后再试'}, status=503, headers={'Retry-After': '1'})
+
     async def _api_auth_register(self, request: web.Request):
         try:
             data = await request.json()
@@ -461,9 +742,11 @@ class WebServer:
                 code = f"{random.randint(100000, 999999)}"
 
             self.plugin.pending_verifications[code] = {
-                'login_id': login_id, 'password_hash': pwd_context.hash(password), 'timestamp': datetime.now()
+                'login_id': login_id, 'password_hash': await self.password_hasher.hash(password), 'timestamp': datetime.now()
             }
             return web.json_response({'success': True, 'verification_code': code})
+        except HasherBusyError:
+            return self._hasher_busy_response()
         except Exception as e:
             logger.error(f"发起注册时发生错误: {e}", exc_info=True)
             return web.json_response({'error': '服务器内部错误'}, status=500)
@@ -475,15 +758,18 @@ class WebServer:
 
             user_record = await self.plugin.db_manager.get_user_by_login_id(login_id)
 
-            if not user_record or not pwd_context.verify(password, user_record['password_hash']):
+            if not user_record or not await self.password_hasher.verify(password, user_record['password_hash']):
                 return web.json_response({'error': '登录名或密码错误'}, status=401)
 
             qq_user_id = user_record['user_id']
             expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRATION_MINUTES)
-            payload = {'sub': qq_user_id, 'login_id': login_id, 'exp': expire}
+            # iat 保留小数秒，与重置密码时记录的撤销时间比较时不会因取整误判
+            payload = {'sub': qq_user_id, 'login_id': login_id, 'iat': time.time(), 'exp': expire}
             token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
             return web.json_response({'access_token': token, 'token_type': 'bearer', 'user_id': qq_user_id, 'login_id': login_id})
+        except HasherBusyError:
+            return self._hasher_busy_response()
         except Exception as e:
             logger.error(f"登录时发生错误: {e}", exc_info=True)
             return web.json_response({'error': '服务器内部错误'}, status=500)
@@ -561,12 +847,15 @@ class WebServer:
             if pending_request.get('login_id') != login_id:
                 return web.json_response({'error': '重置码与用户ID不匹配'}, status=403)
 
-            new_password_hash = pwd_context.hash(new_password)
+            new_password_hash = await self.password_hasher.hash(new_password)
             await self.plugin.db_manager.update_user_password(login_id, new_password_hash)
+            verified_tokens.revoke_login(login_id)
 
             del self.plugin.pending_password_resets[code]
             logger.info(f"登录ID '{login_id}' 的密码已成功重置。")
             return web.json_response({'success': True, 'message': '密码重置成功！'})
+        except HasherBusyError:
+            return self._hasher_busy_response()
         except Exception as e:
             logger.error(f"重置密码时出错: {e}", exc_info=True)
             return web.json_response({'error': '服务器内部错误'}, status=500)
\ No newline at end of file